@@ -1,4 +1,4 @@
-from typing import Union, List
+from typing import Union, List, Optional
 
 from ..incremental_parse import IncrementalParser, ParseFailure, SpecialToken
 from ..incremental_parse import EmptyTokenGroup
@@ -22,6 +22,61 @@ class SyntaxConstraint:
         except ParseFailure:
             return False
         
+    def copy(self) -> "SyntaxConstraint":
+        return SyntaxConstraint(self.parser.copy())
+
+    r"""
+    Returns the number of leading sequences in `draft` that can be appended to the current
+    parse state, appending them in order to a single copy of the parser"""
+    def valid_prefix_length(self, draft: List[Union[List[str], "SpecialToken"]]) -> int:
+        parser_copy = self.parser.copy()
+        for i, chars in enumerate(draft):
+            if not chars:
+                return i
+            try:
+                parser_copy.append(chars)
+            except ParseFailure:
+                return i
+        return len(draft)
+
+    def fingerprint(self):
+        return self.parser.fingerprint()
+
+    def is_complete(self) -> bool:
+        return self.parser.is_complete()
+
+    def get_completion(self) -> Optional[str]:
+        return self.parser.get_completion()
+
+    r"""
+    Returns the longest valid prefix of `text`, appended to the current parse state, followed by the
+    shortest string that completes it. Used to salvage truncated outputs without regenerating them.
+    Returns None if the parser can't provide a completion"""
+    def salvage(self, text: str) -> Optional[str]:
+        parser_copy = self.parser.copy()
+        valid_length = 0
+        for char in text:
+            try:
+                parser_copy.append(char)
+            except ParseFailure:
+                # a failed append may leave the parser partially updated, so replay the valid prefix
+                parser_copy = self.parser.copy()
+                parser_copy.append(text[:valid_length])
+                break
+            valid_length += 1
+        if parser_copy.is_complete():  # nothing to complete, only the invalid tail is dropped
+            return text[:valid_length]
+        completion = parser_copy.get_completion()
+        if completion is None:
+            return None
+        return text[:valid_length] + completion
+
+    def reachable_states(self) -> Optional[List["SyntaxConstraint"]]:
+        states = self.parser.reachable_states()
+        if states is None:
+            return None
+        return [SyntaxConstraint(parser) for parser in states]
+
     def get_next(self) -> List[str]:
         return self.parser.get_next()
         
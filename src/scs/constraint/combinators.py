@@ -0,0 +1,21 @@
+from . import SyntaxConstraint
+
+from ..incremental_parse.combinators import SequenceParser, AlternationParser, IntersectionParser
+
+
+def sequence(*constraints: SyntaxConstraint) -> SyntaxConstraint:
+    return SyntaxConstraint(
+        SequenceParser(parsers=[constraint.parser for constraint in constraints])
+    )
+
+
+def alternation(*constraints: SyntaxConstraint) -> SyntaxConstraint:
+    return SyntaxConstraint(
+        AlternationParser(parsers=[constraint.parser for constraint in constraints])
+    )
+
+
+def intersection(*constraints: SyntaxConstraint) -> SyntaxConstraint:
+    return SyntaxConstraint(
+        IntersectionParser(parsers=[constraint.parser for constraint in constraints])
+    )
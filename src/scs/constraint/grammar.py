@@ -0,0 +1,11 @@
+from typing import Optional
+
+from . import SyntaxConstraint
+
+from ..incremental_parse.grammar import GrammarParser, compile_grammar
+
+
+def grammar(ebnf: str, start: Optional[str] = None) -> SyntaxConstraint:
+    return SyntaxConstraint(
+        GrammarParser(grammar=compile_grammar(ebnf, start=start))
+    )
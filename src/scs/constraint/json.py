@@ -1,8 +1,11 @@
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
+
 from . import SyntaxConstraint
 
 from ..incremental_parse.json import JSONParser
-from ..incremental_parse.json.parser import JSONParser as ConstrainedParser
-from ..incremental_parse.json.schema import JSONSchemaParser
+from ..incremental_parse.json.parser import JSONParser as ConstrainedParser, UnionParser
+from ..incremental_parse.json.schema import JSONSchemaParser, JSONSchema, UnionSchema, intern_schema
 
 
 def valid_json(
@@ -21,10 +24,41 @@ def valid_json(
     )
 
 
-def force_json_schema(schema: str) -> SyntaxConstraint:
-    schema_parser = JSONSchemaParser()
+@lru_cache(maxsize=64)
+def compile_json_schema(schema: str, ordered_keys: bool = False) -> JSONSchema:
+    schema_parser = JSONSchemaParser(ordered_keys=ordered_keys)
     schema_parser.append(schema)
-    json_schema = schema_parser.get_schema()
+    return intern_schema(schema_parser.get_schema())
+
+
+@lru_cache(maxsize=64)
+def compile_json_union(
+    schemas: Tuple[str],
+    ordered_keys: bool = False,
+    discriminator: Optional[str] = None,
+) -> UnionSchema:
+    alternatives = [compile_json_schema(schema, ordered_keys=ordered_keys) for schema in schemas]
+    return intern_schema(UnionSchema(alternatives=alternatives, discriminator=discriminator))
+
+
+r"""
+Constrains output to JSON following `schema`, or any of the schemas in a list. With
+`ordered_keys`, object keys must appear in the order they are declared in (optional keys may
+still be skipped), which lets entire key spans be forced instead of sampled. With
+`discriminator`, every schema must be an object with that required key, which must come first"""
+def force_json_schema(
+    schema: Union[str, List[str]],
+    ordered_keys: bool = False,
+    discriminator: Optional[str] = None,
+) -> SyntaxConstraint:
+    # compiled schemas are shared (and never modified) by every constraint using them
+    if isinstance(schema, str) and discriminator is None:
+        json_schema = compile_json_schema(schema, ordered_keys=ordered_keys)
+        return SyntaxConstraint(
+            ConstrainedParser(schema=json_schema)
+        )
+    schemas = (schema,) if isinstance(schema, str) else tuple(schema)
+    union_schema = compile_json_union(schemas, ordered_keys=ordered_keys, discriminator=discriminator)
     return SyntaxConstraint(
-        ConstrainedParser(schema=json_schema)
+        UnionParser(schema=union_schema)
     )
@@ -0,0 +1,9 @@
+from . import SyntaxConstraint
+
+from ..incremental_parse.regex import RegexParser
+
+
+def regex(pattern: str) -> SyntaxConstraint:
+    return SyntaxConstraint(
+        RegexParser(pattern=pattern)
+    )
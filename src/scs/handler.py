@@ -1,29 +1,41 @@
 from concurrent.futures.thread import ThreadPoolExecutor
-from concurrent.futures import Future, as_completed
-from typing import List, Iterable, Tuple, Optional, Dict, Type, Union
+from concurrent.futures import Executor, Future, as_completed
+from collections import Counter, OrderedDict
+from typing import List, Iterable, Tuple, Optional, Dict, Type, Union, Hashable, Callable
 from dataclasses import dataclass
+import asyncio
 import numpy as np
 
 from .constraint import SyntaxConstraint
+from .mask import TokenMask, AllowList, compact_mask
 from .constraint.json import valid_json, force_json_schema
 from .constraint.one_of import one_of
-from .incremental_parse.json.parser import NonNumericTokenGroup, InvalidFloatTokenGroup, BeginWithNonJsonCharGroup, NoQuoteCharGroup, NumericTokenGroup
-from .incremental_parse.string_match import NonAlnumGroup
-from .incremental_parse import TokenGroup, AllTokenGroup, EmptyTokenGroup
+from .constraint.regex import regex
+from .constraint.grammar import grammar
+from .constraint.combinators import sequence, alternation, intersection
+from .incremental_parse.combinators import SequenceParser, AlternationParser, IntersectionParser
+from .incremental_parse.grammar import GrammarParser
+from .incremental_parse import IncrementalParser, TokenGroup, ParseFailure, SpecialToken
+from .vocab import TOKEN_GROUPS, VocabSplit, VocabularyIndex, make_vocab_splits, vocabulary_index
 
 
-TOKEN_GROUPS = [
-    AllTokenGroup, EmptyTokenGroup, NonNumericTokenGroup, InvalidFloatTokenGroup, BeginWithNonJsonCharGroup, NonAlnumGroup, NoQuoteCharGroup, NumericTokenGroup
-]
+def _nucleus(scores: np.ndarray, top_k: Optional[int] = None, top_p: Optional[float] = None) -> np.ndarray:
+    order = np.argsort(-scores, kind="stable")
+    if top_k is not None:
+        order = order[:top_k]
+    if top_p is not None and len(order) > 0:
+        probs = np.exp(scores[order] - scores[order[0]])
+        cumulative = np.cumsum(probs / probs.sum())
+        # keep the smallest prefix whose probability mass reaches top_p
+        order = order[:int(np.searchsorted(cumulative, top_p)) + 1]
+    return order
 
 
-def make_vocab_splits(vocab: List[str], *token_group_types: Type[TokenGroup]) -> Dict[Type, "VocabSplit"]:
-    split_dict = {}
-    for T in token_group_types:
-        split = VocabSplit()
-        split.filter_vocab(vocab, grouping=T)
-        split_dict[T] = split
-    return split_dict
+def _state_key(check: SyntaxConstraint) -> Hashable:
+    fingerprint = check.fingerprint()
+    if fingerprint is None:  # parse state can't be compared, only share masks for the same check
+        return id(check)
+    return (SyntaxConstraint, fingerprint)
 
 
 def _check_token_batched(
@@ -63,58 +75,781 @@ class OneOfValidityCheckFactory(SyntaxValidityCheckFactory):
         return one_of(**self._init_kwargs)
 
 
+class RegexCheckFactory(SyntaxValidityCheckFactory):
+
+    def __call__(self) -> SyntaxConstraint:
+        return regex(**self._init_kwargs)
+
+
+class GrammarCheckFactory(SyntaxValidityCheckFactory):
+
+    def __call__(self) -> SyntaxConstraint:
+        return grammar(**self._init_kwargs)
+
+
+class SequenceCheckFactory(SyntaxValidityCheckFactory):
+
+    def __init__(self, *factories: SyntaxValidityCheckFactory):
+        super().__init__()
+        self._factories = factories
+
+    def __call__(self) -> SyntaxConstraint:
+        return sequence(*(factory() for factory in self._factories))
+
+
+class AlternationCheckFactory(SequenceCheckFactory):
+
+    def __call__(self) -> SyntaxConstraint:
+        return alternation(*(factory() for factory in self._factories))
+
+
+class IntersectionCheckFactory(SequenceCheckFactory):
+
+    def __call__(self) -> SyntaxConstraint:
+        return intersection(*(factory() for factory in self._factories))
+
+
 class SyntaxValidityCheckHandler:
 
     def __init__(
         self,
-        token_vocab: List[str],
+        token_vocab: Union[List[str], VocabularyIndex],
         check_factory: SyntaxValidityCheckFactory,
         num_workers: int = 2,
         begin_first_check: bool = True,
+        eos_token_id: Optional[int] = None,
+        max_new_tokens: Optional[int] = None,
+        budget_margin: int = 16,
+        mask_cache_size: int = 1024,
+        mask_cache: Optional["OrderedDict[Hashable, Union[np.ndarray, TokenMask]]"] = None,
     ):
         self._executor = None #ThreadPoolExecutor(max_workers=num_workers)
         self._num_workers = num_workers
         self._batch_size = len(token_vocab) // num_workers
-        self._active_futures: List[Future] = []
+        self._active_futures: List[Union[Future, asyncio.Future]] = []
         self._initialized = False
-        self._token_vocab = token_vocab
-        self._vocab_map = {t: i for i, t in enumerate(token_vocab) if isinstance(t, str)}
-        self._vocab_splits = make_vocab_splits(token_vocab, *TOKEN_GROUPS)
+        # vocab structures are shared with every handler built from the same index
+        self._vocab_index = vocabulary_index(token_vocab)
+        self._token_vocab = self._vocab_index.token_vocab
+        self._vocab_map = self._vocab_index.vocab_map
+        self._eos_token_id = eos_token_id
+        self._max_token_length = self._vocab_index.max_token_length
+        self._token_budget = max_new_tokens
+        self._budget_margin = budget_margin
+        # masks of recently seen parse states, keyed by fingerprint, reused across steps and rows.
+        # handlers over the same vocab and EOS token may share a cache
+        self._mask_cache: "OrderedDict[Hashable, Union[np.ndarray, TokenMask]]" = OrderedDict() if mask_cache is None else mask_cache
+        self._mask_cache_size = mask_cache_size
+        # masks of every state of the constraint, computed up front and kept apart from the cache
+        self._precomputed_masks: Dict[Hashable, np.ndarray] = {}
         self._check_factory = check_factory
         self._active_checks = [check_factory()]  # initialize single check to constrain start tokens
+        # copies of active checks advanced with candidate tokens, by (id of the check, token id)
+        self._prefetched: Dict[Tuple[int, int], Tuple[SyntaxConstraint, Future]] = {}
         if begin_first_check:
             self.process_invalid_next_tokens()
 
+    @property
+    def eos_token_id(self) -> Optional[int]:
+        return self._eos_token_id
+
+    @property
+    def vocab_index(self) -> VocabularyIndex:
+        return self._vocab_index
+
     r"""
     Yield tokens from each invalid group"""
     def await_invalid_next_tokens(self) -> Union[List[Tuple[int, int]], Iterable[Tuple[int, int]]]:
+        results = {}
         for check_idx, check in enumerate(self._active_checks):
-            next_tokens = check.get_next()
-            if next_tokens:
-                for t in next_tokens:
-                    for i in range(min(6, len(t)), 0, -1):
-                        if t[:i] in self._vocab_map:
-                            yield check_idx, self._vocab_map[t[:i]], False
-                            break
-                return
-                
-            toks_to_check = np.ones(len(self._token_vocab)).astype(np.bool_)
-            suppress_tokens, allow_tokens = [], []
-            invalid_vocab_split = self._vocab_splits.get(check.invalid_token_group())
-            if invalid_vocab_split:
-                suppress_tokens = invalid_vocab_split.filtered
-            for token_id, token in suppress_tokens:
+            state = _state_key(check)
+            if state in results:  # same parse state as a previous row
+                for _, token_id, suppress in results[state]:
+                    yield check_idx, token_id, suppress
+                continue
+            results[state] = []
+            for result in self._invalid_next_tokens(check_idx, check):
+                results[state] += [result]
+                yield result
+
+    def _forced_token_ids(self, next_tokens: List[str]) -> List[int]:
+        token_ids = []
+        for t in next_tokens:
+            for i in range(min(self._max_token_length, len(t)), 0, -1):
+                if t[:i] in self._vocab_map:
+                    token_ids += [self._vocab_map[t[:i]]]
+                    break
+            else:  # forcing the other sequences would rule this one out
+                return []
+        return token_ids
+
+    def _eos_valid(self, check: SyntaxConstraint) -> bool:
+        return check.check_next([SpecialToken.EOS])
+
+    r"""
+    Returns the only token ids allowed next for `check`, or None if generation isn't forced.
+    Once the check is complete only EOS is allowed."""
+    def _forced_next_ids(self, check: SyntaxConstraint) -> Optional[List[int]]:
+        eos_token_id = self._eos_token_id
+        if eos_token_id is not None and check.is_complete():
+            return [eos_token_id]
+        next_tokens = check.get_next()
+        if not next_tokens:
+            return None
+        token_ids = self._forced_token_ids(next_tokens)
+        if not token_ids:  # no token begins any of the forced sequences
+            return None
+        if eos_token_id is not None and self._eos_valid(check):
+            token_ids += [eos_token_id]
+        return token_ids
+
+    def _vocab_split(self, group: Optional[Type[TokenGroup]]) -> Optional[VocabSplit]:
+        return self._vocab_index.split(group)
+
+    r"""
+    Sets the number of tokens that may still be generated, including the next one. Once the
+    budget comes within `budget_margin` tokens of the number needed to complete the output,
+    only tokens that leave room for a valid completion are allowed. Set to None to disable."""
+    def set_token_budget(self, remaining_tokens: Optional[int]):
+        self._token_budget = remaining_tokens
+
+    r"""
+    Tokenizes `text` by greedily matching the longest vocab token at each position"""
+    def _tokenize(self, text: str) -> Optional[List[int]]:
+        token_ids = []
+        pos = 0
+        while pos < len(text):
+            for end in range(min(len(text), pos + self._max_token_length), pos, -1):
+                token_id = self._vocab_map.get(text[pos:end])
+                if token_id is not None:
+                    token_ids += [token_id]
+                    pos = end
+                    break
+            else:
+                return None
+        return token_ids
+
+    def _completion_token_ids(self, check: SyntaxConstraint) -> Optional[List[int]]:
+        completion = check.get_completion()
+        if completion is None:
+            return None
+        return self._tokenize(completion)
+
+    r"""
+    Returns whether the output can still be completed within the budget after `token_id`.
+    Completion lengths are memoized in `completion_lengths` by the fingerprint of the state the
+    token leads to, as tokens ending a value often lead to the same state"""
+    def _fits_budget(self, check: SyntaxConstraint, token_id: int, completion_lengths: Optional[dict] = None) -> bool:
+        check_copy = check.copy()
+        self._update_check(check_copy, token_id)
+        fingerprint = check_copy.fingerprint() if completion_lengths is not None else None
+        if fingerprint is None or fingerprint not in completion_lengths:
+            completion = self._completion_token_ids(check_copy)
+            length = None if completion is None else len(completion)
+            if fingerprint is not None:
+                completion_lengths[fingerprint] = length
+        else:
+            length = completion_lengths[fingerprint]
+        return length is not None and length <= self._token_budget - 1
+
+    r"""
+    Returns the tokens of the shortest completion for `check` if the token budget is close to
+    running out, otherwise None"""
+    def _budget_completion(self, check: SyntaxConstraint) -> Optional[List[int]]:
+        if self._token_budget is None or check.is_complete():
+            return None
+        completion = self._completion_token_ids(check)
+        if not completion or self._token_budget - len(completion) > self._budget_margin:
+            return None
+        return completion
+
+    def _invalid_next_tokens(self, check_idx: int, check: SyntaxConstraint) -> Iterable[Tuple[int, int, bool]]:
+        completion = self._budget_completion(check)
+        if completion is None:
+            yield from self._unbudgeted_invalid_next_tokens(check_idx, check)
+            return
+
+        if self._token_budget <= len(completion):  # only the shortest completion still fits
+            yield check_idx, completion[0], False
+            return
+        # close to the end of the budget: tokens must leave room to complete the output
+        results = list(self._unbudgeted_invalid_next_tokens(check_idx, check))
+        allowed = [token_id for _, token_id, suppress in results if not suppress]
+        if allowed:  # forced tokens
+            allowed = [token_id for token_id in allowed if self._fits_budget(check, token_id)]
+            for token_id in allowed or completion[:1]:
+                yield check_idx, token_id, False
+            return
+        mask = np.zeros(len(self._token_vocab), dtype=np.bool_)
+        for result in results:
+            mask[result[1]] = True
+            yield result
+        # tokens of the valid group continue the current value, which leaves its completion as is,
+        # and the completion fits as the budget is past it. Only tokens that may end it are checked
+        valid_vocab_split = self._vocab_split(check.valid_token_group())
+        if valid_vocab_split:
+            mask[valid_vocab_split.filtered_mask] = True
+        completion_lengths = {}
+        for token_id in np.where(~mask)[0]:
+            if not self._fits_budget(check, token_id, completion_lengths):
+                yield check_idx, token_id, True
+
+    def _unbudgeted_invalid_next_tokens(self, check_idx: int, check: SyntaxConstraint, force: bool = True) -> Iterable[Tuple[int, int, bool]]:
+        forced_ids = self._forced_next_ids(check) if force else None
+        if forced_ids is not None:
+            for token_id in forced_ids:
+                yield check_idx, token_id, False
+            return
+        combined_mask = self._combined_invalid_mask(check)
+        if combined_mask is None:
+            combined_mask = self._walked_invalid_mask(check)
+        if combined_mask is not None:
+            for token_id in np.where(combined_mask)[0]:
                 yield check_idx, token_id, True
-                toks_to_check[token_id] = False
-            valid_vocab_split = self._vocab_splits.get(check.valid_token_group())
-            if valid_vocab_split:
-                allow_tokens = valid_vocab_split.filtered
-            for token_id, token in allow_tokens:
-                toks_to_check[token_id] = False
-            for token_id in np.where(toks_to_check)[0]:
+            return
+
+        suppress_ids, toks_to_check = self._split_scan(check)
+        for token_id in suppress_ids:
+            yield check_idx, token_id, True
+        for token_id in np.where(toks_to_check)[0]:
+            token = self._token_vocab[token_id]
+            if not check.check_next(token):
+                yield check_idx, token_id, True
+        eos_token_id = self._eos_token_id
+        if eos_token_id is not None and not self._eos_valid(check):
+            yield check_idx, eos_token_id, True
+
+    r"""
+    Splits the vocab scan for `check` using its token groups. Returns the ids of tokens in its
+    invalid group, and a mask of the tokens neither group decides, which are checked one by one.
+    EOS is in neither, as it's checked separately from its token string"""
+    def _split_scan(self, check: SyntaxConstraint) -> Tuple[List[int], np.ndarray]:
+        toks_to_check = np.ones(len(self._token_vocab)).astype(np.bool_)
+        eos_token_id = self._eos_token_id
+        if eos_token_id is not None:
+            toks_to_check[eos_token_id] = False
+        suppress_ids = []
+        invalid_vocab_split = self._vocab_split(check.invalid_token_group())
+        if invalid_vocab_split:
+            suppress_ids = [token_id for token_id, _ in invalid_vocab_split.filtered if token_id != eos_token_id]
+            toks_to_check[invalid_vocab_split.filtered_mask] = False
+        valid_vocab_split = self._vocab_split(check.valid_token_group())
+        if valid_vocab_split:
+            toks_to_check[valid_vocab_split.filtered_mask] = False
+        return suppress_ids, toks_to_check
+
+    r"""
+    Returns whether each active check is complete, meaning that its output can't be
+    continued and generation for the corresponding row can be stopped"""
+    def completed_checks(self) -> List[bool]:
+        return [check.is_complete() for check in self._active_checks]
+
+    r"""
+    Returns, for each active check, the shortest string that validly completes the output generated
+    so far, or None if its parser can't provide one. Appending it salvages an output cut short by a
+    length limit or timeout"""
+    def get_completions(self) -> List[Optional[str]]:
+        return [check.get_completion() for check in self._active_checks]
+
+    r"""
+    Returns a boolean mask over the vocab marking every token that may not be sampled next
+    for the check at `check_idx`"""
+    def invalid_next_token_mask(self, check_idx: int = 0) -> np.ndarray:
+        return self._invalid_mask(self._active_checks[check_idx]).copy()
+
+    r"""
+    Returns the value cached for a parse state, computing and caching it if it isn't cached. Masks
+    of recently seen parse states are kept in an LRU cache; cached arrays are read-only. States that
+    can't be cached are passed as None."""
+    def _cached(self, state: Optional[Hashable], compute: Callable[[], object]):
+        value = self._cache_lookup(state)
+        if value is None:
+            value = self._cache_store(state, compute())
+        return value
+
+    r"""
+    Returns the value cached or precomputed for a parse state, or None. Handlers computing masks
+    in other threads may share the cache, so entries can be evicted between any two operations"""
+    def _cache_lookup(self, state: Optional[Hashable]):
+        if state is None:
+            return None
+        value = self._precomputed_masks.get(state)
+        if value is not None or self._mask_cache_size <= 0:
+            return value
+        value = self._mask_cache.get(state)
+        if value is not None:
+            try:
+                self._mask_cache.move_to_end(state)
+            except KeyError:  # evicted meanwhile
+                pass
+        return value
+
+    def _cache_store(self, state: Optional[Hashable], value):
+        if state is None or self._mask_cache_size <= 0:
+            return value
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        self._mask_cache[state] = value
+        while len(self._mask_cache) > self._mask_cache_size:
+            try:
+                self._mask_cache.popitem(last=False)
+            except KeyError:  # emptied meanwhile
+                break
+        return value
+
+    def _mask_state(self, check: SyntaxConstraint) -> Optional[Hashable]:
+        fingerprint = check.fingerprint()
+        # masks in the tight budget regime also depend on the remaining budget
+        cacheable = fingerprint is not None and self._budget_completion(check) is None
+        return (SyntaxConstraint, fingerprint) if cacheable else None
+
+    r"""
+    Returns the invalid mask for `check`, looking it up by fingerprint among the masks of recently
+    seen parse states. States within interned schemas (such as enum values and object keys) recur
+    across steps and requests, so their masks are only computed once. Cached masks are read-only."""
+    def _invalid_mask(self, check: SyntaxConstraint) -> np.ndarray:
+        return self._cached(self._mask_state(check), lambda: self._compute_invalid_mask(check))
+
+    r"""
+    Returns the invalid mask of a parser on its own, without forcing tokens, looking it up by
+    fingerprint like the masks of checks. Masks of combined constraints are built from these."""
+    def _parser_mask(self, parser: IncrementalParser) -> np.ndarray:
+        fingerprint = parser.fingerprint()
+        state = (IncrementalParser, fingerprint) if fingerprint is not None else None
+        return self._cached(state, lambda: self._compute_parser_mask(parser))
+
+    def _compute_parser_mask(self, parser: IncrementalParser) -> np.ndarray:
+        mask = np.zeros(len(self._token_vocab), dtype=np.bool_)
+        for _, token_id, _ in self._unbudgeted_invalid_next_tokens(0, SyntaxConstraint(parser), force=False):
+            mask[token_id] = True
+        return mask
+
+    r"""
+    Returns the mask of tokens that may not be sampled next for every active check, each in the
+    smallest form for the number of tokens it allows (see `scs.mask.compact_mask`): an allow-list
+    when few tokens are valid, such as forced punctuation, a deny-list when few are invalid, such
+    as inside strings, and a dense boolean mask otherwise. Rows in the same parse state share a
+    mask. Apply them to logits with `scs.mask.apply_masks`.
+
+    Parameters:
+        max_sparse (Optional[int]):
+            Largest number of token ids stored in a list, by default the size at which a list
+            becomes larger than the dense mask
+
+    Return:
+        (List[TokenMask]):
+        Mask for each active check"""
+    def next_token_masks(self, max_sparse: Optional[int] = None) -> List[TokenMask]:
+        masks = {}
+        rows = []
+        for check in self._active_checks:
+            state = _state_key(check)
+            if state not in masks:
+                masks[state] = self._token_mask(check, max_sparse)
+            rows += [masks[state]]
+        return rows
+
+    def _token_mask(self, check: SyntaxConstraint, max_sparse: Optional[int]) -> TokenMask:
+        fingerprint = check.fingerprint()
+        budgeted = self._budget_completion(check) is not None
+        state = (TokenMask, fingerprint, max_sparse) if fingerprint is not None and not budgeted else None
+        return self._cached(state, lambda: self._compute_token_mask(check, max_sparse, budgeted))
+
+    def _compute_token_mask(self, check: SyntaxConstraint, max_sparse: Optional[int], budgeted: bool) -> TokenMask:
+        forced_ids = None if budgeted else self._forced_next_ids(check)
+        if forced_ids is not None:  # no need to compute the dense mask
+            return AllowList(len(self._token_vocab), forced_ids)
+        return compact_mask(self._invalid_mask(check), max_sparse=max_sparse)
+
+    r"""
+    Returns the same masks as `next_token_masks` without blocking the event loop. Parse states
+    whose masks aren't cached are computed on `executor` (by default the loop's), and the vocab
+    scan of each state is split into batches of `batch_size` tokens, with at most `num_workers`
+    batches queued at a time. Sessions sharing an executor therefore take turns instead of
+    waiting for each other's whole scans, and masks of other sessions' states are served from a
+    shared cache.
+
+    The active checks must not be updated while masks are computed. `cancel_current_check`, or
+    cancelling the awaiting task, drops the batches not yet started and raises
+    `asyncio.CancelledError` in the awaiting task.
+
+    Parameters:
+        max_sparse (Optional[int]):
+            Passed to `scs.mask.compact_mask`
+        executor (Optional[Executor]):
+            Executor of the scans, which may be shared with other handlers
+        batch_size (int):
+            Number of tokens checked by each job
+
+    Return:
+        (List[TokenMask]):
+        Mask for each active check"""
+    async def next_mask(
+        self,
+        max_sparse: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        batch_size: int = 1024,
+    ) -> List[TokenMask]:
+        masks = {}
+        rows = []
+        for check in self._active_checks:
+            state = _state_key(check)
+            if state not in masks:
+                masks[state] = await self._atoken_mask(check, max_sparse, executor, batch_size)
+            rows += [masks[state]]
+        return rows
+
+    r"""
+    Updates the active checks like `update` without blocking the event loop, once masks still
+    being computed for the previous step are cancelled"""
+    async def aupdate(self, next_token_ids: List[int], *args, executor: Optional[Executor] = None, **kwargs):
+        self.cancel_current_check()
+        await asyncio.get_running_loop().run_in_executor(
+            executor, lambda: self.update(next_token_ids, *args, **kwargs),
+        )
+
+    async def _atoken_mask(
+        self,
+        check: SyntaxConstraint,
+        max_sparse: Optional[int],
+        executor: Optional[Executor],
+        batch_size: int,
+    ) -> TokenMask:
+        fingerprint = check.fingerprint()
+        budgeted = self._budget_completion(check) is not None
+        state = (TokenMask, fingerprint, max_sparse) if fingerprint is not None and not budgeted else None
+        mask = self._cache_lookup(state)
+        if mask is not None:
+            return mask
+        check = check.copy()  # scanned in other threads
+        forced_ids = None if budgeted else await self._submit(executor, lambda: self._forced_next_ids(check))
+        if forced_ids is not None:
+            mask = AllowList(len(self._token_vocab), forced_ids)
+        else:
+            mask = compact_mask(await self._ainvalid_mask(check, executor, batch_size), max_sparse=max_sparse)
+        return self._cache_store(state, mask)
+
+    r"""
+    Computes the invalid mask of a check whose next tokens aren't forced, checking the tokens its
+    token groups don't decide in batches"""
+    async def _ainvalid_mask(self, check: SyntaxConstraint, executor: Optional[Executor], batch_size: int) -> np.ndarray:
+        state = self._mask_state(check)
+        mask = self._cache_lookup(state)
+        if mask is not None:
+            return mask
+        mask, token_batch = await self._submit(executor, lambda: self._partial_invalid_mask(check))
+        running = set()
+
+        async def collect(max_running: int):
+            nonlocal running
+            while len(running) > max_running:
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    mask[future.result()] = True  # raises CancelledError for cancelled batches
+
+        try:
+            for start in range(0, len(token_batch), batch_size):
+                await collect(self._num_workers - 1)
+                batch = token_batch[start:start + batch_size]
+                running.add(self._submit(executor, lambda batch=batch: [
+                    token_id for _, token_id in _check_token_batched(check, 0, batch)
+                ]))
+            await collect(0)
+        finally:
+            for future in running:
+                future.cancel()
+        return self._cache_store(state, mask)
+
+    r"""
+    Returns a partial invalid mask of a check whose next tokens aren't forced, along with the
+    tokens left to check one by one, which may be checked in any order. Masks of combined
+    and grammar constraints and in the tight budget regime are computed whole."""
+    def _partial_invalid_mask(self, check: SyntaxConstraint) -> Tuple[np.ndarray, List[Tuple[int, str]]]:
+        parser = check.parser
+        if self._budget_completion(check) is not None or isinstance(parser, (SequenceParser, AlternationParser, IntersectionParser, GrammarParser)):
+            return self._compute_invalid_mask(check), []
+        mask = np.zeros(len(self._token_vocab), dtype=np.bool_)
+        suppress_ids, toks_to_check = self._split_scan(check)
+        mask[suppress_ids] = True
+        if self._eos_token_id is not None:
+            mask[self._eos_token_id] = not self._eos_valid(check)
+        return mask, [(token_id, self._token_vocab[token_id]) for token_id in np.where(toks_to_check)[0]]
+
+    def _submit(self, executor: Optional[Executor], job: Callable[[], object]) -> asyncio.Future:
+        future = asyncio.get_running_loop().run_in_executor(executor, job)
+        self._active_futures = [f for f in self._active_futures if not f.done()] + [future]
+        return future
+
+    r"""
+    Returns the invalid mask of a combined constraint from the masks of its parts, or None for
+    other constraints. A token is invalid for an alternation if it's invalid for every surviving
+    alternative, and for an intersection if it's invalid for any part. A token is invalid for a
+    sequence if it's invalid for every branch, except tokens that end one part and begin the next,
+    which are checked on their own. EOS is always checked against the combined constraint."""
+    def _combined_invalid_mask(self, check: SyntaxConstraint) -> Optional[np.ndarray]:
+        parser = check.parser
+        if isinstance(parser, AlternationParser):
+            mask = np.logical_and.reduce([self._parser_mask(alternative) for alternative in parser.alternatives])
+        elif isinstance(parser, IntersectionParser):
+            mask = np.logical_or.reduce([self._parser_mask(part) for part in parser.parsers])
+        elif isinstance(parser, SequenceParser):
+            mask = np.logical_and.reduce([self._parser_mask(branch) for _, branch in parser.branches])
+            self._allow_straddling_tokens(check, mask)
+        else:
+            return None
+        if self._eos_token_id is not None:
+            mask[self._eos_token_id] = not self._eos_valid(check)
+        return mask
+
+    r"""
+    Returns the invalid mask of a grammar constraint from a walk of the vocab's character trie,
+    which checks tokens sharing a prefix together instead of advancing a copy of the parser per
+    token, or None for other constraints"""
+    def _walked_invalid_mask(self, check: SyntaxConstraint) -> Optional[np.ndarray]:
+        parser = check.parser
+        if not isinstance(parser, GrammarParser):
+            return None
+        mask = np.ones(len(self._token_vocab), dtype=np.bool_)
+        mask[parser.valid_token_ids(self._vocab_index.token_trie())] = False
+        if self._eos_token_id is not None:
+            mask[self._eos_token_id] = not self._eos_valid(check)
+        return mask
+
+    r"""
+    Clears the mask of tokens that end a part of the sequence `check` partway through and begin
+    the next one. The masks of the parts can't tell these apart: such a token is invalid for the
+    part it ends, as its tail belongs to the next part, and invalid for the next part, as its head
+    doesn't, so the tokens masked by every part are re-checked against the whole sequence. Only
+    tokens whose first character continues a part that can be followed by another are candidates"""
+    def _allow_straddling_tokens(self, check: SyntaxConstraint, mask: np.ndarray):
+        parser: SequenceParser = check.parser
+        for index, branch in parser.branches:
+            if index == parser.num_parsers - 1:
+                continue
+            branch_check = SyntaxConstraint(branch)
+            first_char_valid = {}
+            for token_id in np.where(mask)[0]:
                 token = self._token_vocab[token_id]
-                if not check.check_next(token):
-                    yield check_idx, token_id, True
+                if token_id == self._eos_token_id or not isinstance(token, str) or len(token) < 2:
+                    continue
+                if token[0] not in first_char_valid:
+                    first_char_valid[token[0]] = branch_check.check_next(token[0])
+                if first_char_valid[token[0]] and check.check_next(token):
+                    mask[token_id] = False
+
+    r"""
+    Computes the invalid mask of every parse state reachable from the check at `check_idx` ahead
+    of generation, for constraints that can enumerate their states (such as regex DFAs). Masks
+    are then served at every step, whatever the vocab size. They're kept by the handler apart
+    from the mask cache, which may be shared, so they neither evict nor get evicted by cached
+    masks. Returns the number of states precomputed, or None if the constraint's states can't be
+    enumerated"""
+    def precompute_masks(self, check_idx: int = 0) -> Optional[int]:
+        states = self._active_checks[check_idx].reachable_states()
+        if states is None:
+            return None
+        for state in states:
+            key = self._mask_state(state)
+            if key is not None and key not in self._precomputed_masks:
+                mask = self._cache_lookup(key)
+                if mask is None:
+                    mask = self._compute_invalid_mask(state)
+                    mask.flags.writeable = False
+                self._precomputed_masks[key] = mask
+        return len(states)
+
+    def _compute_invalid_mask(self, check: SyntaxConstraint) -> np.ndarray:
+        mask = np.zeros(len(self._token_vocab), dtype=np.bool_)
+        allowed = []
+        for _, token_id, suppress in self._invalid_next_tokens(0, check):
+            if suppress:
+                mask[token_id] = True
+            else:
+                allowed += [token_id]
+        if allowed:
+            mask[:] = True
+            mask[allowed] = False
+        return mask
+
+    r"""
+    Returns a `(num_checks, vocab)` boolean mask of tokens that may not be sampled next for
+    every active check. Rows are grouped by parse state fingerprint and one mask is computed
+    per distinct state."""
+    def invalid_next_token_masks(self) -> np.ndarray:
+        masks = {}
+        rows = []
+        for check in self._active_checks:
+            state = _state_key(check)
+            if state not in masks:
+                masks[state] = self._invalid_mask(check)
+            rows += [masks[state]]
+        return np.stack(rows)
+
+    r"""
+    Verifies a sequence of draft token ids proposed for the check at `check_idx`. A single pass of
+    a check copy walks the draft, computing the invalid mask of each state it reaches and stopping
+    at the first token that mask rules out. Returns the length of the longest valid prefix of the
+    draft, along with the invalid mask at each position of that prefix and at the position
+    following it (shape `(prefix_length + 1, vocab)`). Ids outside the vocab are rejected. The
+    active check is not updated."""
+    def verify_draft(self, draft_token_ids: List[int], check_idx: int = 0) -> Tuple[int, np.ndarray]:
+        check = self._active_checks[check_idx].copy()
+        token_budget = self._token_budget
+        masks = []
+        try:
+            for token_id in draft_token_ids:
+                masks += [self._invalid_mask(check)]
+                if not 0 <= token_id < len(self._token_vocab) or masks[-1][token_id]:
+                    return len(masks) - 1, np.stack(masks)
+                self._update_check(check, token_id)
+                self._consume_token_budget()
+            masks += [self._invalid_mask(check)]
+            return len(draft_token_ids), np.stack(masks)
+        finally:
+            self._token_budget = token_budget
+
+    def _row_checks(self, num_rows: int) -> List[SyntaxConstraint]:
+        if not self._initialized and len(self._active_checks) < num_rows:
+            # before the first update every row shares the initial check
+            return [self._active_checks[0]] * num_rows
+        return self._active_checks[:num_rows]
+
+    def _is_valid_next(self, check: SyntaxConstraint, token_id: int) -> bool:
+        if token_id == self._eos_token_id:
+            return self._eos_valid(check)
+        token = self._token_vocab[token_id]
+        if not isinstance(token, str):
+            return False
+        invalid_vocab_split = self._vocab_split(check.invalid_token_group())
+        if invalid_vocab_split and invalid_vocab_split.filtered_mask[token_id]:
+            return False
+        valid_vocab_split = self._vocab_split(check.valid_token_group())
+        if valid_vocab_split and valid_vocab_split.filtered_mask[token_id]:
+            return True
+        return check.check_next(token)
+
+    def _first_valid_candidate(self, check: SyntaxConstraint, scores: np.ndarray, candidate_ids: np.ndarray) -> Optional[int]:
+        if self._budget_completion(check) is not None:
+            mask = self._invalid_mask(check)
+            valid_ids = [i for i in candidate_ids if not mask[i]]
+            return int(valid_ids[0]) if valid_ids else None
+        forced_ids = self._forced_next_ids(check)
+        if forced_ids is not None:
+            forced = [i for i in forced_ids if i < len(scores)]
+            if forced:
+                return max(forced, key=lambda i: scores[i])
+            return None
+        for token_id in candidate_ids:
+            if self._is_valid_next(check, token_id):
+                return int(token_id)
+        return None
+
+    r"""
+    Greedy selection without computing the full mask. For each row of `logits` returns the
+    highest scoring token that is valid under the corresponding check, validating candidates
+    in descending score order and stopping at the first valid one."""
+    def next_valid_tokens(self, logits: np.ndarray, lookahead: int = 16) -> List[int]:
+        logits = np.atleast_2d(np.asarray(logits))[:, :len(self._token_vocab)]
+        next_token_ids = []
+        for scores, check in zip(logits, self._row_checks(len(logits))):
+            k = min(lookahead, len(scores))
+            top_k = np.argpartition(-scores, k - 1)[:k]
+            top_k = top_k[np.argsort(-scores[top_k], kind="stable")]
+            token_id = self._first_valid_candidate(check, scores, top_k)
+            if token_id is None and k < len(scores):
+                rest = np.argsort(-scores, kind="stable")[k:]
+                token_id = self._first_valid_candidate(check, scores, rest)
+            if token_id is None:
+                raise ParseFailure("No valid next token for current parse state")
+            next_token_ids += [token_id]
+        return next_token_ids
+
+    r"""
+    Returns a boolean mask of shape `logits.shape` marking tokens to suppress when sampling
+    from the top-k/top-p nucleus of `logits`. Only candidates inside the nucleus are validated;
+    the full invalid mask is computed for a row only if every one of its candidates is invalid."""
+    def invalid_candidate_mask(
+        self,
+        logits: np.ndarray,
+        top_k: Optional[int] = None,
+        top_p: Optional[float] = None,
+    ) -> np.ndarray:
+        logits = np.atleast_2d(np.asarray(logits))
+        vocab_size = min(logits.shape[1], len(self._token_vocab))
+        mask = np.ones(logits.shape, dtype=np.bool_)
+        for row, (scores, check) in enumerate(zip(logits, self._row_checks(len(logits)))):
+            candidate_ids = _nucleus(scores[:vocab_size], top_k=top_k, top_p=top_p)
+            if self._budget_completion(check) is not None:
+                full_mask = self._invalid_mask(check)
+                valid_ids = [i for i in candidate_ids if not full_mask[i]]
+            else:
+                forced_ids = self._forced_next_ids(check)
+                if forced_ids is not None:
+                    forced = set(forced_ids)
+                    valid_ids = [i for i in candidate_ids if i in forced]
+                else:
+                    valid_ids = [i for i in candidate_ids if self._is_valid_next(check, i)]
+            if valid_ids:
+                mask[row, valid_ids] = False
+            else:
+                mask[row, :vocab_size] = self._invalid_mask(check)[:vocab_size]
+        return mask
+
+    r"""
+    Speculatively advances copies of the active checks with likely next tokens and computes the
+    masks that would follow them in the background, while the model computes the current step's
+    logits. If a sampled token was prefetched, `update` promotes its advanced copy instead of
+    advancing the check, and the next masks are served from the cache. Prefetches that weren't
+    sampled are discarded at `update`.
+
+    Parameters:
+        candidate_ids (List[List[int]]):
+            Candidate next token ids of each row, such as the top-k tokens of its masked logits
+        max_sparse (Optional[int]):
+            Passed to `next_token_masks`
+        executor (Optional[Executor]):
+            Executor of the background jobs, by default a pool of `num_workers` threads owned
+            by the handler"""
+    def prefetch(
+        self,
+        candidate_ids: List[List[int]],
+        max_sparse: Optional[int] = None,
+        executor: Optional[Executor] = None,
+    ):
+        if executor is None:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._num_workers)
+            executor = self._executor
+        for check, row_candidates in zip(self._row_checks(len(candidate_ids)), candidate_ids):
+            for token_id in row_candidates:
+                key = (id(check), int(token_id))
+                if key not in self._prefetched:
+                    # the check is kept alongside its job so that its id isn't reused
+                    future = executor.submit(self._advance_copy, check.copy(), int(token_id), max_sparse)
+                    self._prefetched[key] = (check, future)
+
+    def _advance_copy(self, check: SyntaxConstraint, token_id: int, max_sparse: Optional[int]) -> Optional[SyntaxConstraint]:
+        try:
+            self._update_check(check, token_id)
+        except ParseFailure:  # the token isn't valid, update raises as usual if it's sampled
+            return None
+        self._token_mask(check, max_sparse)
+        return check
+
+    r"""
+    Returns the prefetched copy of `check` advanced with `token_id`, or None if the token wasn't
+    prefetched. Jobs that haven't started yet are cancelled, as advancing the check now costs the
+    same, and running jobs are waited for."""
+    def _take_prefetched(self, check: SyntaxConstraint, token_id: int) -> Optional[SyntaxConstraint]:
+        prefetched = self._prefetched.pop((id(check), token_id), None)
+        if prefetched is None or prefetched[1].cancel():
+            return None
+        return prefetched[1].result()
+
+    def _discard_prefetched(self):
+        for _, future in self._prefetched.values():
+            future.cancel()
+        self._prefetched = {}
 
     def process_invalid_next_tokens(self):
         pass
@@ -149,30 +884,74 @@ class SyntaxValidityCheckHandler:
 
     r"""
     Updates parsers for all active checks with next sampled token for the corresponding generation.
-    If this is the first sample step, initialize a check for each element in batch"""
-    def update(self, next_token_ids: List[int], begin_next_check: bool = True):
+    If this is the first sample step, initialize a check for each element in batch. Checks of
+    `skip_rows` (rows that already generated EOS) are left as they are"""
+    def update(self, next_token_ids: List[int], begin_next_check: bool = True, skip_rows: Iterable[int] = ()):
+        self._consume_token_budget()
         next_token_id = next_token_ids[0]  # currently only supports single-beam and greedy
         # print(next_token_id)
         # print(f"Next token: {next_token_id}, {repr(self._token_vocab[next_token_id])}")
         if not self._initialized:  # this is the first sampling step
             self._active_checks += [self._check_factory() for _ in range(len(next_token_ids) - 1)]
-        for token_id, check in zip(next_token_ids, self._active_checks):
-            check.update_parser(self._token_vocab[token_id])
+            self._initialized = True
+        skip_rows = set(skip_rows)  # rows that already ended, whose tokens are padding
+        for row, (token_id, check) in enumerate(zip(next_token_ids, self._active_checks)):
+            if row in skip_rows:
+                continue
+            prefetched = self._take_prefetched(check, token_id)
+            if prefetched is not None:
+                self._active_checks[row] = prefetched
+            else:
+                self._update_check(check, token_id)
+        self._discard_prefetched()
         if begin_next_check:
             self.process_invalid_next_tokens()
 
+    def _consume_token_budget(self):
+        if self._token_budget is not None:
+            self._token_budget -= 1
 
-class VocabSplit:
-    
-    def __init__(self) -> None:
-        self.filtered = []
-        self.remaining = []
+    def _update_check(self, check: SyntaxConstraint, token_id: int):
+        if token_id == self._eos_token_id:
+            check.update_parser([SpecialToken.EOS])
+        else:
+            check.update_parser(self._token_vocab[token_id])
+
+
+class BeamSearchCheckHandler(SyntaxValidityCheckHandler):
+
+    r"""
+    Check handler for beam search. Beams that have the same parse history share a single
+    check; a check is only copied when the search forks it into hypotheses with different
+    next tokens, and masks are computed once per distinct check across beams."""
+
+    r"""
+    Advances the beams with their sampled tokens. `beam_indices[i]` is the index of the beam
+    (from the previous step) that hypothesis `i` extends, as reported by the beam search.
+    Beams that are not referenced are dropped."""
+    def update(self, next_token_ids: List[int], beam_indices: Optional[List[int]] = None, begin_next_check: bool = True):
+        self._consume_token_budget()
+        if beam_indices is None:
+            beam_indices = list(range(len(next_token_ids)))
+        parents = self._row_checks(max(beam_indices) + 1)
+        keys = [(id(parents[b]), t) for b, t in zip(beam_indices, next_token_ids)]
+        remaining_children = Counter(parent_id for parent_id, _ in set(keys))
+        children: Dict[Tuple[int, int], SyntaxConstraint] = {}
+        active_checks = []
+        for b, token_id, key in zip(beam_indices, next_token_ids, keys):
+            if key not in children:
+                parent = parents[b]
+                remaining_children[key[0]] -= 1
+                child = self._take_prefetched(parent, token_id)
+                if child is None:
+                    # the last child of a parent takes over its state instead of copying it
+                    child = parent if remaining_children[key[0]] == 0 else parent.copy()
+                    self._update_check(child, token_id)
+                children[key] = child
+            active_checks += [children[key]]
+        self._active_checks = active_checks
+        self._discard_prefetched()
+        self._initialized = True
+        if begin_next_check:
+            self.process_invalid_next_tokens()
 
-    def filter_vocab(self, vocab: List[str], grouping: Type[TokenGroup]):
-        self.filtered = []
-        self.remaining = []
-        for i, tok in enumerate(vocab):
-            if isinstance(tok, str) and grouping.filter(tok):
-                self.filtered += [(i, tok)]
-            else:
-                self.remaining += [(i, tok)]
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Union, List, Dict, Tuple, Optional
+from typing import Union, List, Dict, Tuple, Optional, Hashable
 
 
 class TokenSplit:
@@ -51,14 +51,78 @@ class IncrementalParser:
         Boolean specifying whether parsing of this value is complete"""
     def _append(self, char: Union[str, "SpecialToken"]) -> bool:
         raise NotImplementedError()
+
+    r"""
+    Continues parsing with as many characters of `chars`, starting at index `start`, as the
+    parser can consume at once. At least one character is consumed, and parsing stops right
+    after the character that concludes the value so the parent parser can handle the rest.
+    Parsers override this to consume runs of characters natively.
+
+    Parameters:
+        chars (str):
+            Characters to parse
+        start (int):
+            Index of the first character to parse
+
+    Raise:
+        ParseFailure:
+            Raised if parsing fails for one of the consumed characters
+
+    Return:
+        (int, bool):
+        Index of the first unconsumed character, and whether parsing of the value is complete"""
+    def _append_chunk(self, chars: str, start: int) -> Tuple[int, bool]:
+        return start + 1, self._append(chars[start])
     
     def append(self, chars: Union[List[str], "SpecialToken"]):
-        for c in chars:
-            self._append(c)
+        if not isinstance(chars, str):
+            for c in chars:
+                self._append(c)
+            return
+        pos = 0
+        while pos < len(chars):
+            pos, _ = self._append_chunk(chars, pos)
 
     def get_next(self) -> List[str]:
         return []
 
+    r"""
+    Returns whether the parsed content is complete and can't be continued, leaving the end of
+    sequence as the only valid continuation"""
+    def is_complete(self) -> bool:
+        return False
+
+    r"""
+    Returns the shortest string that, once appended, validly completes the parsed content
+
+    Return:
+        (Optional[str]):
+        Shortest valid completion, or None if the parser can't determine one"""
+    def get_completion(self) -> Optional[str]:
+        return None
+
+    r"""
+    Returns a hashable summary of the parse state. Parsers with equal fingerprints must accept
+    exactly the same continuations, so their token masks can be shared. Parsers that cannot
+    summarize their state return None.
+
+    Return:
+        (Optional[Hashable]):
+        Fingerprint of the current parse state, or None"""
+    def fingerprint(self) -> Optional[Hashable]:
+        return None
+
+    r"""
+    Returns a parser in every parse state reachable from this one, for parsers with few enough
+    states to enumerate (such as the states of a DFA), so their token masks can be computed ahead
+    of generation. Other parsers return None.
+
+    Return:
+        (Optional[List[IncrementalParser]]):
+        Parsers in each reachable state, or None"""
+    def reachable_states(self) -> Optional[List["IncrementalParser"]]:
+        return None
+
     def invalid_token_group(self) -> List["TokenGroup"]:
         return EmptyTokenGroup
     
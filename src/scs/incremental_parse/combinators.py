@@ -0,0 +1,270 @@
+from typing import List, Optional, Tuple, Union
+
+from . import IncrementalParser, ParseFailure, SpecialToken, EmptyTokenGroup
+
+
+def _accepts_end(parser: IncrementalParser) -> bool:
+    try:
+        parser.copy()._append(SpecialToken.EOS)
+        return True
+    except ParseFailure:
+        return False
+
+
+def _fingerprints(parsers: List[IncrementalParser]) -> Optional[tuple]:
+    fingerprints = tuple(parser.fingerprint() for parser in parsers)
+    return None if None in fingerprints else fingerprints
+
+
+class SequenceParser(IncrementalParser):
+
+    r"""
+    Parses output made of the outputs of several parsers, one after the other. Where the current
+    parser could either continue or end and hand over to the next one, both branches are tracked
+    until the output rules one out, so the boundary between them needn't fall on a token boundary.
+    Branches are `(index of the parser, its state)` pairs, deduplicated by fingerprint."""
+    def __init__(self, parsers: List[IncrementalParser] = None):
+        super().__init__()
+        self._parsers = parsers or []  # initial states, copied when a parser begins
+        self._branches: List[Tuple[int, IncrementalParser]] = []
+        if parsers:
+            self._branches = self._close([(0, parsers[0].copy())])
+
+    def _copy_from(self, other: "SequenceParser"):
+        super()._copy_from(other)
+        self._parsers = other._parsers
+        self._branches = [(index, parser.copy()) for index, parser in other._branches]
+
+    @property
+    def branches(self) -> List[Tuple[int, IncrementalParser]]:
+        return self._branches
+
+    @property
+    def num_parsers(self) -> int:
+        return len(self._parsers)
+
+    r"""
+    Adds a branch beginning the next parser for every branch whose parser can end"""
+    def _close(self, branches: List[Tuple[int, IncrementalParser]]) -> List[Tuple[int, IncrementalParser]]:
+        closed = []
+        seen = set()
+        while branches:
+            index, parser = branches.pop(0)
+            fingerprint = parser.fingerprint()
+            if fingerprint is not None:
+                if (index, fingerprint) in seen:
+                    continue
+                seen.add((index, fingerprint))
+            closed += [(index, parser)]
+            if index + 1 < len(self._parsers) and _accepts_end(parser):
+                branches += [(index + 1, self._parsers[index + 1].copy())]
+        return closed
+
+    def _append(self, char: Union[str, SpecialToken]) -> bool:
+        if isinstance(char, SpecialToken):
+            if not any(index == len(self._parsers) - 1 and _accepts_end(parser) for index, parser in self._branches):
+                raise ParseFailure(f"Got {char} before the last parser of the sequence could end")
+            return True
+        surviving = []
+        for index, parser in self._branches:
+            try:
+                parser._append(char)
+            except ParseFailure:
+                continue
+            surviving += [(index, parser)]
+        if not surviving:
+            raise ParseFailure(f"No parser of the sequence accepts {char!r} after {self._parsed!r}")
+        self._branches = self._close(surviving)
+        self._parsed += char
+        return self.is_complete()
+
+    def is_complete(self) -> bool:
+        return all(index == len(self._parsers) - 1 and parser.is_complete() for index, parser in self._branches)
+
+    def get_completion(self) -> Optional[str]:
+        rests = [parser.get_completion() for parser in self._parsers]
+        best = None
+        for index, parser in self._branches:
+            completions = [parser.get_completion()] + rests[index + 1:]
+            if None in completions:
+                continue
+            completion = "".join(completions)
+            if best is None or len(completion) < len(best):
+                best = completion
+        return best
+
+    def fingerprint(self):
+        parsers = _fingerprints(self._parsers)
+        branches = _fingerprints([parser for _, parser in self._branches])
+        if parsers is None or branches is None:
+            return None
+        indices = tuple(index for index, _ in self._branches)
+        return (SequenceParser, parsers, frozenset(zip(indices, branches)))
+
+    def get_next(self) -> List[str]:
+        if len(self._branches) != 1:  # the current parser may end here
+            return []
+        return self._branches[0][1].get_next()
+
+
+class AlternationParser(IncrementalParser):
+
+    r"""
+    Parses output accepted by any of several parsers. Every parser still accepting the parsed
+    output is tracked, and parsing fails once none survives. Alternatives with equal merge keys
+    (their fingerprints by default) accept the same continuations, so only one of them is kept,
+    standing for all the parsers it was merged with."""
+    def __init__(self, parsers: List[IncrementalParser] = None):
+        super().__init__()
+        self._parsers = parsers or []
+        self._alternatives: List[IncrementalParser] = [parser.copy() for parser in self._parsers]
+        # indices in `parsers` of the parsers each alternative stands for
+        self._sources: List[Tuple[int, ...]] = [(i,) for i in range(len(self._parsers))]
+
+    def _copy_from(self, other: "AlternationParser"):
+        super()._copy_from(other)
+        self._parsers = other._parsers
+        self._alternatives = [alternative.copy() for alternative in other._alternatives]
+        self._sources = other._sources
+
+    @property
+    def alternatives(self) -> List[IncrementalParser]:
+        return self._alternatives
+
+    r"""
+    Key under which alternatives are merged, or None if `alternative` can't be merged"""
+    def _merge_key(self, alternative: IncrementalParser):
+        return alternative.fingerprint()
+
+    def _append(self, char: Union[str, SpecialToken]) -> bool:
+        surviving = []
+        sources = []
+        seen = {}
+        done = False
+        for alternative, source in zip(self._alternatives, self._sources):
+            try:
+                alternative_done = alternative._append(char)
+            except ParseFailure:
+                continue
+            key = self._merge_key(alternative)
+            if key is not None:
+                if key in seen:
+                    sources[seen[key]] += source
+                    continue
+                seen[key] = len(surviving)
+            surviving += [alternative]
+            sources += [source]
+            done = done or alternative_done
+        if not surviving:
+            raise ParseFailure(f"No alternative accepts {char!r} after {self._parsed!r}")
+        self._alternatives = surviving
+        self._sources = sources
+        if isinstance(char, str):
+            self._parsed += char
+        return done
+
+    def is_complete(self) -> bool:
+        return all(alternative.is_complete() for alternative in self._alternatives)
+
+    def get_completion(self) -> Optional[str]:
+        completions = [alternative.get_completion() for alternative in self._alternatives]
+        completions = [completion for completion in completions if completion is not None]
+        return min(completions, key=len) if completions else None
+
+    def fingerprint(self):
+        fingerprints = _fingerprints(self._alternatives)
+        if fingerprints is None:
+            return None
+        return (AlternationParser, frozenset(fingerprints))
+
+    def get_next(self) -> List[str]:
+        next_sequences = []
+        for alternative in self._alternatives:
+            alternative_next = alternative.get_next()
+            if not alternative_next:  # generation is free for this alternative
+                return []
+            next_sequences += [sequence for sequence in alternative_next if sequence not in next_sequences]
+        return next_sequences
+
+    def invalid_token_group(self):
+        # a token must be invalid for every alternative
+        groups = {alternative.invalid_token_group() for alternative in self._alternatives}
+        return groups.pop() if len(groups) == 1 else EmptyTokenGroup
+
+    def valid_token_group(self):
+        # only tokens valid for every alternative are known to be valid without checking them
+        groups = {alternative.valid_token_group() for alternative in self._alternatives}
+        return groups.pop() if len(groups) == 1 else EmptyTokenGroup
+
+
+class IntersectionParser(IncrementalParser):
+
+    r"""
+    Parses output accepted by all of several parsers at once, failing as soon as any of them
+    fails. Each parser only checks that the output can still be completed on its own, so the
+    parsers together may accept a prefix that no single output completes for all of them."""
+    def __init__(self, parsers: List[IncrementalParser] = None):
+        super().__init__()
+        self._parsers = [parser.copy() for parser in parsers or []]
+
+    def _copy_from(self, other: "IntersectionParser"):
+        super()._copy_from(other)
+        self._parsers = [parser.copy() for parser in other._parsers]
+
+    @property
+    def parsers(self) -> List[IncrementalParser]:
+        return self._parsers
+
+    def _append(self, char: Union[str, SpecialToken]) -> bool:
+        done = False
+        for parser in self._parsers:
+            done = parser._append(char) or done
+        if isinstance(char, str):
+            self._parsed += char
+        return done
+
+    def is_complete(self) -> bool:
+        # the output is only complete once it's complete for every parser
+        return all(parser.is_complete() for parser in self._parsers)
+
+    r"""
+    Returns the shortest completion of any parser that every other parser accepts"""
+    def get_completion(self) -> Optional[str]:
+        completions = [parser.get_completion() for parser in self._parsers]
+        for completion in sorted(set(c for c in completions if c is not None), key=len):
+            try:
+                for parser in self._parsers:
+                    parser_copy = parser.copy()
+                    parser_copy.append(completion)
+                    parser_copy.append([SpecialToken.EOS])
+            except ParseFailure:
+                continue
+            return completion
+        return None
+
+    def fingerprint(self):
+        fingerprints = _fingerprints(self._parsers)
+        if fingerprints is None:
+            return None
+        return (IntersectionParser, fingerprints)
+
+    def get_next(self) -> List[str]:
+        # sequences forced by one parser, and accepted by the others, are forced for all of them
+        for parser in self._parsers:
+            forced = parser.get_next()
+            if not forced:
+                continue
+            accepted = []
+            for sequence in forced:
+                try:
+                    for other in self._parsers:
+                        other.copy().append(sequence)
+                except ParseFailure:
+                    continue
+                accepted += [sequence]
+            return accepted
+        return []
+
+    def invalid_token_group(self):
+        # tokens invalid for the first parser are invalid for all of them
+        return self._parsers[0].invalid_token_group() if self._parsers else EmptyTokenGroup
@@ -0,0 +1,578 @@
+from functools import lru_cache
+from typing import List, Optional, Tuple, Dict, Union, Set, FrozenSet
+
+from . import IncrementalParser, ParseFailure, SpecialToken
+from .regex import Intervals, ANY_CHAR, parse_char_class, contains
+
+
+class GrammarSyntaxError(ValueError):
+    pass
+
+
+# a symbol is the index of a nonterminal if >= 0, or ~index of a terminal (character class)
+Symbol = int
+# an Earley item: (production, dot, origin column)
+Item = Tuple[int, int, int]
+
+
+class Grammar:
+
+    r"""
+    Context free grammar over characters, compiled from EBNF:
+
+        root  ::= "SELECT " cols " FROM " ident
+        cols  ::= ident ("," " "? ident)*
+        ident ::= [a-z_] [a-z0-9_]*
+
+    Rules are `name ::= expression`, where expressions combine string literals, character
+    classes, `.`, rule names, groups, alternation and the `* + ?` operators. `#` starts a comment.
+    The first rule, or `start`, is the start rule.
+
+    Repetitions and groups are rewritten into generated rules, and the tables the parser needs at
+    every step are precomputed: nullable rules, the closure of predicted items of each rule and
+    the shortest string derived by each rule."""
+    def __init__(self, ebnf: str, start: Optional[str] = None):
+        self.names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self.terminals: List[Intervals] = []
+        self._terminal_ids: Dict[Intervals, int] = {}
+        self.productions: List[Tuple[int, Tuple[Symbol, ...]]] = []
+        self.rules: List[List[int]] = []  # production indices of each nonterminal
+
+        definitions = _GrammarParser(ebnf).parse()
+        if not definitions:
+            raise GrammarSyntaxError("Grammar defines no rules")
+        for name, _ in definitions:
+            self._nonterminal(name)
+        defined = set(name for name, _ in definitions)
+        for name, expression in definitions:
+            for alternative in self._alternatives(expression):
+                self._add_production(self._ids[name], alternative)
+        for name in self.names:
+            if name not in defined and not name.startswith("<"):
+                raise GrammarSyntaxError(f"Rule {name} is not defined")
+        start = definitions[0][0] if start is None else start
+        if start not in self._ids:
+            raise GrammarSyntaxError(f"Start rule {start} is not defined")
+        self.start: int = self._ids[start]
+
+        self.nullable: Set[int] = self._nullable()
+        self.predictions: List[FrozenSet[Tuple[int, int]]] = [
+            self._predict(nonterminal) for nonterminal in range(len(self.names))
+        ]
+        self.shortest: List[Optional[str]] = self._shortest_yields()
+        if self.shortest[self.start] is None:
+            raise GrammarSyntaxError("Start rule derives no finite string")
+
+    def _nonterminal(self, name: str) -> int:
+        if name not in self._ids:
+            self._ids[name] = len(self.names)
+            self.names += [name]
+            self.rules += [[]]
+        return self._ids[name]
+
+    def _terminal(self, intervals: Intervals) -> Symbol:
+        if intervals not in self._terminal_ids:
+            self._terminal_ids[intervals] = len(self.terminals)
+            self.terminals += [intervals]
+        return ~self._terminal_ids[intervals]
+
+    def _add_production(self, lhs: int, symbols: Tuple[Symbol, ...]):
+        self.rules[lhs] += [len(self.productions)]
+        self.productions += [(lhs, symbols)]
+
+    def _generated(self, alternatives: List[Tuple[Symbol, ...]]) -> Symbol:
+        nonterminal = self._nonterminal(f"<{len(self.names)}>")
+        for alternative in alternatives:
+            self._add_production(nonterminal, alternative)
+        return nonterminal
+
+    r"""
+    Returns the symbol sequences of each alternative of an expression tree"""
+    def _alternatives(self, expression) -> List[Tuple[Symbol, ...]]:
+        if expression[0] == "alt":
+            return [self._sequence(branch) for branch in expression[1]]
+        return [self._sequence(expression)]
+
+    def _sequence(self, expression) -> Tuple[Symbol, ...]:
+        if expression[0] == "cat":
+            return tuple(symbol for child in expression[1] for symbol in self._sequence(child))
+        return (self._symbol(expression),)
+
+    def _symbol(self, expression) -> Symbol:
+        kind = expression[0]
+        if kind == "ref":
+            return self._nonterminal(expression[1])
+        if kind == "set":
+            return self._terminal(expression[1])
+        if kind in ["alt", "cat"]:
+            return self._generated(self._alternatives(expression))
+        item = self._symbol(expression[1])
+        if kind == "star":  # R ::= | R item
+            repeat = self._generated([()])
+            self._add_production(repeat, (repeat, item))
+        elif kind == "plus":  # R ::= item | R item
+            repeat = self._generated([(item,)])
+            self._add_production(repeat, (repeat, item))
+        else:  # optional
+            repeat = self._generated([(), (item,)])
+        return repeat
+
+    def _nullable(self) -> Set[int]:
+        nullable = set()
+        changed = True
+        while changed:
+            changed = False
+            for lhs, symbols in self.productions:
+                if lhs not in nullable and all(s >= 0 and s in nullable for s in symbols):
+                    nullable.add(lhs)
+                    changed = True
+        return nullable
+
+    r"""
+    Returns the (production, dot) items predicted at a column when `nonterminal` is expected,
+    closed under prediction and skipping nullable rules"""
+    def _predict(self, nonterminal: int) -> FrozenSet[Tuple[int, int]]:
+        items = set()
+        stack = [nonterminal]
+        predicted = {nonterminal}
+        while stack:
+            for production in self.rules[stack.pop()]:
+                symbols = self.productions[production][1]
+                for dot in range(len(symbols) + 1):
+                    items.add((production, dot))
+                    if dot == len(symbols):
+                        break
+                    symbol = symbols[dot]
+                    if symbol < 0:
+                        break
+                    if symbol not in predicted:
+                        predicted.add(symbol)
+                        stack += [symbol]
+                    if symbol not in self.nullable:
+                        break
+        return frozenset(items)
+
+    def _shortest_yields(self) -> List[Optional[str]]:
+        shortest: List[Optional[str]] = [None] * len(self.names)
+        changed = True
+        while changed:
+            changed = False
+            for lhs, symbols in self.productions:
+                text = self.shortest_yield(symbols, shortest)
+                if text is not None and (shortest[lhs] is None or len(text) < len(shortest[lhs])):
+                    shortest[lhs] = text
+                    changed = True
+        return shortest
+
+    r"""
+    Returns the shortest string derived by a sequence of symbols, or None if there is none"""
+    def shortest_yield(self, symbols: Tuple[Symbol, ...], shortest: Optional[List[Optional[str]]] = None) -> Optional[str]:
+        shortest = self.shortest if shortest is None else shortest
+        text = ""
+        for symbol in symbols:
+            part = _representative(self.terminals[~symbol]) if symbol < 0 else shortest[symbol]
+            if part is None:
+                return None
+            text += part
+        return text
+
+
+def _representative(intervals: Intervals) -> Optional[str]:
+    for char in "a0A_ ":
+        if contains(intervals, char):
+            return char
+    for lo, hi in intervals:
+        if lo <= 0x7E and hi >= 0x21:  # prefer a printable character
+            return chr(max(lo, 0x21))
+    return chr(intervals[0][0]) if intervals else None
+
+
+class _GrammarParser:
+
+    r"""
+    Parses EBNF text into (rule name, expression tree) definitions. Trees are tuples:
+    ("set", intervals), ("ref", name), ("cat", nodes), ("alt", nodes), ("star" | "plus" | "opt", node)"""
+    def __init__(self, text: str):
+        self._text = text
+        self._pos = 0
+
+    def parse(self) -> List[Tuple[str, tuple]]:
+        definitions = []
+        self._skip()
+        while self._pos < len(self._text):
+            name = self._name()
+            self._skip()
+            if not self._text.startswith("::=", self._pos):
+                raise GrammarSyntaxError(f"Expected '::=' after {name} at {self._pos}")
+            self._pos += 3
+            definitions += [(name, self._alternation())]
+        return definitions
+
+    def _skip(self):
+        text = self._text
+        while self._pos < len(text):
+            if text[self._pos].isspace():
+                self._pos += 1
+            elif text[self._pos] == "#":
+                end = text.find("\n", self._pos)
+                self._pos = len(text) if end < 0 else end
+            else:
+                break
+
+    def _name(self) -> str:
+        start = self._pos
+        while self._pos < len(self._text) and (self._text[self._pos].isalnum() or self._text[self._pos] in "_-"):
+            self._pos += 1
+        if start == self._pos:
+            raise GrammarSyntaxError(f"Expected a rule name at {start}")
+        return self._text[start:self._pos]
+
+    def _at_rule_start(self) -> bool:
+        # a name followed by '::=' begins the next rule
+        pos = self._pos
+        try:
+            self._name()
+            self._skip()
+            return self._text.startswith("::=", self._pos)
+        except GrammarSyntaxError:
+            return False
+        finally:
+            self._pos = pos
+
+    def _alternation(self):
+        branches = [self._concatenation()]
+        while self._peek() == "|":
+            self._pos += 1
+            branches += [self._concatenation()]
+        return branches[0] if len(branches) == 1 else ("alt", branches)
+
+    def _peek(self) -> Optional[str]:
+        self._skip()
+        return self._text[self._pos] if self._pos < len(self._text) else None
+
+    def _concatenation(self):
+        nodes = []
+        while self._peek() not in [None, "|", ")"] and not self._at_rule_start():
+            node = self._atom()
+            while self._peek() in ["*", "+", "?"]:
+                node = ({"*": "star", "+": "plus", "?": "opt"}[self._text[self._pos]], node)
+                self._pos += 1
+            nodes += [node]
+        return ("cat", nodes)
+
+    def _atom(self):
+        text = self._text
+        char = text[self._pos]
+        if char == "(":
+            self._pos += 1
+            node = self._alternation()
+            if self._peek() != ")":
+                raise GrammarSyntaxError(f"Missing ')' at {self._pos}")
+            self._pos += 1
+            return node
+        if char == '"':
+            return ("cat", [("set", ((ord(c), ord(c)),)) for c in self._literal()])
+        if char == "[":
+            intervals, self._pos = parse_char_class(text, self._pos + 1)
+            return ("set", intervals)
+        if char == ".":
+            self._pos += 1
+            return ("set", ANY_CHAR)
+        if char.isalpha() or char == "_":
+            return ("ref", self._name())
+        raise GrammarSyntaxError(f"Unexpected {char!r} at {self._pos}")
+
+    def _literal(self) -> str:
+        text = self._text
+        self._pos += 1
+        literal = ""
+        while True:
+            if self._pos >= len(text):
+                raise GrammarSyntaxError("Unterminated string literal")
+            char = text[self._pos]
+            self._pos += 1
+            if char == '"':
+                return literal
+            if char == "\\":
+                escaped = text[self._pos]
+                self._pos += 1
+                char = {"n": "\n", "t": "\t", "r": "\r"}.get(escaped, escaped)
+            literal += char
+
+
+@lru_cache(maxsize=64)
+def compile_grammar(ebnf: str, start: Optional[str] = None) -> Grammar:
+    return Grammar(ebnf, start=start)
+
+
+class _Column:
+
+    r"""
+    Immutable Earley chart column. Items waiting on a nonterminal and items waiting on a
+    terminal are indexed for completion and scanning. The fingerprint summarizes everything
+    the column's future depends on: its incomplete items, each paired with the continuation of
+    the rule it belongs to, so equivalent states reached through different columns (such as
+    successive iterations of a repetition) share a fingerprint."""
+    __slots__ = ["index", "waiting", "scans", "accept", "fingerprint", "_continuations"]
+
+    def __init__(self, index: int, items: Set[Item], grammar: Grammar, chart: List["_Column"]):
+        self.index = index
+        self.waiting: Dict[int, List[Item]] = {}
+        self.scans: Dict[int, List[Item]] = {}
+        self.accept = False
+        self._continuations: Dict[int, tuple] = {}
+        summary = []
+        for item in items:
+            production, dot, origin = item
+            lhs, symbols = grammar.productions[production]
+            if dot == len(symbols):
+                if lhs == grammar.start and origin == 0:
+                    self.accept = True
+                continue
+            symbol = symbols[dot]
+            if symbol >= 0:
+                self.waiting.setdefault(symbol, []).append(item)
+            else:
+                self.scans.setdefault(~symbol, []).append(item)
+        for production, dot, origin in items:
+            lhs, symbols = grammar.productions[production]
+            if dot < len(symbols):
+                # items predicted here continue through the other items of this column
+                continuation = None if origin == index else chart[origin].continuation(lhs, grammar, chart)
+                summary += [(production, dot, continuation)]
+        self.fingerprint = (self.accept, frozenset(summary))
+
+    r"""
+    Returns a hashable summary of what follows once `nonterminal`, begun at this column,
+    completes: whether the parse is accepted, and the items that advance over it along with
+    their own continuations. Left recursive rules refer back to continuations still being
+    summarized, which are marked by the nonterminal they continue."""
+    def continuation(self, nonterminal: int, grammar: Grammar, chart: List["_Column"]) -> tuple:
+        return self._continuation(nonterminal, grammar, chart, set())[0]
+
+    def _continuation(self, nonterminal: int, grammar: Grammar, chart: List["_Column"], visiting: Set[int]):
+        if nonterminal in self._continuations:
+            return self._continuations[nonterminal], set()
+        if nonterminal in visiting:
+            return ("rec", nonterminal), {nonterminal}
+        visiting.add(nonterminal)
+        referenced = set()
+        advanced = []
+        for production, dot, origin in self.waiting.get(nonterminal, []):
+            lhs = grammar.productions[production][0]
+            if origin == self.index:
+                continuation, refs = self._continuation(lhs, grammar, chart, visiting)
+                referenced |= refs
+            else:
+                continuation = chart[origin].continuation(lhs, grammar, chart)
+            advanced += [(production, dot + 1, continuation)]
+        visiting.discard(nonterminal)
+        accept = self.index == 0 and nonterminal == grammar.start
+        summary = (nonterminal, accept, frozenset(advanced))
+        referenced.discard(nonterminal)
+        if not referenced:  # summaries referring to enclosing ones depend on where they're nested
+            self._continuations[nonterminal] = summary
+        return summary, referenced
+
+
+class GrammarParser(IncrementalParser):
+
+    r"""
+    Parses output derived from a context free grammar with a character level Earley parser.
+    Each appended character adds an immutable column to the chart. Copies share the chart and
+    copy it on their first append, so snapshots are cheap and copies advanced in other threads
+    never append to a chart another parser reads."""
+    def __init__(self, grammar: Grammar = None):
+        super().__init__()
+        self._grammar = grammar
+        self._chart: List[_Column] = []
+        self._length = 0  # columns of the (possibly shared) chart belonging to this parser
+        self._owns_tail = True  # whether this parser alone appends to its chart
+        if grammar is not None:
+            items = {(production, dot, 0) for production, dot in grammar.predictions[grammar.start]}
+            self._push(self._close(items, 0))
+
+    def _copy_from(self, other: "GrammarParser"):
+        super()._copy_from(other)
+        self._grammar = other._grammar
+        self._chart = other._chart
+        self._length = other._length
+        self._owns_tail = False
+
+    def _push(self, items: Set[Item]):
+        if not self._owns_tail:  # the chart is shared with the parser this was copied from
+            self._chart = self._chart[:self._length]
+            self._owns_tail = True
+        self._chart.append(_Column(self._length, items, self._grammar, self._chart))
+        self._length += 1
+
+    @property
+    def _column(self) -> _Column:
+        return self._chart[self._length - 1]
+
+    r"""
+    Completes and predicts from `items`, the items of column `index` after scanning"""
+    def _close(self, items: Set[Item], index: int) -> Set[Item]:
+        grammar = self._grammar
+        stack = list(items)
+        while stack:
+            production, dot, origin = stack.pop()
+            lhs, symbols = grammar.productions[production]
+            if dot == len(symbols):
+                if origin == index:  # nullable rules are skipped when predicted
+                    continue
+                for waiting_production, waiting_dot, waiting_origin in self._chart[origin].waiting.get(lhs, []):
+                    advanced = (waiting_production, waiting_dot + 1, waiting_origin)
+                    if advanced not in items:
+                        items.add(advanced)
+                        stack += [advanced]
+                continue
+            symbol = symbols[dot]
+            if symbol < 0:
+                continue
+            for predicted_production, predicted_dot in grammar.predictions[symbol]:
+                predicted = (predicted_production, predicted_dot, index)
+                if predicted not in items:
+                    items.add(predicted)
+                    stack += [predicted]
+            if symbol in grammar.nullable:
+                advanced = (production, dot + 1, origin)
+                if advanced not in items:
+                    items.add(advanced)
+                    stack += [advanced]
+        return items
+
+    r"""
+    Returns the items of the current column advanced over `char`, empty if no terminal scans it"""
+    def _scan(self, char: str) -> Set[Item]:
+        terminals = self._grammar.terminals
+        scanned = set()
+        for terminal, items in self._column.scans.items():
+            if contains(terminals[terminal], char):
+                scanned.update((production, dot + 1, origin) for production, dot, origin in items)
+        return scanned
+
+    def _append(self, char: Union[str, SpecialToken]) -> bool:
+        if isinstance(char, SpecialToken):
+            if char != SpecialToken.EOS or not self._column.accept:
+                raise ParseFailure("Got special token before the grammar was matched")
+            return True
+        scanned = self._scan(char)
+        if not scanned:
+            raise ParseFailure(f"{self._parsed + char!r} isn't derived by the grammar")
+        self._push(self._close(scanned, self._length))
+        self._parsed += char
+        return self.is_complete()
+
+    r"""
+    Returns the ids of the tokens in `trie` (a `scs.vocab.TokenTrie`) that may come next. The
+    trie is walked depth first over a private copy of the chart, pushing a column for each
+    character and popping it on the way back. Tokens sharing a prefix share its columns, and
+    subtrees are pruned at the first character no terminal scans, so the walk costs one copy of
+    the chart plus one column per trie node reached."""
+    def valid_token_ids(self, trie) -> List[int]:
+        walker = GrammarParser()
+        walker._grammar = self._grammar
+        walker._chart = self._chart[:self._length]
+        walker._length = self._length
+        valid_ids = []
+        stack = [iter(trie.children.items())]
+        while stack:
+            step = next(stack[-1], None)
+            if step is None:
+                stack.pop()
+                if stack:  # leave the column of the node walked
+                    walker._chart.pop()
+                    walker._length -= 1
+                continue
+            char, node = step
+            scanned = walker._scan(char)
+            if not scanned:
+                continue
+            walker._push(walker._close(scanned, walker._length))
+            valid_ids += node.token_ids
+            stack += [iter(node.children.items())]
+        return valid_ids
+
+    def is_complete(self) -> bool:
+        column = self._column
+        return column.accept and not column.scans
+
+    def fingerprint(self):
+        return (GrammarParser, self._grammar, self._column.fingerprint)
+
+    def get_next(self) -> List[str]:
+        # follow characters while a single one can come next
+        forced = ""
+        parser = self
+        while len(forced) < 32:
+            column = parser._column
+            if column.accept or len(column.scans) != 1:
+                break
+            intervals = self._grammar.terminals[next(iter(column.scans))]
+            if len(intervals) != 1 or intervals[0][0] != intervals[0][1]:
+                break
+            char = chr(intervals[0][0])
+            if parser is self:
+                parser = self.copy()
+            parser._append(char)
+            forced += char
+        return [forced] if forced else []
+
+    def get_completion(self) -> Optional[str]:
+        grammar = self._grammar
+        column = self._column
+        items = [item for waiting in list(column.scans.values()) + list(column.waiting.values()) for item in waiting]
+
+        # find the rules, keyed by the column they began at, whose completion the parse depends on
+        needed = set()
+        stack = [(origin, grammar.productions[production][0]) for production, _, origin in items]
+        while stack:
+            key = stack.pop()
+            if key in needed:
+                continue
+            needed.add(key)
+            origin, nonterminal = key
+            stack += [(waiting_origin, grammar.productions[production][0])
+                      for production, _, waiting_origin in self._chart[origin].waiting.get(nonterminal, [])]
+
+        # shortest string finishing the parse once each completes, from the earliest column on.
+        # rules began at the same column may depend on each other, so iterate to a fixpoint
+        finish: Dict[Tuple[int, int], Optional[str]] = {}
+        by_column: Dict[int, List[int]] = {}
+        for origin, nonterminal in needed:
+            by_column.setdefault(origin, []).append(nonterminal)
+        for origin in sorted(by_column):
+            changed = True
+            while changed:
+                changed = False
+                for nonterminal in by_column[origin]:
+                    best = "" if origin == 0 and nonterminal == grammar.start else None
+                    for production, dot, waiting_origin in self._chart[origin].waiting.get(nonterminal, []):
+                        best = _shorter(best, self._finish_item(production, dot + 1, waiting_origin, finish))
+                    key = (origin, nonterminal)
+                    if best is not None and (finish.get(key) is None or len(best) < len(finish[key])):
+                        finish[key] = best
+                        changed = True
+
+        best = "" if column.accept else None
+        for production, dot, origin in items:
+            best = _shorter(best, self._finish_item(production, dot, origin, finish))
+        return best
+
+    def _finish_item(self, production: int, dot: int, origin: int, finish: Dict[Tuple[int, int], Optional[str]]) -> Optional[str]:
+        lhs, symbols = self._grammar.productions[production]
+        rest = self._grammar.shortest_yield(symbols[dot:])
+        after = finish.get((origin, lhs))
+        if rest is None or after is None:
+            return None
+        return rest + after
+
+
+def _shorter(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return b if len(b) < len(a) else a
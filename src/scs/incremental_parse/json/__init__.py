@@ -1,10 +1,10 @@
 from enum import Enum
-from typing import Dict, Union, Optional
-from copy import deepcopy
+from typing import Union, Optional, List, Type, Tuple
 
 from scs.incremental_parse import IncrementalParser
 
-from .. import IncrementalParser, ParseFailure, SpecialToken
+from .. import IncrementalParser, ParseFailure, SpecialToken, TokenGroup, EmptyTokenGroup, AllTokenGroup
+from .parser import NumberParser, StringParser, BeginWithNonJsonCharGroup, NonValueStartGroup
 
 
 class JSONParser(IncrementalParser):
@@ -73,6 +73,58 @@ class JSONParser(IncrementalParser):
         else:
             return self._subparser.get_parsed()
 
+    def is_complete(self) -> bool:
+        return self._complete
+
+    def get_completion(self) -> Optional[str]:
+        if self._subparser:
+            return self._subparser.get_completion()
+        if self._allow_empty:
+            return "{}"
+        return '[0]' if self._allow_outer_list else '{"":0}'
+
+    def fingerprint(self):
+        sub = self._subparser.fingerprint() if self._subparser else ()
+        if sub is None:
+            return None
+        return (
+            JSONParser,
+            self._allow_outer_list,
+            self._allow_empty,
+            self._allow_empty_children,
+            self._allow_whitespace_formatting,
+            self._complete,
+            sub,
+        )
+
+    def _append_chunk(self, chars: str, start: int) -> Tuple[int, bool]:
+        if self._subparser is None or self._complete:
+            return super()._append_chunk(chars, start)
+        pos, done = self._subparser._append_chunk(chars, start)
+        if done:
+            self._parsed += self._subparser._parsed
+            self._complete = True
+        return pos, done
+
+    def get_next(self) -> List[str]:
+        if self._subparser:
+            return self._subparser.get_next()
+        if not self._allow_outer_list:
+            return [SpecialChar.OPEN_OBJECT.value]
+        return []
+
+    def invalid_token_group(self) -> Type[TokenGroup]:
+        if self._complete:
+            return AllTokenGroup
+        if self._subparser:
+            return self._subparser.invalid_token_group()
+        return BeginWithNonJsonCharGroup
+
+    def valid_token_group(self) -> Type[TokenGroup]:
+        if self._subparser and not self._complete:
+            return self._subparser.valid_token_group()
+        return EmptyTokenGroup
+
 
 class ObjectParser(IncrementalParser):
     def __init__(
@@ -86,13 +138,11 @@ class ObjectParser(IncrementalParser):
         self._allow_empty_children = allow_empty_children
         self._allow_whitespace_formatting = allow_whitespace_formatting
         self._parsed = SpecialChar.OPEN_OBJECT.value
-        self.state: Dict[str, Union[int, float, str, ObjectParser]] = {}
         self._parse_status: ObjectParseStatus = ObjectParseStatus.OPENED
         self._active_subparser: Optional[IncrementalParser] = None
 
     def _copy_from(self, other: "ObjectParser"):
         super()._copy_from(other)
-        self.state = deepcopy(other.state)
         self._parse_status = other._parse_status
         self._active_subparser = (
             other._active_subparser.copy() if other._active_subparser else None
@@ -110,6 +160,75 @@ class ObjectParser(IncrementalParser):
             parsed += self._active_subparser.get_parsed()
         return parsed
 
+    def fingerprint(self):
+        sub = self._active_subparser.fingerprint() if self._active_subparser else ()
+        if sub is None:
+            return None
+        return (
+            type(self),
+            self._allow_empty,
+            self._allow_empty_children,
+            self._allow_whitespace_formatting,
+            self._parse_status,
+            sub,
+        )
+
+    def _append_chunk(self, chars: str, start: int) -> Tuple[int, bool]:
+        if self._active_subparser is None:
+            return super()._append_chunk(chars, start)
+        pos, done = self._active_subparser._append_chunk(chars, start)
+        if done:
+            self._close_subparser()
+            return pos, self._parse_status == ObjectParseStatus.PARSE_COMPLETE
+        return pos, False
+
+    def get_completion(self) -> Optional[str]:
+        # keys are completed with the empty string and values with 0, the shortest JSON value
+        status = self._parse_status
+        if status == ObjectParseStatus.PARSE_COMPLETE:
+            return ""
+        rest = {
+            ObjectParseStatus.OPENED: '}' if self._allow_empty else '"":0}',
+            ObjectParseStatus.AWAITING_KEY: '"":0}',
+            ObjectParseStatus.IN_KEY_SUBPARSER: ':0}',
+            ObjectParseStatus.FINISHED_KEY: ':0}',
+            ObjectParseStatus.AWAITING_VALUE: '0}',
+            ObjectParseStatus.IN_VALUE_SUBPARSER: '}',
+            ObjectParseStatus.FINISHED_VALUE: '}',
+        }[status]
+        if self._active_subparser:
+            return self._active_subparser.get_completion() + rest
+        return rest
+
+    def get_next(self) -> List[str]:
+        if self._active_subparser:
+            return self._active_subparser.get_next()
+        if self._allow_whitespace_formatting:
+            return []
+        if self._parse_status == ObjectParseStatus.AWAITING_KEY or (
+            self._parse_status == ObjectParseStatus.OPENED and not self._allow_empty
+        ):
+            return [SpecialChar.QUOTE.value]
+        if self._parse_status == ObjectParseStatus.FINISHED_KEY:
+            return [SpecialChar.COLON.value]
+        return []
+
+    def invalid_token_group(self) -> Type[TokenGroup]:
+        if self._active_subparser:
+            if self._allow_whitespace_formatting:  # numbers may also be closed by whitespace
+                return EmptyTokenGroup
+            return self._active_subparser.invalid_token_group()
+        if self._allow_whitespace_formatting:
+            return EmptyTokenGroup
+        if self._parse_status == ObjectParseStatus.AWAITING_VALUE:
+            return NonValueStartGroup
+        return BeginWithNonJsonCharGroup
+
+    def valid_token_group(self) -> Type[TokenGroup]:
+        if self._active_subparser:
+            return self._active_subparser.valid_token_group()
+        return EmptyTokenGroup
+
     r"""
     Opens a subparser and sends characters to it to begin parsing.
     Previous subparser should be closed before this is called."""
@@ -125,6 +244,7 @@ class ObjectParser(IncrementalParser):
             self._active_subparser = ArrayParser(
                 allow_empty=self._allow_empty_children,
                 allow_empty_children=self._allow_empty_children,
+                allow_whitespace_formatting=self._allow_whitespace_formatting,
             )
         elif char == SpecialChar.QUOTE.value:  # begin parsing text
             self._active_subparser = StringParser()
@@ -185,6 +305,7 @@ class ObjectParser(IncrementalParser):
                         "Got empty object. If this is expected set allow_empty and allow_empty_children accordingly"
                     )
                 self._parsed += char
+                self._parse_status = ObjectParseStatus.PARSE_COMPLETE
                 return True
             if char == SpecialChar.QUOTE.value:
                 self._active_subparser = StringParser()
@@ -239,6 +360,30 @@ class ArrayParser(ObjectParser):
         )
         self._parsed = SpecialChar.OPEN_ARRAY.value
 
+    def get_completion(self) -> Optional[str]:
+        status = self._parse_status
+        if status == ObjectParseStatus.PARSE_COMPLETE:
+            return ""
+        if self._active_subparser:
+            return self._active_subparser.get_completion() + ']'
+        if status == ObjectParseStatus.AWAITING_VALUE or (status == ObjectParseStatus.OPENED and not self._allow_empty):
+            return '0]'
+        return ']'
+
+    def get_next(self) -> List[str]:
+        if self._active_subparser:
+            return self._active_subparser.get_next()
+        return []
+
+    def invalid_token_group(self) -> Type[TokenGroup]:
+        if self._active_subparser:
+            return super().invalid_token_group()
+        if self._allow_whitespace_formatting:
+            return EmptyTokenGroup
+        if self._parse_status in [ObjectParseStatus.OPENED, ObjectParseStatus.AWAITING_VALUE]:
+            return NonValueStartGroup
+        return BeginWithNonJsonCharGroup
+
     def _close_subparser(self):
         self._parsed += self._active_subparser._parsed
         if (
@@ -281,6 +426,7 @@ class ArrayParser(ObjectParser):
                         "Got empty object. If this is expected set allow_empty and allow_empty_children accordingly"
                     )
                 self._parsed += char
+                self._parse_status = ObjectParseStatus.PARSE_COMPLETE
                 return True
             self._open_subparser(char)
             self._parse_status = ObjectParseStatus.IN_VALUE_SUBPARSER
@@ -305,77 +451,6 @@ class ArrayParser(ObjectParser):
         raise Exception("Something went wrong")
 
 
-class NumberParser(IncrementalParser):
-    _END_CHARS = [",", "]", "}"]
-
-    def __init__(self) -> None:
-        super().__init__()
-        self._has_period = False
-        self._leading_zero = None
-        self._is_valid = True
-        self.closing_char = None  # appended to outer parser after closing
-
-    def _copy_from(self, other: "NumberParser") -> "NumberParser":
-        super()._copy_from(other)
-        self._has_period = other._has_period
-        self._leading_zero = other._leading_zero
-        self._is_valid = other._is_valid
-
-    def _append(self, char: str) -> bool:
-        if self._leading_zero:
-            if char != SpecialChar.PERIOD.value:
-                raise ParseFailure("Leading 0 in integer value")
-            self._leading_zero = False
-        if char.isnumeric():
-            if len(self._parsed) == 0 and char == SpecialChar.ZERO.value:
-                self._leading_zero = True
-            self._parsed += char
-            self._is_valid = True
-        elif char == SpecialChar.PERIOD.value:
-            if (not self._has_period) and len(
-                self._parsed
-            ) > 0:  # cannot begin with '.'
-                self._parsed += char
-                self._has_period = True
-                self._is_valid = False  # cannot end with '.'
-            else:
-                raise ParseFailure("Invalid position for '.' in number")
-        elif char in NumberParser._END_CHARS or char.isspace():
-            if self._is_valid:
-                self.closing_char = char
-                return True
-            raise ParseFailure(
-                f"End character '{char}' after invalid number {self._parsed}"
-            )
-        else:
-            raise ParseFailure(f"Invalid character for number: {char}")
-        return False
-
-
-class StringParser(IncrementalParser):
-    def __init__(self) -> None:
-        super().__init__()
-        self._parsed = '"'
-        self._escape_next = False
-
-    def _copy_from(self, other: "StringParser"):
-        super()._copy_from(other)
-        self._escape_next = other._escape_next
-
-    def _append(self, char: str) -> bool:
-        if self._escape_next:
-            self._parsed += char
-            self._escape_next = False
-        elif char == SpecialChar.QUOTE.value:
-            self._parsed += char
-            return True
-        elif char == SpecialChar.ESCAPE.value:
-            self._escape_next = True
-        else:
-            self._parsed += char
-        return False
-
-
 class SpecialChar(Enum):
     ESCAPE = "\\"
     PERIOD = "."
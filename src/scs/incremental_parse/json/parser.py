@@ -1,14 +1,18 @@
+import re
 from enum import Enum
-from typing import Dict, Union, Optional, List, Type
-from copy import deepcopy, copy
+from functools import lru_cache
+from typing import Dict, Union, Optional, List, Type, Tuple, Iterable
 
 from scs.incremental_parse import IncrementalParser, TokenGroup
 
-from .. import IncrementalParser, ParseFailure, SpecialToken, TokenGroup, EmptyTokenGroup
-from ..string_match import MultiStringMatchParser
-from .schema import JSONSchema, ObjectSchema, BaseType
+from .. import IncrementalParser, ParseFailure, SpecialToken, TokenGroup, EmptyTokenGroup, AllTokenGroup
+from ..combinators import AlternationParser
+from .schema import JSONSchema, ObjectSchema, UnionSchema, SchemaKind, KeyIndex, KeyTrieNode
 
 JSON_CHARS = ['{', '}', '[', ']', '"', ',']
+_DIGITS = re.compile(r"[0-9]+")
+_STRING_SPECIAL_CHARS = re.compile(r'["\\]')
+_PAD_CHAR = "_"  # fills strings up to their minimum length in completions
 
 
 class JSONParser(IncrementalParser):
@@ -56,6 +60,41 @@ class JSONParser(IncrementalParser):
         else:
             return self._subparser.get_parsed()
 
+    def is_complete(self) -> bool:
+        return self._complete
+
+    def get_completion(self) -> Optional[str]:
+        if self._subparser is None:
+            return _placeholder(self._schema)
+        return self._subparser.get_completion()
+
+    def _append_chunk(self, chars: str, start: int) -> Tuple[int, bool]:
+        if self._subparser is None or self._complete:
+            return super()._append_chunk(chars, start)
+        pos, done = self._subparser._append_chunk(chars, start)
+        if done:
+            self._parsed += self._subparser._parsed
+            self._complete = True
+        return pos, done
+
+    def fingerprint(self):
+        sub = self._subparser.fingerprint() if self._subparser else ()
+        if sub is None:
+            return None
+        return (JSONParser, self._schema, self._complete, sub)
+
+    r"""
+    Returns a fingerprint of what remains to be parsed, leaving out the parts of the schema
+    that were already parsed. Parsers of different schemas with equal remaining states accept
+    the same continuations"""
+    def remaining_state(self):
+        if self._subparser is None:
+            return self.fingerprint()
+        sub = _remaining_state(self._subparser)
+        if sub is None:
+            return None
+        return (JSONParser, self._complete, sub)
+
     def get_next(self) -> List[str]:
         if self._subparser:
             return self._subparser.get_next()
@@ -65,16 +104,51 @@ class JSONParser(IncrementalParser):
             return ["{"]
 
     def invalid_token_group(self):
+        if self._complete:
+            return AllTokenGroup
         if self._subparser:
             return self._subparser.invalid_token_group()
         return BeginWithNonJsonCharGroup
 
     def valid_token_group(self) -> List[TokenGroup]:
-        if self._subparser:
+        if self._subparser and not self._complete:
             return self._subparser.valid_token_group()
         return EmptyTokenGroup
 
 
+class UnionParser(AlternationParser):
+
+    r"""
+    Parses output following any alternative of a UnionSchema, failing once no alternative is
+    compatible with the parsed output. Alternatives are merged as soon as what remains of their
+    schemas is equal (e.g. objects sharing a prefix of keys, once the keys they differ on are
+    parsed), so the masks of the merged state are only computed once."""
+    def __init__(self, schema: UnionSchema = None):
+        super().__init__([JSONParser(schema=alternative) for alternative in schema.alternatives] if schema else [])
+        self._schema = schema
+
+    def _copy_from(self, other: "UnionParser"):
+        super()._copy_from(other)
+        self._schema = other._schema
+
+    def _merge_key(self, alternative: "JSONParser"):
+        return alternative.remaining_state()
+
+    def get_parsed(self) -> str:
+        return self._alternatives[0].get_parsed()
+
+    r"""
+    Returns the schemas of the alternatives still compatible with the parsed output"""
+    def surviving_schemas(self) -> List[JSONSchema]:
+        return [self._schema.alternatives[i] for source in self._sources for i in source]
+
+    def fingerprint(self):
+        keys = [self._merge_key(alternative) for alternative in self._alternatives]
+        if None in keys:
+            return None
+        return (UnionParser, frozenset(keys))
+
+
 class ObjectOrArrayParser(IncrementalParser):
     def __init__(
         self,
@@ -98,6 +172,18 @@ class ObjectOrArrayParser(IncrementalParser):
         if self._active_subparser:
             parsed += self._active_subparser.get_parsed()
         return parsed
+
+    def _append_chunk(self, chars: str, start: int) -> Tuple[int, bool]:
+        if self._active_subparser is None:
+            return super()._append_chunk(chars, start)
+        pos, done = self._active_subparser._append_chunk(chars, start)
+        if done:
+            self._close_subparser()
+            return pos, self._parse_status == ObjectParseStatus.PARSE_COMPLETE
+        return pos, False
+
+    def _subparser_fingerprint(self):
+        return self._active_subparser.fingerprint() if self._active_subparser else ()
     
     def invalid_token_group(self) -> Optional[Type]:
         if self._active_subparser:
@@ -118,39 +204,86 @@ class ObjectParser(ObjectOrArrayParser):
         super().__init__(schema=schema)
         self._schema: ObjectSchema
         self._parsed = SpecialChar.OPEN_OBJECT.value
-        self._current_key = None
-        self._schema_dict, self._remaining_required_keys, self._remaining_optional_keys = None, None, None
-        if self._schema:
-            self._schema_dict = {k.name: v.value_def for k, v in self._schema.get_items()}
-            self._remaining_required_keys = {k.name for k in self._schema.get_keys(optional=False)}
-            self._remaining_optional_keys = {k.name for k in self._schema.get_keys(optional=True)}
+        self._current_key: Optional[int] = None  # ordinal of the key being parsed
+        self._key_index: Optional[KeyIndex] = self._schema.key_index if self._schema else None
+        self._consumed_keys = 0  # bitset of parsed key ordinals
 
     @property
     def _current_value_schema(self) -> JSONSchema:
-        return self._schema_dict[self._current_key]
+        return self._key_index.values[self._current_key]
     
     @property
-    def _remaining_keys(self) -> List[str]:
-        return list(self._remaining_required_keys) + list(self._remaining_optional_keys)
+    def _remaining_keys(self) -> int:
+        return self._key_index.all_keys & ~self._consumed_keys
     
-    def _update_remaining(self, key: str):
-        try:
-            self._remaining_required_keys.remove(key)
-        except KeyError:
-            self._remaining_optional_keys.remove(key)
+    @property
+    def _allowed_keys(self) -> int:
+        remaining = self._remaining_keys
+        if not self._consumed_keys:
+            remaining &= self._key_index.first_keys
+        if not self._schema.ordered_keys:
+            return remaining
+        # only keys after the last parsed one, up to and including the next required key
+        remaining &= ~((1 << self._consumed_keys.bit_length()) - 1)
+        required = remaining & self._key_index.required_keys
+        if required:
+            next_required = required & -required
+            remaining &= (next_required << 1) - 1
+        return remaining
+
+    def _update_remaining(self, key: int):
+        self._consumed_keys |= 1 << key
     
     def _is_complete(self) -> bool:
-        return len(self._remaining_required_keys) == 0
+        return self._key_index.required_keys & ~self._consumed_keys == 0
 
     def _no_more_keys(self) -> bool:
-        return len(self._remaining_required_keys) + len(self._remaining_optional_keys) == 0
+        return self._allowed_keys == 0
     
+    def fingerprint(self):
+        sub = self._subparser_fingerprint()
+        if sub is None:
+            return None
+        return (
+            ObjectParser,
+            self._schema,
+            self._parse_status,
+            self._current_key,
+            self._consumed_keys,
+            sub,
+        )
+
+    r"""
+    Returns a fingerprint of what remains to be parsed: the keys left with their value schemas,
+    the key being parsed and its value parser. Keys are compared by name rather than ordinal,
+    so objects of different schemas are equal once the keys they differ on are consumed"""
+    def remaining_state(self):
+        status = self._parse_status
+        if self._schema.ordered_keys or status == ObjectParseStatus.IN_KEY_SUBPARSER:
+            return self.fingerprint()
+        sub = _remaining_state(self._active_subparser) if self._active_subparser else ()
+        if sub is None:
+            return None
+        current = None
+        if status in (ObjectParseStatus.FINISHED_KEY, ObjectParseStatus.AWAITING_VALUE, ObjectParseStatus.IN_VALUE_SUBPARSER):
+            current = (self._key_index.names[self._current_key], self._current_value_schema)
+        allowed = self._allowed_keys
+        keys = frozenset(
+            (
+                self._key_index.names[key],
+                self._key_index.values[key],
+                bool((self._key_index.required_keys >> key) & 1),
+                bool((allowed >> key) & 1),
+            )
+            for key in _bits(self._remaining_keys)
+        )
+        return (ObjectParser, status, current, keys, sub)
+
     def _copy_from(self, other: "ObjectParser"):
         super()._copy_from(other)
         self._current_key = other._current_key
-        self._schema_dict = copy(other._schema_dict)
-        self._remaining_required_keys = copy(other._remaining_required_keys)
-        self._remaining_optional_keys = copy(other._remaining_optional_keys)
+        self._key_index = other._key_index
+        self._consumed_keys = other._consumed_keys
 
     r"""
     Opens a subparser and sends characters to it to begin parsing.
@@ -161,18 +294,11 @@ class ObjectParser(ObjectOrArrayParser):
                 if char != SpecialChar.OPEN_ARRAY.value:
                     raise ParseFailure(f"Expected '[' got {char}")
                 self._active_subparser = ArrayParser(schema=self._current_value_schema)
-            elif char == SpecialChar.OPEN_OBJECT.value and isinstance(self._current_value_schema, ObjectSchema):
-                self._active_subparser = ObjectParser(schema=self._current_value_schema)
-            elif char == SpecialChar.QUOTE.value and self._current_value_schema == BaseType.STRING.schema():
-                self._active_subparser = StringParser()
-            elif char.isnumeric() and self._current_value_schema == BaseType.NUMBER.schema():
-                self._active_subparser = NumberParser()
-                self._active_subparser._append(char)
             else:
-                raise ParseFailure(f"Expected start of value, got {char}")
+                self._active_subparser = _open_item_parser(self._current_value_schema, char)
             self._parse_status = ObjectParseStatus.IN_VALUE_SUBPARSER
         elif self._parse_status == ObjectParseStatus.AWAITING_KEY and char == SpecialChar.QUOTE.value:
-            self._active_subparser = MultiStringMatchParser(match_strings=self._remaining_keys)
+            self._active_subparser = KeyParser(self._key_index.trie, allowed_keys=self._allowed_keys)
             self._parse_status = ObjectParseStatus.IN_KEY_SUBPARSER
         else:
             raise ParseFailure(f"Invalid parse status for opening subparser: {self._parse_status}")
@@ -205,8 +331,8 @@ class ObjectParser(ObjectOrArrayParser):
             self._update_remaining(self._current_key)
             self._parse_status = ObjectParseStatus.FINISHED_VALUE
         else:
-            # defer updating parse status to FINISHED_KEY until we receive closing quote
-            self._current_key = self._active_subparser._parsed
+            self._current_key = self._active_subparser.key
+            self._parse_status = ObjectParseStatus.FINISHED_KEY
         self._active_subparser = None
 
     def _append(self, char: str) -> bool:
@@ -222,7 +348,7 @@ class ObjectParser(ObjectOrArrayParser):
                 "Got whitespace in JSON body"
             )
         
-        remaining_keys = self._remaining_keys
+        remaining_keys = self._allowed_keys
 
         if self._parse_status == ObjectParseStatus.OPENED:
             if char == SpecialChar.CLOSE_OBJECT.value:
@@ -235,7 +361,7 @@ class ObjectParser(ObjectOrArrayParser):
             if char == SpecialChar.QUOTE.value:
                 if not remaining_keys:
                     raise ParseFailure("No keys remaining to parse")
-                self._active_subparser = MultiStringMatchParser(match_strings=remaining_keys)
+                self._active_subparser = KeyParser(self._key_index.trie, allowed_keys=remaining_keys)
                 self._parse_status = ObjectParseStatus.IN_KEY_SUBPARSER
                 return False
             raise ParseFailure(f"Expected '}}' or '\"', got {char}")
@@ -261,38 +387,106 @@ class ObjectParser(ObjectOrArrayParser):
                 self._parse_status = ObjectParseStatus.AWAITING_VALUE
                 return False
             raise ParseFailure(f"Expected ':', got {char}")
-        
-        if self._parse_status == ObjectParseStatus.IN_KEY_SUBPARSER:
-            if char == SpecialChar.QUOTE.value:
-                self._parsed += char
-                self._parse_status = ObjectParseStatus.FINISHED_KEY
-                return False
-            raise ParseFailure(f"Expected '\"' after parsed key, got {char}")
 
         raise Exception("Something went wrong")
     
-    def _value_prefix(self) -> str:
-        prefix = ""
-        if self._current_value_schema._is_list:
-            prefix = "["
-        if isinstance(self._current_value_schema, ObjectSchema):
-            return f'{prefix}{{"'
-        elif self._current_value_schema == BaseType.NUMBER.schema(is_list=True):
-            return prefix
-        elif self._current_value_schema == BaseType.STRING.schema(is_list=True):
-            return f'{prefix}"'
+    def _value_prefix(self, key: int) -> str:
+        schema = self._key_index.values[key]
+        if schema._is_list:
+            return SpecialChar.OPEN_ARRAY.value + _first_item_prefix(schema)
+        return _item_prefix(schema)
+
+    r"""
+    Returns the shortest string completing the object once the keys in `consumed_keys` have
+    been parsed, starting after a value if `after_value` or else where a key may begin"""
+    def _closing(self, consumed_keys: int, after_value: bool) -> str:
+        missing = self._key_index.required_keys & ~consumed_keys
+        if not missing:
+            return SpecialChar.CLOSE_OBJECT.value
+        pairs = _placeholder_pairs(self._key_index, missing) + SpecialChar.CLOSE_OBJECT.value
+        return SpecialChar.COMMA.value + pairs if after_value else pairs
+
+    def _completion_after_key(self, key: int) -> str:
+        consumed = self._consumed_keys | (1 << key)
+        return _placeholder(self._key_index.values[key]) + self._closing(consumed, after_value=True)
+
+    def _completion_with_key(self, key: int, key_suffix: str) -> str:
+        return key_suffix + SpecialChar.QUOTE.value + SpecialChar.COLON.value + self._completion_after_key(key)
+
+    def get_completion(self) -> Optional[str]:
+        status = self._parse_status
+        if status == ObjectParseStatus.PARSE_COMPLETE:
+            return ""
+        if status == ObjectParseStatus.IN_VALUE_SUBPARSER:
+            completion = self._active_subparser.get_completion()
+            if completion is None:
+                return None
+            return completion + self._closing(self._consumed_keys | (1 << self._current_key), after_value=True)
+        if status == ObjectParseStatus.IN_KEY_SUBPARSER:
+            return min(
+                (
+                    self._completion_with_key(key, suffix)
+                    for suffix, key in self._active_subparser.get_key_completions()
+                ),
+                key=len,
+            )
+        if status == ObjectParseStatus.FINISHED_KEY:
+            return SpecialChar.COLON.value + self._completion_after_key(self._current_key)
+        if status == ObjectParseStatus.AWAITING_VALUE:
+            return self._completion_after_key(self._current_key)
+        if status == ObjectParseStatus.FINISHED_VALUE:
+            return self._closing(self._consumed_keys, after_value=True)
+        if status == ObjectParseStatus.AWAITING_KEY and not self._key_index.required_keys & ~self._consumed_keys:
+            # a key must follow the comma, complete with the cheapest remaining one
+            return SpecialChar.QUOTE.value + min(
+                (
+                    self._completion_with_key(key, self._key_index.names[key])
+                    for key in _bits(self._allowed_keys)
+                ),
+                key=len,
+            )
+        return self._closing(self._consumed_keys, after_value=False)  # OPENED or AWAITING_KEY
+
+    r"""
+    Returns every way to continue: each allowed key span (key, colon and value prefix) after
+    `separator`, and the closing brace if `can_close` and all required keys are parsed. Only used
+    with ordered keys, where few keys are allowed at a time"""
+    def _ordered_continuations(self, separator: str, can_close: bool) -> List[str]:
+        continuations = [
+            f'{separator}"{self._key_index.names[key]}":{self._value_prefix(key)}'
+            for key in _bits(self._allowed_keys)
+        ]
+        if can_close and self._is_complete():
+            continuations += [SpecialChar.CLOSE_OBJECT.value]
+        return continuations
 
     def get_next(self) -> List[str]:
+        ordered = self._schema.ordered_keys
         if self._active_subparser:
+            if ordered and self._parse_status == ObjectParseStatus.IN_KEY_SUBPARSER:
+                return [
+                    f'{suffix}":{self._value_prefix(key)}'
+                    for suffix, key in self._active_subparser.get_key_completions()
+                ]
             return self._active_subparser.get_next()
-        elif self._parse_status in [ObjectParseStatus.OPENED, ObjectParseStatus.AWAITING_KEY]:
+        elif self._parse_status == ObjectParseStatus.OPENED:
+            if ordered:
+                return self._ordered_continuations("", can_close=True)
+            if self._key_index.required_keys:
+                return ['"']
+            return ['}'] if not self._key_index.all_keys else []
+        elif self._parse_status == ObjectParseStatus.AWAITING_KEY:
+            if ordered:
+                return self._ordered_continuations("", can_close=False)
             return ['"']
         elif self._parse_status == ObjectParseStatus.AWAITING_VALUE:
-            prefix = self._value_prefix()
+            prefix = self._value_prefix(self._current_key)
             return [prefix] if prefix else []
         elif self._parse_status == ObjectParseStatus.FINISHED_KEY:
-            prefix = self._value_prefix()
+            prefix = self._value_prefix(self._current_key)
             return [f':{prefix}']
+        elif self._parse_status == ObjectParseStatus.FINISHED_VALUE and ordered:
+            return self._ordered_continuations(SpecialChar.COMMA.value, can_close=True)
         else:
             return []
 
@@ -304,17 +498,35 @@ class ArrayParser(ObjectOrArrayParser):
     ):
         super().__init__(schema=schema)
         self._parsed = SpecialChar.OPEN_ARRAY.value
+        self._num_items = 0  # number of items opened so far
+
+    def _copy_from(self, other: "ArrayParser"):
+        super()._copy_from(other)
+        self._num_items = other._num_items
+
+    @property
+    def _bounded(self) -> bool:
+        return self._schema.min_items > 0 or self._schema.max_items is not None
+
+    def _can_add_item(self) -> bool:
+        return self._schema.max_items is None or self._num_items < self._schema.max_items
+
+    def _can_close(self) -> bool:
+        return self._num_items >= self._schema.min_items
+
+    def fingerprint(self):
+        sub = self._subparser_fingerprint()
+        if sub is None:
+            return None
+        # the item count only affects unbounded arrays through their content
+        num_items = self._num_items if self._bounded else None
+        return (ArrayParser, self._schema, self._parse_status, num_items, sub)
 
     def _open_subparser(self, char: str):
-        if char == SpecialChar.OPEN_OBJECT.value and isinstance(self._schema, ObjectSchema):
-            self._active_subparser = ObjectParser(schema=self._schema)
-        elif char == SpecialChar.QUOTE.value and self._schema == BaseType.STRING.schema(is_list=True):
-            self._active_subparser = StringParser()
-        elif char.isnumeric() and self._schema == BaseType.NUMBER.schema(is_list=True):
-            self._active_subparser = NumberParser()
-            self._active_subparser._append(char)
-        else:
-            raise ParseFailure(f"Expected start of value, got {char}")
+        if not self._can_add_item():
+            raise ParseFailure(f"Array exceeds maximum of {self._schema.max_items} items")
+        self._active_subparser = _open_item_parser(self._schema, char)
+        self._num_items += 1
         self._parse_status = ObjectParseStatus.IN_VALUE_SUBPARSER
 
     def _close_subparser(self):
@@ -326,8 +538,12 @@ class ArrayParser(ObjectOrArrayParser):
             # infer current parse state based on how number parsing was terminated
             self._parsed += self._active_subparser.closing_char
             if self._active_subparser.closing_char == SpecialChar.COMMA.value:
+                if not self._can_add_item():
+                    raise ParseFailure(f"Array exceeds maximum of {self._schema.max_items} items")
                 self._parse_status = ObjectParseStatus.AWAITING_VALUE
             elif self._active_subparser.closing_char == SpecialChar.CLOSE_ARRAY.value:
+                if not self._can_close():
+                    raise ParseFailure(f"Array has fewer than {self._schema.min_items} items")
                 self._parse_status = ObjectParseStatus.PARSE_COMPLETE
             else:
                 raise ParseFailure(
@@ -352,6 +568,8 @@ class ArrayParser(ObjectOrArrayParser):
 
         if self._parse_status == ObjectParseStatus.OPENED:
             if char == SpecialChar.CLOSE_ARRAY.value:
+                if not self._can_close():
+                    raise ParseFailure(f"Array has fewer than {self._schema.min_items} items")
                 self._parsed += char
                 return True
             self._open_subparser(char)
@@ -364,11 +582,11 @@ class ArrayParser(ObjectOrArrayParser):
             return False
 
         if self._parse_status == ObjectParseStatus.FINISHED_VALUE:
-            if char == SpecialChar.COMMA.value:
+            if char == SpecialChar.COMMA.value and self._can_add_item():
                 self._parsed += char
                 self._parse_status = ObjectParseStatus.AWAITING_VALUE
                 return False
-            if char == SpecialChar.CLOSE_ARRAY.value:
+            if char == SpecialChar.CLOSE_ARRAY.value and self._can_close():
                 self._parsed += char
                 self._parse_status = ObjectParseStatus.PARSE_COMPLETE
                 return True
@@ -377,25 +595,210 @@ class ArrayParser(ObjectOrArrayParser):
         raise Exception("Something went wrong")
     
     def _value_prefix(self) -> str:
-        if isinstance(self._schema, ObjectSchema):
-            return '{"'
-        elif self._schema == BaseType.NUMBER.schema(is_list=True):
+        return _item_prefix(self._schema)
+
+    r"""
+    Returns the placeholder items, each preceded by a comma, still needed to reach the minimum
+    item count once `num_items` items have been parsed"""
+    def _padding(self, num_items: int) -> str:
+        missing = max(self._schema.min_items - num_items, 0)
+        return (SpecialChar.COMMA.value + _placeholder(self._schema, item=True)) * missing
+
+    def get_completion(self) -> Optional[str]:
+        status = self._parse_status
+        if status == ObjectParseStatus.PARSE_COMPLETE:
             return ""
-        elif self._schema == BaseType.STRING.schema(is_list=True):
-            return '"'
+        if status == ObjectParseStatus.IN_VALUE_SUBPARSER:
+            completion = self._active_subparser.get_completion()
+            if completion is None:
+                return None
+            return completion + self._padding(self._num_items) + SpecialChar.CLOSE_ARRAY.value
+        if status == ObjectParseStatus.AWAITING_VALUE:  # an item must follow the comma
+            item = _placeholder(self._schema, item=True)
+            return item + self._padding(self._num_items + 1) + SpecialChar.CLOSE_ARRAY.value
+        if status == ObjectParseStatus.OPENED:
+            return _placeholder(self._schema)[1:]
+        return self._padding(self._num_items) + SpecialChar.CLOSE_ARRAY.value
     
     def get_next(self) -> List[str]:
         if self._active_subparser:
             return self._active_subparser.get_next()
         elif self._parse_status == ObjectParseStatus.FINISHED_VALUE:
+            if not self._can_add_item():
+                return [SpecialChar.CLOSE_ARRAY.value]
+            if not self._can_close():
+                return [SpecialChar.COMMA.value + self._value_prefix()]
             return []
-        elif self._parse_status in [ObjectParseStatus.OPENED, ObjectParseStatus.AWAITING_VALUE]:
+        elif self._parse_status == ObjectParseStatus.OPENED:
+            prefix = _first_item_prefix(self._schema)
+            return [prefix] if prefix else []
+        elif self._parse_status == ObjectParseStatus.AWAITING_VALUE:
             prefix = self._value_prefix()
             return [prefix] if prefix else []
         else:
             return []
 
 
+r"""
+Opens the parser for a single (non-list) value of `schema`, beginning with `char`"""
+def _open_item_parser(schema: JSONSchema, char: str) -> IncrementalParser:
+    kind = schema.kind
+    if kind == SchemaKind.OBJECT and char == SpecialChar.OPEN_OBJECT.value:
+        return ObjectParser(schema=schema)
+    if kind == SchemaKind.STRING and char == SpecialChar.QUOTE.value:
+        return StringParser(min_length=schema.min_length, max_length=schema.max_length)
+    if kind == SchemaKind.ENUM and char == SpecialChar.QUOTE.value:
+        return EnumParser(schema.trie, allowed_keys=schema.all_options)
+    if kind == SchemaKind.NUMBER and char.isnumeric():
+        parser = NumberParser()
+        parser._append(char)
+        return parser
+    raise ParseFailure(f"Expected start of value, got {char}")
+
+
+r"""
+Returns the characters that must begin a single (non-list) value of `schema`"""
+def _item_prefix(schema: JSONSchema) -> str:
+    kind = schema.kind
+    if kind == SchemaKind.OBJECT:
+        if schema.key_index.required_keys:
+            return '{"'
+        return SpecialChar.OPEN_OBJECT.value
+    if kind in [SchemaKind.STRING, SchemaKind.ENUM]:
+        return SpecialChar.QUOTE.value
+    return ""
+
+
+r"""
+Returns the characters that must begin the first item of the list `schema`, right after its
+opening bracket. Nothing is forced while the list may still be empty"""
+def _first_item_prefix(schema: JSONSchema) -> str:
+    if schema.min_items > 0:
+        return _item_prefix(schema)
+    if schema.max_items == 0:
+        return SpecialChar.CLOSE_ARRAY.value
+    return ""
+
+
+r"""
+Returns the shortest valid value of `schema`, or of a single item of `schema` if `item`"""
+def _placeholder(schema: JSONSchema, item: bool = False) -> str:
+    if schema._is_list and not item:
+        items = SpecialChar.COMMA.value.join([_placeholder(schema, item=True)] * schema.min_items)
+        return SpecialChar.OPEN_ARRAY.value + items + SpecialChar.CLOSE_ARRAY.value
+    kind = schema.kind
+    if kind == SchemaKind.OBJECT:
+        key_index = schema.key_index
+        return (
+            SpecialChar.OPEN_OBJECT.value
+            + _placeholder_pairs(key_index, key_index.required_keys)
+            + SpecialChar.CLOSE_OBJECT.value
+        )
+    if kind == SchemaKind.STRING:
+        return SpecialChar.QUOTE.value + _PAD_CHAR * schema.min_length + SpecialChar.QUOTE.value
+    if kind == SchemaKind.ENUM:
+        return SpecialChar.QUOTE.value + min(schema.options, key=len) + SpecialChar.QUOTE.value
+    return SpecialChar.ZERO.value
+
+
+def _placeholder_pairs(key_index: KeyIndex, keys: int) -> str:
+    return SpecialChar.COMMA.value.join(
+        f'"{key_index.names[key]}":{_placeholder(key_index.values[key])}' for key in _bits(keys)
+    )
+
+
+def _remaining_state(parser: IncrementalParser):
+    if isinstance(parser, (JSONParser, ObjectParser)):
+        return parser.remaining_state()
+    return parser.fingerprint()
+
+
+def _bits(bitset: int) -> Iterable[int]:
+    i = 0
+    while bitset:
+        if bitset & 1:
+            yield i
+        bitset >>= 1
+        i += 1
+
+
+class KeyParser(IncrementalParser):
+
+    r"""
+    Parses an object key (after its opening quote, up to and including its closing quote)
+    by walking the schema's key trie. Only keys in the `allowed_keys` bitset are accepted."""
+    def __init__(self, trie: KeyTrieNode = None, allowed_keys: int = 0) -> None:
+        super().__init__()
+        self._parsed = SpecialChar.QUOTE.value
+        self._node = trie
+        self._allowed_keys = allowed_keys
+        self.key: Optional[int] = None  # ordinal of the parsed key once closed
+
+    def _copy_from(self, other: "KeyParser"):
+        super()._copy_from(other)
+        self._node = other._node
+        self._allowed_keys = other._allowed_keys
+
+    def fingerprint(self):
+        return (KeyParser, self._node, self._allowed_keys)  # the node compares by identity
+
+    def _append_chunk(self, chars: str, start: int) -> Tuple[int, bool]:
+        # walk the trie over the chunk until the closing quote or a mismatch
+        node = self._node
+        pos = start
+        while pos < len(chars) and (chars[pos] != SpecialChar.QUOTE.value or node.escaped):
+            child = node.children.get(chars[pos])
+            if child is None or not child.reach & self._allowed_keys:
+                break
+            node = child
+            pos += 1
+        if pos == start:
+            return super()._append_chunk(chars, start)
+        self._parsed += chars[start:pos]
+        self._node = node
+        return pos, False
+
+    def _append(self, char: str) -> bool:
+        if char == SpecialChar.QUOTE.value and not self._node.escaped:
+            ordinal = self._node.ordinal
+            if ordinal is None or not (self._allowed_keys >> ordinal) & 1:
+                raise ParseFailure(f"Invalid key {self._parsed[1:]}")
+            self._parsed += char
+            self.key = ordinal
+            return True
+        child = self._node.children.get(char)
+        if child is None or not child.reach & self._allowed_keys:
+            raise ParseFailure(f"No remaining key matches {self._parsed[1:] + char}")
+        self._node = child
+        self._parsed += char
+        return False
+
+    r"""
+    Returns (remaining characters, ordinal) for every allowed key matching the parsed prefix"""
+    def get_key_completions(self) -> List[Tuple[str, int]]:
+        return [
+            (suffix, ordinal)
+            for suffix, ordinal in self._node.completions()
+            if (self._allowed_keys >> ordinal) & 1
+        ]
+
+    def get_next(self) -> List[str]:
+        return [suffix + SpecialChar.QUOTE.value for suffix, _ in self.get_key_completions()]
+
+
+class EnumParser(KeyParser):
+
+    r"""
+    Parses a string enum value (after its opening quote, up to and including its closing quote)
+    by walking the trie of the enum's options. Once a single option matches the parsed prefix,
+    the rest of it is forced"""
+    def fingerprint(self):
+        return (EnumParser, self._node, self._allowed_keys)
+
+    def get_completion(self) -> Optional[str]:
+        return min((suffix for suffix, _ in self.get_key_completions()), key=len) + SpecialChar.QUOTE.value
+
+
 class NumberParser(IncrementalParser):
     _END_CHARS = [",", "]", "}"]
 
@@ -412,9 +815,24 @@ class NumberParser(IncrementalParser):
         self._leading_zero = other._leading_zero
         self._is_valid = other._is_valid
 
+    def fingerprint(self):
+        return (NumberParser, self._has_period, self._leading_zero, self._is_valid, len(self._parsed) > 0)
+
+    def get_completion(self) -> Optional[str]:
+        # the parent's completion begins with the character closing the number
+        return "" if self._is_valid else SpecialChar.ZERO.value
+
+    def _append_chunk(self, chars: str, start: int) -> Tuple[int, bool]:
+        digits = _DIGITS.match(chars, start)
+        if digits is None or self._leading_zero or (not self._parsed and chars[start] == SpecialChar.ZERO.value):
+            return super()._append_chunk(chars, start)  # leading zeros are handled char by char
+        self._parsed += digits.group()
+        self._is_valid = True
+        return digits.end(), False
+
     def _append(self, char: str) -> bool:
         if self._leading_zero:
-            if char != SpecialChar.PERIOD.value:
+            if char.isnumeric():
                 raise ParseFailure("Leading 0 in integer value")
             self._leading_zero = False
         if char.isnumeric():
@@ -448,31 +866,93 @@ class NumberParser(IncrementalParser):
         return InvalidFloatTokenGroup
 
     def valid_token_group(self) -> Optional[Type[TokenGroup]]:
+        if self._leading_zero:  # only '.' may follow a leading 0
+            return EmptyTokenGroup
         return NumericTokenGroup
 
 
 class StringParser(IncrementalParser):
-    def __init__(self) -> None:
+
+    r"""
+    Parses a string value after its opening quote. The length of the content is bounded by
+    `min_length` and `max_length`, counting each escape sequence's backslash as part of the
+    escaped character"""
+    def __init__(self, min_length: int = 0, max_length: Optional[int] = None) -> None:
         super().__init__()
         self._parsed = '"'
         self._escape_next = False
+        self._min_length = min_length
+        self._max_length = max_length
+        self._length = 0
 
     def _copy_from(self, other: "StringParser"):
         super()._copy_from(other)
         self._escape_next = other._escape_next
+        self._min_length = other._min_length
+        self._max_length = other._max_length
+        self._length = other._length
+
+    @property
+    def _bounded(self) -> bool:
+        return self._min_length > 0 or self._max_length is not None
+
+    @property
+    def _at_max_length(self) -> bool:
+        return self._max_length is not None and self._length >= self._max_length
+
+    def fingerprint(self):
+        if not self._bounded:
+            return (StringParser, self._escape_next)
+        # past the minimum, only the remaining room matters
+        length = self._length if self._length < self._min_length else self._min_length
+        room = None if self._max_length is None else self._max_length - self._length
+        return (StringParser, self._escape_next, self._min_length, length, room)
+
+    def get_completion(self) -> Optional[str]:
+        length = self._length
+        completion = ""
+        if self._escape_next:  # the first quote is escaped
+            completion = SpecialChar.QUOTE.value
+            length += 1
+        return completion + _PAD_CHAR * max(self._min_length - length, 0) + SpecialChar.QUOTE.value
+
+    def _append_chunk(self, chars: str, start: int) -> Tuple[int, bool]:
+        if self._escape_next:
+            return super()._append_chunk(chars, start)
+        # jump to the next quote or escape character
+        special = _STRING_SPECIAL_CHARS.search(chars, start)
+        end = special.start() if special else len(chars)
+        if self._max_length is not None:
+            end = min(end, start + self._max_length - self._length)
+        if end <= start:
+            return super()._append_chunk(chars, start)
+        self._parsed += chars[start:end]
+        self._length += end - start
+        return end, False
 
     def _append(self, char: str) -> bool:
         if self._escape_next:
             self._parsed += char
             self._escape_next = False
+            self._length += 1
         elif char == SpecialChar.QUOTE.value:
+            if self._length < self._min_length:
+                raise ParseFailure(f"String shorter than minimum length {self._min_length}")
             self._parsed += char
             return True
+        elif self._at_max_length:
+            raise ParseFailure(f"String exceeds maximum length {self._max_length}")
         elif char == SpecialChar.ESCAPE.value:
             self._escape_next = True
         else:
             self._parsed += char
+            self._length += 1
         return False
+
+    def get_next(self) -> List[str]:
+        if self._at_max_length:
+            return [SpecialChar.QUOTE.value]
+        return []
     
     def invalid_token_group(self) -> Optional[Type[TokenGroup]]:
         return EmptyTokenGroup  # all token types allowed
@@ -480,7 +960,9 @@ class StringParser(IncrementalParser):
     def valid_token_group(self) -> Optional[Type[TokenGroup]]:
         # if token contains no quotes it will never close the string parser
         # and is guaranteed to be valid all the way through
-        return NoQuoteCharGroup
+        if self._max_length is None:
+            return NoQuoteCharGroup
+        return bounded_no_quote_char_group(self._max_length - self._length)
 
 
 class SpecialChar(Enum):
@@ -532,7 +1014,7 @@ class InvalidFloatTokenGroup(TokenGroup):
             return False
         period = False
         for c in token:
-            if not token.isnumeric():
+            if not c.isnumeric():
                 if c == ".":
                     if period:
                         return True
@@ -549,6 +1031,13 @@ class BeginWithNonJsonCharGroup(TokenGroup):
         return token[0] not in JSON_CHARS
 
 
+class NonValueStartGroup(TokenGroup):
+
+    @staticmethod
+    def filter(token: str) -> bool:
+        return token[0] not in JSON_CHARS and not token[0].isnumeric()
+
+
 class NoQuoteCharGroup(TokenGroup):
 
     @staticmethod
@@ -557,3 +1046,20 @@ class NoQuoteCharGroup(TokenGroup):
             if c == SpecialChar.QUOTE.value:
                 return False
         return True            
+
+
+r"""
+Returns the group of tokens containing no quotes and at most `max_length` characters. These fit
+in a string with `max_length` characters of room left. Groups are created once per length and
+expose `max_length` so handlers can reuse the NoQuoteCharGroup split when every token fits"""
+@lru_cache(maxsize=None)
+def bounded_no_quote_char_group(max_length: int) -> Type[TokenGroup]:
+
+    class BoundedNoQuoteCharGroup(NoQuoteCharGroup):
+
+        @staticmethod
+        def filter(token: str) -> bool:
+            return len(token) <= max_length and NoQuoteCharGroup.filter(token)
+
+    BoundedNoQuoteCharGroup.max_length = max_length
+    return BoundedNoQuoteCharGroup
@@ -1,4 +1,8 @@
+import re
+import copy
 from enum import Enum
+from threading import Lock
+from weakref import WeakValueDictionary
 from typing import Dict, Union, Optional, List, Tuple, Iterable
 from dataclasses import dataclass
 
@@ -8,6 +12,9 @@ from .. import IncrementalParser, ParseFailure, SpecialToken
 from ..string_match import StringMatchParser
 
 
+_LENGTH_BOUNDS = re.compile(r"\s*(\d*)\s*(?:(\.\.)\s*(\d*)\s*)?")
+
+
 def isalpha(char: str) -> bool:
     return char.isalpha() or char == '_'    
 
@@ -21,35 +28,44 @@ class SchemaValueParser(IncrementalParser):
 
 class ObjectSchemaParser(SchemaValueParser):
 
-    def __init__(self):
+    r"""
+    Parses an object schema. With `ordered_keys`, the keys of this and every nested object
+    schema must appear in declaration order."""
+    def __init__(self, ordered_keys: bool = False):
         super().__init__()
-        self.value: ObjectSchema = ObjectSchema()
+        self._ordered_keys = ordered_keys
+        self.value: ObjectSchema = ObjectSchema(ordered_keys=ordered_keys)
         self._parsed = SpecialChar.OPEN_OBJECT.value
         self._parse_status: ObjectParseStatus = ObjectParseStatus.OPENED
         self._active_subparser: Optional[SchemaValueParser] = None
         self._curr_key: JSONKey = None
-        self._curr_value_basetype: BaseTypeSchema = None
+        self._curr_value_basetype: BaseType = None
         self._array_set = False
+        self._array_bounds: Tuple[int, Optional[int]] = (0, None)
+        self._string_bounds: Tuple[int, Optional[int]] = (0, None)
 
     r"""
     Opens a subparser and sends characters to it to begin parsing.
     Previous subparser should be closed before this is called."""
     def _open_subparser(self, char: str, array_set: bool = False):
         if char == SpecialChar.OPEN_OBJECT.value:  # begin parsing nested schema
-            self._active_subparser = ObjectSchemaParser()
+            self._active_subparser = ObjectSchemaParser(ordered_keys=self._ordered_keys)
             self._parse_status = ObjectParseStatus.IN_VALUE_SUBPARSER
         elif (not array_set) and char == ControlSequences.ARRAY.value[0]:  # begin parsing array control sequence
-            self._active_subparser = StringMatchParser(ControlSequences.ARRAY.value, nocase=True)
-            self._active_subparser._append(char)
+            self._active_subparser = LengthBoundsParser(close_char=ControlSequences.ARRAY.value[1])
             self._parse_status = ObjectParseStatus.IN_ARRAY_CTR_SEQ_SUBPARSER
         elif char == ControlSequences.STRING.value[0]:
             self._active_subparser = StringMatchParser(ControlSequences.STRING.value, nocase=True)
-            self._curr_value_basetype = BaseTypeSchema(BaseType.STRING)
+            self._curr_value_basetype = BaseType.STRING
             self._active_subparser._append(char)
             self._parse_status = ObjectParseStatus.IN_VALUE_SUBPARSER
         elif char == ControlSequences.NUMBER.value[0]:
             self._active_subparser = StringMatchParser(ControlSequences.NUMBER.value, nocase=True)
-            self._curr_value_basetype = BaseTypeSchema(BaseType.NUMBER)
+            self._curr_value_basetype = BaseType.NUMBER
+            self._active_subparser._append(char)
+            self._parse_status = ObjectParseStatus.IN_VALUE_SUBPARSER
+        elif char == ControlSequences.ONE_OF.value[0]:
+            self._active_subparser = OneOfSchemaParser()
             self._active_subparser._append(char)
             self._parse_status = ObjectParseStatus.IN_VALUE_SUBPARSER
         else:
@@ -63,16 +79,17 @@ class ObjectSchemaParser(SchemaValueParser):
         self._parsed += parsed
         if self._parse_status == ObjectParseStatus.IN_ARRAY_CTR_SEQ_SUBPARSER:
             self._array_set = True
+            self._array_bounds = self._active_subparser.bounds
             self._parse_status = ObjectParseStatus.AWAITING_OBJECT
+        elif self._parse_status == ObjectParseStatus.IN_BOUNDS_SUBPARSER:
+            self._string_bounds = self._active_subparser.bounds
+            self._add_value()
         elif self._parse_status == ObjectParseStatus.IN_VALUE_SUBPARSER:
-            self._parse_status = ObjectParseStatus.FINISHED_VALUE
-            assert self._curr_key is not None
-            value = self._curr_value_basetype if self._curr_value_basetype is not None else self._active_subparser.value
-            value._is_list = self._array_set
-            self.value.add_prop(key=self._curr_key, value=JSONValue(value))
-            self._curr_key = None
-            self._curr_value_basetype = None
-            self._array_set = False
+            if self._curr_value_basetype == BaseType.STRING:
+                # wait for the next character to see whether length bounds follow
+                self._parse_status = ObjectParseStatus.FINISHED_BASETYPE
+            else:
+                self._add_value()
         else:  # IN_KEY_SUBPARSER
             if char == SpecialChar.OPTIONAL.value:
                 # TODO set optional on current key
@@ -85,6 +102,32 @@ class ObjectSchemaParser(SchemaValueParser):
                 raise ParseFailure(f"Invalid char following key name {char}")
         self._active_subparser = None
 
+    r"""
+    Adds the value parsed for the current key to the schema"""
+    def _add_value(self):
+        assert self._curr_key is not None
+        min_items, max_items = self._array_bounds
+        if self._curr_value_basetype is not None:
+            min_length, max_length = self._string_bounds
+            value = self._curr_value_basetype.schema(
+                is_list=self._array_set,
+                min_items=min_items,
+                max_items=max_items,
+                min_length=min_length,
+                max_length=max_length,
+            )
+        else:
+            value = self._active_subparser.value
+            value._is_list = self._array_set
+            value.min_items, value.max_items = min_items, max_items
+        self.value.add_prop(key=self._curr_key, value=JSONValue(value))
+        self._parse_status = ObjectParseStatus.FINISHED_VALUE
+        self._curr_key = None
+        self._curr_value_basetype = None
+        self._array_set = False
+        self._array_bounds = (0, None)
+        self._string_bounds = (0, None)
+
     def _append(self, char: str) -> bool:
         if self._active_subparser is not None:
             done = self._active_subparser._append(char)
@@ -96,6 +139,13 @@ class ObjectSchemaParser(SchemaValueParser):
         if char.isspace():
             return False
 
+        if self._parse_status == ObjectParseStatus.FINISHED_BASETYPE:
+            if char == SpecialChar.OPEN_BOUNDS.value:
+                self._active_subparser = LengthBoundsParser(close_char=SpecialChar.CLOSE_BOUNDS.value)
+                self._parse_status = ObjectParseStatus.IN_BOUNDS_SUBPARSER
+                return False
+            self._add_value()
+
         if self._parse_status in [ObjectParseStatus.OPENED, ObjectParseStatus.AWAITING_KEY]:
             if char == SpecialChar.CLOSE_OBJECT.value:
                 self._parsed += char
@@ -141,8 +191,8 @@ class JSONSchemaParser(ObjectSchemaParser):
     """
     Parser for outer JSON. Effectively an ObjectSchemaParser that is initialized with AWAITING_VALUE status
     and closes once the first value has been parsed."""
-    def __init__(self):
-        super().__init__()
+    def __init__(self, ordered_keys: bool = False):
+        super().__init__(ordered_keys=ordered_keys)
         self._curr_key = JSONKey("")
         self._parsed = ""
         self._parse_status: ObjectParseStatus = ObjectParseStatus.AWAITING_VALUE
@@ -154,6 +204,10 @@ class JSONSchemaParser(ObjectSchemaParser):
             if (isinstance(char, str) and char.isspace()) or char == SpecialToken.EOS:
                 return True
             raise ParseFailure("Got EOS before schema was complete")
+        if char == SpecialToken.EOS and self._parse_status == ObjectParseStatus.FINISHED_BASETYPE:
+            self._add_value()
+            self._done = True
+            return True
         super()._append(char)
         if self._parse_status == ObjectParseStatus.FINISHED_VALUE:
             self._done = True
@@ -161,6 +215,9 @@ class JSONSchemaParser(ObjectSchemaParser):
         return False
     
     def get_schema(self) -> "JSONSchema":
+        if self._parse_status == ObjectParseStatus.FINISHED_BASETYPE:  # no length bounds followed
+            self._add_value()
+            self._done = True
         for _, value in self.value._child_schemas:
             return value.value_def
 
@@ -182,52 +239,242 @@ class PropNameParser(IncrementalParser):
         return False
 
 
+class LengthBoundsParser(IncrementalParser):
+
+    r"""
+    Parses length bounds following their opening character, up to and including `close_char`.
+    Bounds are written `min..max`, where either side may be omitted, or as a single exact length.
+    Nothing between the brackets leaves the length unbounded."""
+    def __init__(self, close_char: str = "]") -> None:
+        super().__init__()
+        self._close_char = close_char
+        self.bounds: Tuple[int, Optional[int]] = (0, None)
+
+    def _append(self, char: str) -> bool:
+        if char == self._close_char:
+            self.bounds = self._parse_bounds()
+            self._parsed += char
+            return True
+        if not (char.isdigit() or char.isspace() or char == SpecialChar.PERIOD.value):
+            raise ParseFailure(f"Invalid character in length bounds: {char}")
+        self._parsed += char
+        return False
+
+    def _parse_bounds(self) -> Tuple[int, Optional[int]]:
+        match = _LENGTH_BOUNDS.fullmatch(self._parsed)
+        if match is None:
+            raise ParseFailure(f"Invalid length bounds: {self._parsed}")
+        min_length, is_range, max_length = match.groups()
+        if is_range is None:
+            if not min_length:
+                return 0, None
+            return int(min_length), int(min_length)
+        min_length = int(min_length) if min_length else 0
+        max_length = int(max_length) if max_length else None
+        if max_length is not None and max_length < min_length:
+            raise ParseFailure(f"Minimum length exceeds maximum length: {self._parsed}")
+        return min_length, max_length
+
+
+class OneOfSchemaParser(SchemaValueParser):
+
+    r"""
+    Parses a string enum, written `oneof("a", "b", ...)`, into a StringEnumSchema"""
+    def __init__(self) -> None:
+        super().__init__()
+        self._match_parser = StringMatchParser(ControlSequences.ONE_OF.value, nocase=True)
+        self._parse_status = OneOfParseStatus.IN_CONTROL_SEQUENCE
+        self._options: List[str] = []
+        self._escape_next = False
+
+    def _append(self, char: str) -> bool:
+        status = self._parse_status
+        if status == OneOfParseStatus.IN_CONTROL_SEQUENCE:
+            self._parsed += char
+            if self._match_parser._append(char):
+                self._parse_status = OneOfParseStatus.AWAITING_OPEN
+            return False
+        if status == OneOfParseStatus.IN_OPTION:
+            self._parsed += char
+            if char == SpecialChar.QUOTE.value and not self._escape_next:
+                self._parse_status = OneOfParseStatus.FINISHED_OPTION
+            else:  # options keep their escape sequences, as they appear in the output
+                self._options[-1] += char
+                self._escape_next = not self._escape_next and char == SpecialChar.ESCAPE.value
+            return False
+        if char.isspace():
+            self._parsed += char
+            return False
+        if status == OneOfParseStatus.AWAITING_OPEN and char == SpecialChar.OPEN_BOUNDS.value:
+            self._parse_status = OneOfParseStatus.AWAITING_OPTION
+        elif status == OneOfParseStatus.AWAITING_OPTION and char == SpecialChar.QUOTE.value:
+            self._options += [""]
+            self._parse_status = OneOfParseStatus.IN_OPTION
+        elif status == OneOfParseStatus.FINISHED_OPTION and char == SpecialChar.COMMA.value:
+            self._parse_status = OneOfParseStatus.AWAITING_OPTION
+        elif status == OneOfParseStatus.FINISHED_OPTION and char == SpecialChar.CLOSE_BOUNDS.value:
+            self._parsed += char
+            self.value = StringEnumSchema(options=self._options)
+            return True
+        else:
+            raise ParseFailure(f"Unexpected character in {ControlSequences.ONE_OF.value}: {char}")
+        self._parsed += char
+        return False
+
+
+class SchemaKind(Enum):
+    STRING = "string"
+    NUMBER = "number"
+    OBJECT = "object"
+    ENUM = "oneof"
+    UNION = "union"
+
+
 class JSONSchema:
+
+    kind: SchemaKind = None
     
-    def __init__(self, is_list: bool = False) -> None:
+    def __init__(self, is_list: bool = False, min_items: int = 0, max_items: Optional[int] = None) -> None:
         self._is_list = is_list
+        self.min_items = min_items  # item count bounds, if this is a list
+        self.max_items = max_items
+        self._key: Optional[Tuple] = None  # set once the schema is interned
+        self._hash: Optional[int] = None  # hash of the key, computed once when interned
+
+    r"""
+    Returns a hashable structural description of this schema"""
+    def key(self) -> Tuple:
+        if self._key is not None:
+            return self._key
+        return self._build_key()
+
+    def _build_key(self) -> Tuple:
+        return (self.kind, self._is_list, self.min_items, self.max_items)
+
+    def _list_repr(self) -> str:
+        if not self._is_list:
+            return ''
+        if self.min_items == 0 and self.max_items is None:
+            return '[]'
+        return f'[{_bounds_repr(self.min_items, self.max_items)}]'
+
+    def __eq__(self, __value: object) -> bool:
+        if self is __value:
+            return True
+        if not isinstance(__value, JSONSchema):
+            return False
+        if self._key is not None and __value._key is not None:  # interned schemas are canonical
+            return False
+        return self.key() == __value.key()
+
+    def __hash__(self) -> int:
+        if self._hash is not None:
+            return self._hash
+        return hash(self.key())
 
 
 class BaseTypeSchema(JSONSchema):
     
-    def __init__(self, type: "BaseType", is_list: bool = False):
-        super().__init__(is_list=is_list)
+    def __init__(
+        self,
+        type: "BaseType",
+        is_list: bool = False,
+        min_items: int = 0,
+        max_items: Optional[int] = None,
+        min_length: int = 0,
+        max_length: Optional[int] = None,
+    ):
+        super().__init__(is_list=is_list, min_items=min_items, max_items=max_items)
         self.type = type
+        self.kind = SchemaKind(type.value)
+        self.min_length = min_length  # character count bounds, if this is a string
+        self.max_length = max_length
 
-    def __eq__(self, __value: object) -> bool:
-        return (
-            isinstance(__value, BaseTypeSchema) and
-            self.type == __value.type and
-            self._is_list == __value._is_list
-        )
+    def _build_key(self) -> Tuple:
+        return super()._build_key() + (self.min_length, self.max_length)
 
     def __repr__(self) -> str:
-        return ('[]' if self._is_list else '') + self.type.value
+        bounds = ''
+        if self.min_length != 0 or self.max_length is not None:
+            bounds = f'({_bounds_repr(self.min_length, self.max_length)})'
+        return self._list_repr() + self.type.value + bounds
+
+
+def _bounds_repr(min_length: int, max_length: Optional[int]) -> str:
+    if min_length == max_length:
+        return str(min_length)
+    return f'{min_length or ""}..{"" if max_length is None else max_length}'
 
 
-# TODO  add this
 class StringEnumSchema(JSONSchema):
 
+    kind = SchemaKind.ENUM
+
+    r"""
+    Schema for a string taking one of `options`. Options are the string contents as they appear
+    in the output, between the quotes (with any escape sequences written out)."""
     def __init__(self, options: List[str] = [], is_list: bool = False) -> None:
         super().__init__(is_list=is_list)
-        self.options = options
+        self.options = list(dict.fromkeys(options))
+        self._trie: Optional[KeyTrieNode] = None
 
-    def __eq__(self, __value: object) -> bool:
-        return (
-            isinstance(__value, StringEnumSchema) and
-            self._is_list == __value._is_list and
-            len(set(self.options).intersection(set(__value.options))) == len(self.options)
-        )
+    def _build_key(self) -> Tuple:
+        return (self.kind, self._is_list, self.min_items, self.max_items, tuple(dict.fromkeys(self.options)))
+
+    r"""
+    Trie over the options, identified by their ordinals. Built once per interned schema, so parse
+    states within it are shared by every constraint using the schema"""
+    @property
+    def trie(self) -> "KeyTrieNode":
+        if self._trie is None:
+            trie = KeyTrieNode()
+            for i, option in enumerate(self.options):
+                trie.add(option, i)
+            self._trie = trie
+        return self._trie
+
+    @property
+    def all_options(self) -> int:
+        return (1 << len(self.options)) - 1
+
+    def __repr__(self) -> str:
+        options = ', '.join(f'"{option}"' for option in self.options)
+        return f'{self._list_repr()}{ControlSequences.ONE_OF.value}({options})'
 
 
 class ObjectSchema(JSONSchema):
 
-    def __init__(self, is_list: bool = False):
+    kind = SchemaKind.OBJECT
+
+    def __init__(self, is_list: bool = False, ordered_keys: bool = False, discriminator: Optional[str] = None):
         super().__init__(is_list=is_list)
+        self.ordered_keys = ordered_keys  # keys must appear in declaration order
+        self.discriminator = discriminator  # key that must appear first, if any
         self._child_schemas: List[Tuple[JSONKey, JSONValue]] = []
+        self._key_index: Optional[KeyIndex] = None
 
     def add_prop(self, key: "JSONKey", value: "JSONValue"):
+        if self._key is not None:
+            raise ValueError("Cannot add properties to an interned schema")
         self._child_schemas += [(key, value)]
+        self._key_index = None
+
+    def _build_key(self) -> Tuple:
+        return (
+            self.kind,
+            self._is_list,
+            self.min_items,
+            self.max_items,
+            self.ordered_keys,
+            self.discriminator,
+            tuple((k.name, k.optional, v.value_def.key()) for k, v in self._child_schemas),
+        )
+
+    @property
+    def key_index(self) -> "KeyIndex":
+        if self._key_index is None:
+            self._key_index = KeyIndex(self._child_schemas, discriminator=self.discriminator)
+        return self._key_index
 
     def get_keys(self, optional: Optional[bool] = None) -> Iterable["JSONKey"]:
         for k, _ in self._child_schemas:
@@ -238,34 +485,151 @@ class ObjectSchema(JSONSchema):
         for k, v in self._child_schemas:
             yield k, v
 
-    def __eq__(self, __value: object) -> bool:
-        if not isinstance(__value, ObjectSchema):
-            return False
-        if self._is_list != __value._is_list:
-            return False
-        for (k1, v1), (k2, v2) in zip(self._child_schemas, __value._child_schemas):
-            if k1 != k2 or v1 != v2:
-                return False
-        return True
+    r"""
+    Returns the interned copy of this schema whose `discriminator` key must appear first"""
+    def with_discriminator(self, discriminator: str) -> "ObjectSchema":
+        if not any(k.name == discriminator and not k.optional for k in self.get_keys()):
+            raise ValueError(f"Discriminator {discriminator} is not a required key of {self}")
+        schema = ObjectSchema(is_list=self._is_list, ordered_keys=self.ordered_keys, discriminator=discriminator)
+        schema.min_items, schema.max_items = self.min_items, self.max_items
+        # declared first, so the discriminator also comes first with ordered keys
+        items = sorted(self.get_items(), key=lambda item: item[0].name != discriminator)
+        for k, v in items:
+            schema.add_prop(k, v)
+        return intern_schema(schema)
+
+    def __repr__(self) -> str:
+        props = ', '.join(f'{k.name}{"?" if k.optional else ""}: {v.value_def}' for k, v in self._child_schemas)
+        return f'{self._list_repr()}{{ {props} }}'
+
+
+class UnionSchema(JSONSchema):
+
+    kind = SchemaKind.UNION
+
+    r"""
+    Schema matched by output following any of `alternatives`. If given, `discriminator` names a
+    required key of every (object) alternative which must appear first, so alternatives are
+    told apart as early as possible."""
+    def __init__(self, alternatives: List[JSONSchema] = [], discriminator: Optional[str] = None) -> None:
+        super().__init__()
+        if discriminator is not None:
+            for alternative in alternatives:
+                if alternative.kind != SchemaKind.OBJECT or alternative._is_list:
+                    raise ValueError("Discriminated union alternatives must be objects")
+            alternatives = [alternative.with_discriminator(discriminator) for alternative in alternatives]
+        self.alternatives: Tuple[JSONSchema] = tuple(dict.fromkeys(alternatives))
+        self.discriminator = discriminator
+
+    def _build_key(self) -> Tuple:
+        return (self.kind, self.discriminator, tuple(alternative.key() for alternative in self.alternatives))
+
+    def __repr__(self) -> str:
+        return ' | '.join(repr(alternative) for alternative in self.alternatives)
 
 
-@dataclass
+class KeyTrieNode:
+
+    r"""
+    Node of a trie over key names. `reach` is a bitset of the ordinals of all keys ending at
+    or below this node and `ordinal` is the ordinal of the key ending here, if any. Names are
+    written out as in the output, so `escaped` marks nodes whose prefix ends in an unescaped
+    backslash, where a quote continues the name instead of closing it."""
+    def __init__(self, escaped: bool = False):
+        self.children: Dict[str, KeyTrieNode] = {}
+        self.reach = 0
+        self.ordinal: Optional[int] = None
+        self.escaped = escaped
+        self._completions: Optional[List[Tuple[str, int]]] = None
+
+    def add(self, name: str, ordinal: int):
+        node = self
+        node.reach |= 1 << ordinal
+        for char in name:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = KeyTrieNode(escaped=char == "\\" and not node.escaped)
+            node = child
+            node.reach |= 1 << ordinal
+        node.ordinal = ordinal
+
+    r"""
+    Returns (suffix, ordinal) for every key ending at or below this node"""
+    def completions(self) -> List[Tuple[str, int]]:
+        if self._completions is None:
+            completions = [] if self.ordinal is None else [("", self.ordinal)]
+            for char, child in self.children.items():
+                completions += [(char + suffix, ordinal) for suffix, ordinal in child.completions()]
+            self._completions = completions
+        return self._completions
+
+
+class KeyIndex:
+
+    r"""
+    Immutable index over the keys of an ObjectSchema. Keys are identified by their ordinal
+    (declaration order), so sets of keys can be tracked as integer bitsets."""
+    def __init__(self, items: List[Tuple["JSONKey", "JSONValue"]], discriminator: Optional[str] = None):
+        self.names: Tuple[str] = tuple(k.name for k, _ in items)
+        self.values: Tuple[JSONSchema] = tuple(v.value_def for _, v in items)
+        self.ordinals: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        self.all_keys = (1 << len(items)) - 1
+        self.required_keys = 0
+        self.trie = KeyTrieNode()
+        for i, (k, _) in enumerate(items):
+            if not k.optional:
+                self.required_keys |= 1 << i
+            self.trie.add(k.name, i)
+        # bitset of the key that must be parsed first, or of all keys
+        self.first_keys = self.all_keys if discriminator is None else 1 << self.ordinals[discriminator]
+
+
+@dataclass(frozen=True)
 class JSONKey:
     name: str
     optional: bool = False
 
 
-@dataclass
+@dataclass(frozen=True)
 class JSONValue:
     value_def: JSONSchema
 
 
+# schemas are only kept interned while in use (by parsers, factories or cached fingerprints)
+_INTERNED_SCHEMAS: "WeakValueDictionary[Tuple, JSONSchema]" = WeakValueDictionary()
+_INTERN_LOCK = Lock()
+
+
+r"""
+Returns the canonical, immutable instance of `schema`. Interned schemas are shared between
+every structurally equal schema, compare by identity and hash in constant time, and can be
+used directly as cache keys. `schema` itself is left untouched; a copy of it is interned."""
+def intern_schema(schema: JSONSchema) -> JSONSchema:
+    if schema._key is not None:  # already interned
+        return schema
+    schema = copy.copy(schema)
+    if isinstance(schema, ObjectSchema):
+        schema._child_schemas = [(k, JSONValue(intern_schema(v.value_def))) for k, v in schema._child_schemas]
+        schema._key_index = None
+    elif isinstance(schema, UnionSchema):
+        schema.alternatives = tuple(intern_schema(alternative) for alternative in schema.alternatives)
+    key = schema._build_key()
+    with _INTERN_LOCK:
+        interned = _INTERNED_SCHEMAS.get(key)
+        if interned is None:
+            schema._key = key
+            schema._hash = hash(key)
+            interned = _INTERNED_SCHEMAS[key] = schema
+    return interned
+
+
 class BaseType(Enum):
     STRING = "string"
     NUMBER = "number"
 
-    def schema(self, is_list: bool = False) -> BaseTypeSchema:
-        return BaseTypeSchema(type=self, is_list=is_list)
+    def schema(self, is_list: bool = False, **bounds) -> BaseTypeSchema:
+        return intern_schema(BaseTypeSchema(type=self, is_list=is_list, **bounds))
+
 
 
 class SpecialChar(Enum):
@@ -275,6 +639,11 @@ class SpecialChar(Enum):
     COLON = ":"
     OPTIONAL = "?"
     UNDERSCORE = "_"
+    PERIOD = "."
+    OPEN_BOUNDS = "("
+    CLOSE_BOUNDS = ")"
+    QUOTE = '"'
+    ESCAPE = "\\"
 
 
 class ControlSequences(Enum):
@@ -284,6 +653,14 @@ class ControlSequences(Enum):
     ARRAY = "[]"
 
 
+class OneOfParseStatus(Enum):
+    IN_CONTROL_SEQUENCE = 0
+    AWAITING_OPEN = 1
+    AWAITING_OPTION = 2
+    IN_OPTION = 3
+    FINISHED_OPTION = 4
+
+
 class ObjectParseStatus(Enum):
     OPENED = 0
     AWAITING_KEY = 1
@@ -295,3 +672,5 @@ class ObjectParseStatus(Enum):
     FINISHED_KEY = 7
     FINISHED_VALUE = 8
     PARSE_COMPLETE = 9
+    FINISHED_BASETYPE = 10
+    IN_BOUNDS_SUBPARSER = 11
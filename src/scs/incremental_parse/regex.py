@@ -0,0 +1,524 @@
+from bisect import bisect_right
+from collections import deque
+from functools import lru_cache
+from typing import List, Optional, Tuple, Dict, Union, FrozenSet
+
+from . import IncrementalParser, ParseFailure, SpecialToken
+
+
+_MAX_CHAR = 0x10FFFF
+
+# intervals of code points, inclusive
+Intervals = Tuple[Tuple[int, int], ...]
+
+
+def _normalize(intervals: List[Tuple[int, int]]) -> Intervals:
+    merged = []
+    for lo, hi in sorted(intervals):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged += [(lo, hi)]
+    return tuple(merged)
+
+
+def _negate(intervals: Intervals) -> Intervals:
+    negated = []
+    start = 0
+    for lo, hi in intervals:
+        if lo > start:
+            negated += [(start, lo - 1)]
+        start = hi + 1
+    if start <= _MAX_CHAR:
+        negated += [(start, _MAX_CHAR)]
+    return tuple(negated)
+
+
+def _chars(chars: str) -> Intervals:
+    return _normalize([(ord(c), ord(c)) for c in chars])
+
+
+_DIGIT = _normalize([(ord("0"), ord("9"))])
+_WORD = _normalize([(ord("a"), ord("z")), (ord("A"), ord("Z")), (ord("0"), ord("9")), (ord("_"), ord("_"))])
+_SPACE = _chars(" \t\n\r\f\v")
+_CLASS_ESCAPES = {
+    "d": _DIGIT, "w": _WORD, "s": _SPACE,
+    "D": _negate(_DIGIT), "W": _negate(_WORD), "S": _negate(_SPACE),
+}
+_CHAR_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "f": "\f", "v": "\v", "0": "\0"}
+# anchors and backreferences don't match characters, so they can't be walked by a DFA
+_UNSUPPORTED_ESCAPES = "bBAZ123456789"
+ANY_CHAR = _negate(_chars("\n"))
+
+
+class RegexSyntaxError(ValueError):
+    pass
+
+
+class _RegexParser:
+
+    r"""
+    Recursive descent parser from a pattern to a syntax tree of tuples:
+    ("set", intervals), ("cat", nodes), ("alt", nodes), ("star", node)"""
+    def __init__(self, pattern: str):
+        self._pattern = pattern
+        self._pos = 0
+
+    def parse(self):
+        pattern = self._pattern
+        if pattern.startswith("^"):
+            self._pos = 1
+        if pattern.endswith("$"):
+            escapes = len(pattern[:-1]) - len(pattern[:-1].rstrip("\\"))
+            if escapes % 2 == 0:  # the `$` isn't escaped
+                self._pattern = pattern[:-1]
+        node = self._alternation()
+        if self._pos < len(self._pattern):
+            raise RegexSyntaxError(f"Unbalanced ')' at {self._pos} in {pattern!r}")
+        return node
+
+    def _peek(self) -> Optional[str]:
+        return self._pattern[self._pos] if self._pos < len(self._pattern) else None
+
+    def _next(self) -> str:
+        char = self._peek()
+        if char is None:
+            raise RegexSyntaxError(f"Unexpected end of pattern {self._pattern!r}")
+        self._pos += 1
+        return char
+
+    def _alternation(self):
+        branches = [self._concatenation()]
+        while self._peek() == "|":
+            self._pos += 1
+            branches += [self._concatenation()]
+        return branches[0] if len(branches) == 1 else ("alt", branches)
+
+    def _concatenation(self):
+        nodes = []
+        while self._peek() not in [None, "|", ")"]:
+            nodes += [self._repetition()]
+        return ("cat", nodes)
+
+    def _repetition(self):
+        node = self._atom()
+        while True:
+            char = self._peek()
+            if char == "*":
+                self._pos += 1
+                node = ("star", node)
+            elif char == "+":
+                self._pos += 1
+                node = ("cat", [node, ("star", node)])
+            elif char == "?":
+                self._pos += 1
+                node = ("alt", [node, ("cat", [])])
+            elif char == "{" and self._bounds() is not None:
+                min_count, max_count = self._bounds(consume=True)
+                node = _repeat(node, min_count, max_count)
+            else:
+                return node
+            if self._peek() == "?":  # lazy quantifiers match the same language
+                self._pos += 1
+
+    def _bounds(self, consume: bool = False) -> Optional[Tuple[int, Optional[int]]]:
+        end = self._pattern.find("}", self._pos)
+        if end < 0:
+            return None
+        body = self._pattern[self._pos + 1:end]
+        min_count, comma, max_count = body.partition(",")
+        if not min_count.isdigit() or not (max_count.isdigit() or max_count == ""):
+            return None
+        bounds = (int(min_count), int(max_count) if max_count else (None if comma else int(min_count)))
+        if bounds[1] is not None and bounds[1] < bounds[0]:
+            raise RegexSyntaxError(f"Invalid repetition {{{body}}} in {self._pattern!r}")
+        if consume:
+            self._pos = end + 1
+        return bounds
+
+    def _atom(self):
+        char = self._next()
+        if char == "(":
+            if self._pattern.startswith("?:", self._pos):
+                self._pos += 2
+            node = self._alternation()
+            if self._next() != ")":
+                raise RegexSyntaxError(f"Missing ')' in {self._pattern!r}")
+            return node
+        if char == "[":
+            return ("set", self._char_class())
+        if char == ".":
+            return ("set", ANY_CHAR)
+        if char == "\\":
+            return ("set", self._escape())
+        if char in "*+?":
+            raise RegexSyntaxError(f"Nothing to repeat at {self._pos - 1} in {self._pattern!r}")
+        return ("set", _chars(char))
+
+    def _escape(self, in_class: bool = False) -> Intervals:
+        char = self._next()
+        if char in _CLASS_ESCAPES:
+            return _CLASS_ESCAPES[char]
+        if in_class and char == "b":  # backspace, as in `re`
+            return _chars("\b")
+        if char in _UNSUPPORTED_ESCAPES:
+            raise RegexSyntaxError(f"Unsupported escape \\{char} at {self._pos - 2} in {self._pattern!r}")
+        return _chars(_CHAR_ESCAPES.get(char, char))
+
+    def _char_class(self) -> Intervals:
+        negate = self._peek() == "^"
+        if negate:
+            self._pos += 1
+        intervals = []
+        first = True
+        while True:
+            char = self._next()
+            if char == "]" and not first:
+                break
+            first = False
+            if char == "\\":
+                escaped = self._escape(in_class=True)
+                if len(escaped) != 1 or escaped[0][0] != escaped[0][1]:  # class escape
+                    intervals += list(escaped)
+                    continue
+                lo = escaped[0][0]
+            else:
+                lo = ord(char)
+            hi = lo
+            if self._peek() == "-" and self._pattern[self._pos + 1:self._pos + 2] not in ["]", ""]:
+                self._pos += 1
+                end = self._next()
+                hi = self._escape(in_class=True)[0][0] if end == "\\" else ord(end)
+                if hi < lo:
+                    raise RegexSyntaxError(f"Invalid range in {self._pattern!r}")
+            intervals += [(lo, hi)]
+        intervals = _normalize(intervals)
+        return _negate(intervals) if negate else intervals
+
+
+r"""
+Parses the character class starting right after the `[` at `start` in `text`. Returns its
+intervals of code points and the index following the closing `]`"""
+def parse_char_class(text: str, start: int) -> Tuple[Intervals, int]:
+    parser = _RegexParser(text)
+    parser._pos = start
+    return parser._char_class(), parser._pos
+
+
+def contains(intervals: Intervals, char: str) -> bool:
+    code = ord(char)
+    i = bisect_right(intervals, (code, _MAX_CHAR)) - 1
+    return i >= 0 and intervals[i][0] <= code <= intervals[i][1]
+
+
+def _repeat(node, min_count: int, max_count: Optional[int]):
+    nodes = [node] * min_count
+    if max_count is None:
+        nodes += [("star", node)]
+    else:
+        nodes += [("alt", [node, ("cat", [])])] * (max_count - min_count)
+    return ("cat", nodes)
+
+
+class _NFA:
+
+    r"""
+    Thompson NFA. Each state has epsilon moves and labelled moves (intervals, target)"""
+    def __init__(self):
+        self.epsilon: List[List[int]] = []
+        self.moves: List[List[Tuple[Intervals, int]]] = []
+
+    def add_state(self) -> int:
+        self.epsilon += [[]]
+        self.moves += [[]]
+        return len(self.epsilon) - 1
+
+    r"""
+    Adds the states matching `node` and returns (start, end) states of the fragment"""
+    def build(self, node) -> Tuple[int, int]:
+        kind = node[0]
+        start = self.add_state()
+        if kind == "set":
+            end = self.add_state()
+            if node[1]:
+                self.moves[start] += [(node[1], end)]
+        elif kind == "cat":
+            end = start
+            for child in node[1]:
+                child_start, child_end = self.build(child)
+                self.epsilon[end] += [child_start]
+                end = child_end
+        elif kind == "alt":
+            end = self.add_state()
+            for child in node[1]:
+                child_start, child_end = self.build(child)
+                self.epsilon[start] += [child_start]
+                self.epsilon[child_end] += [end]
+        else:  # star
+            end = self.add_state()
+            child_start, child_end = self.build(node[1])
+            self.epsilon[start] += [child_start, end]
+            self.epsilon[child_end] += [child_start, end]
+        return start, end
+
+    def closure(self, states) -> FrozenSet[int]:
+        closure = set(states)
+        stack = list(states)
+        while stack:
+            for target in self.epsilon[stack.pop()]:
+                if target not in closure:
+                    closure.add(target)
+                    stack += [target]
+        return frozenset(closure)
+
+
+class CompiledRegex:
+
+    r"""
+    Minimized DFA matching `pattern` in full. The alphabet is partitioned into intervals of
+    code points ("atoms") that no character class of the pattern tells apart, so transitions
+    are keyed by atom index. Only states from which an accepting state can be reached are kept:
+    a missing transition means the input can no longer match."""
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        nfa = _NFA()
+        nfa_start, nfa_end = nfa.build(_RegexParser(pattern).parse())
+
+        boundaries = set()
+        for moves in nfa.moves:
+            for intervals, _ in moves:
+                for lo, hi in intervals:
+                    boundaries.update([lo, hi + 1])
+        self._boundaries = sorted(boundaries)
+        self._atoms = list(zip(self._boundaries, [b - 1 for b in self._boundaries[1:]]))
+
+        transitions, accepting, start = self._determinize(nfa, nfa_start, nfa_end)
+        transitions, accepting, start = _minimize(transitions, accepting, start)
+        self.transitions: List[Dict[int, int]] = transitions
+        self.accepting: List[bool] = accepting
+        self.start: int = start
+        self._completions = self._shortest_completions()
+
+    def _atoms_of(self, intervals: Intervals) -> List[int]:
+        atoms = []
+        for lo, hi in intervals:
+            first = bisect_right(self._boundaries, lo) - 1
+            last = bisect_right(self._boundaries, hi) - 1
+            atoms += range(first, last + 1)
+        return atoms
+
+    def _determinize(self, nfa: _NFA, nfa_start: int, nfa_end: int):
+        atoms_of = {}
+        start = nfa.closure([nfa_start])
+        states = {start: 0}
+        queue = deque([start])
+        transitions, accepting = [], []
+        while queue:
+            subset = queue.popleft()
+            targets: Dict[int, set] = {}
+            for state in subset:
+                for intervals, target in nfa.moves[state]:
+                    if intervals not in atoms_of:
+                        atoms_of[intervals] = self._atoms_of(intervals)
+                    for atom in atoms_of[intervals]:
+                        targets.setdefault(atom, set()).add(target)
+            row = {}
+            for atom, target_states in targets.items():
+                target = nfa.closure(target_states)
+                if target not in states:
+                    states[target] = len(states)
+                    queue.append(target)
+                row[atom] = states[target]
+            transitions += [row]
+            accepting += [nfa_end in subset]
+        return transitions, accepting, 0
+
+    r"""
+    Returns the state reached from `state` with `char`, or None if the input can't match anymore"""
+    def step(self, state: int, char: str) -> Optional[int]:
+        atom = bisect_right(self._boundaries, ord(char)) - 1
+        return self.transitions[state].get(atom)
+
+    r"""
+    Returns (rank, character) for a character of `atom` to use in completions, ranking common
+    characters first, then printable ASCII characters"""
+    def _representative(self, atom: int) -> Tuple[int, str]:
+        lo, hi = self._atoms[atom]
+        for char in "a0A_- ":
+            if lo <= ord(char) <= hi:
+                return 0, char
+        if lo <= 0x7E and hi >= 0x21:
+            return 1, chr(max(lo, 0x21))
+        return 2, chr(lo)
+
+    def _shortest_completions(self) -> List[str]:
+        # breadth first search backwards from the accepting states
+        incoming: List[List[Tuple[int, int]]] = [[] for _ in self.transitions]
+        for state, row in enumerate(self.transitions):
+            for atom, target in row.items():
+                incoming[target] += [(state, atom)]
+        completions: List[Optional[str]] = [("" if accepting else None) for accepting in self.accepting]
+        queue = deque(state for state, accepting in enumerate(self.accepting) if accepting)
+        while queue:
+            target = queue.popleft()
+            for state, atom in sorted(incoming[target], key=lambda move: self._representative(move[1])):
+                if completions[state] is None:
+                    completions[state] = self._representative(atom)[1] + completions[target]
+                    queue.append(state)
+        return completions
+
+    r"""
+    Returns the shortest string leading from `state` to a match"""
+    def completion(self, state: int) -> str:
+        return self._completions[state]
+
+    r"""
+    Returns the characters forced from `state` on: while the state doesn't accept and a single
+    character leads on, that character must come next"""
+    def forced(self, state: int) -> str:
+        forced = ""
+        while not self.accepting[state] and len(self.transitions[state]) == 1:
+            (atom, target), = self.transitions[state].items()
+            lo, hi = self._atoms[atom]
+            if lo != hi:
+                break
+            forced += chr(lo)
+            state = target
+        return forced
+
+    def num_states(self) -> int:
+        return len(self.transitions)
+
+
+def _minimize(transitions: List[Dict[int, int]], accepting: List[bool], start: int):
+    # drop states that can't reach a match
+    incoming = [[] for _ in transitions]
+    for state, row in enumerate(transitions):
+        for target in row.values():
+            incoming[target] += [state]
+    live = set(state for state, is_accepting in enumerate(accepting) if is_accepting)
+    stack = list(live)
+    while stack:
+        for state in incoming[stack.pop()]:
+            if state not in live:
+                live.add(state)
+                stack += [state]
+    if start not in live:
+        raise RegexSyntaxError("Pattern matches nothing")
+    transitions = [
+        {atom: target for atom, target in row.items() if target in live}
+        for row in transitions
+    ]
+
+    # Moore partition refinement, over live states (missing transitions lead to the dead state)
+    states = sorted(live)
+    block = {state: int(accepting[state]) for state in states}
+    num_blocks = len(set(block.values()))
+    while True:
+        signatures = {}
+        refined = {}
+        for state in states:
+            signature = (
+                block[state],
+                tuple(sorted((atom, block[target]) for atom, target in transitions[state].items())),
+            )
+            refined[state] = signatures.setdefault(signature, len(signatures))
+        block = refined
+        if len(signatures) == num_blocks:
+            break
+        num_blocks = len(signatures)
+
+    # renumber blocks in breadth first order from the start state
+    order = {block[start]: 0}
+    queue = deque([start])
+    representatives = [start]
+    while queue:
+        state = queue.popleft()
+        for atom in sorted(transitions[state]):
+            target = transitions[state][atom]
+            if block[target] not in order:
+                order[block[target]] = len(order)
+                representatives += [target]
+                queue.append(target)
+    minimized = [
+        {atom: order[block[target]] for atom, target in transitions[state].items()}
+        for state in representatives
+    ]
+    return minimized, [accepting[state] for state in representatives], 0
+
+
+@lru_cache(maxsize=64)
+def compile_regex(pattern: str) -> CompiledRegex:
+    return CompiledRegex(pattern)
+
+
+class RegexParser(IncrementalParser):
+
+    r"""
+    Parses output matching a regular expression in full, by walking the pattern's minimized DFA.
+    Supports literals, `.`, character classes and the `\d \w \s` escapes, groups, alternation,
+    and the `* + ? {n} {n,} {n,m}` quantifiers. A leading `^` and trailing `$` are ignored, and
+    other anchors (`\b \B \A \Z`) and backreferences raise `RegexSyntaxError`."""
+    def __init__(self, pattern: Optional[str] = None):
+        super().__init__()
+        # copies are built without a pattern, and take the DFA of the parser they copy
+        self._dfa = compile_regex(pattern) if pattern is not None else None
+        self._state = self._dfa.start if self._dfa else 0
+
+    def _copy_from(self, other: "RegexParser"):
+        super()._copy_from(other)
+        self._dfa = other._dfa
+        self._state = other._state
+
+    def _append(self, char: Union[str, SpecialToken]) -> bool:
+        if isinstance(char, SpecialToken):
+            if char != SpecialToken.EOS or not self._dfa.accepting[self._state]:
+                raise ParseFailure("Got special token before the pattern was matched")
+            return True
+        state = self._dfa.step(self._state, char)
+        if state is None:
+            raise ParseFailure(f"{self._parsed + char!r} doesn't match {self._dfa.pattern!r}")
+        self._parsed += char
+        self._state = state
+        return self.is_complete()
+
+    def _append_chunk(self, chars: str, start: int) -> Tuple[int, bool]:
+        dfa = self._dfa
+        state = self._state
+        pos = start
+        while pos < len(chars):
+            next_state = dfa.step(state, chars[pos])
+            if next_state is None:
+                break
+            state = next_state
+            pos += 1
+        if pos == start:
+            return super()._append_chunk(chars, start)  # fails on the mismatch
+        self._parsed += chars[start:pos]
+        self._state = state
+        return pos, self.is_complete()
+
+    def is_complete(self) -> bool:
+        return self._dfa.accepting[self._state] and not self._dfa.transitions[self._state]
+
+    def get_completion(self) -> Optional[str]:
+        return self._dfa.completion(self._state)
+
+    def fingerprint(self):
+        return (RegexParser, self._dfa.pattern, self._state)
+
+    def get_next(self) -> List[str]:
+        forced = self._dfa.forced(self._state)
+        return [forced] if forced else []
+
+    r"""
+    Returns a parser in every state of the DFA, so masks can be computed for all of them ahead
+    of generation"""
+    def reachable_states(self) -> List["RegexParser"]:
+        states = []
+        for state in range(self._dfa.num_states()):
+            parser = RegexParser()
+            parser._dfa = self._dfa
+            parser._state = state
+            states += [parser]
+        return states
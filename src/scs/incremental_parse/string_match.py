@@ -1,4 +1,4 @@
-from typing import List, Optional, Union
+from typing import List, Optional, Union, Tuple
 from scs.incremental_parse import IncrementalParser, SpecialToken
 from . import IncrementalParser, ParseFailure, SpecialToken, TokenGroup
 
@@ -15,16 +15,17 @@ class StringMatchParser(IncrementalParser):
     def _copy_from(self, other: "StringMatchParser"):
         super()._copy_from(other)
         self.match_string = other.match_string
+        self._nocase = other._nocase
         self._parse_idx = other._parse_idx
         self._done = other._done
 
     def _append(self, char: str | SpecialToken) -> bool:
-        if self._nocase:
-            char = char.lower()
         if isinstance(char, SpecialToken):
             if char != SpecialToken.EOS or not self._done:
                 raise ParseFailure("Got special token before match completion")
             return True
+        if self._nocase:
+            char = char.lower()
         if len(self.match_string) <= self._parse_idx:
             raise ParseFailure("Parse idx out of bounds")
         if self.match_string[self._parse_idx] != char:
@@ -34,6 +35,27 @@ class StringMatchParser(IncrementalParser):
         self._done = self._parse_idx == len(self.match_string)
         return self._done
 
+    def _append_chunk(self, chars: str, start: int) -> Tuple[int, bool]:
+        end = min(len(chars), start + len(self.match_string) - self._parse_idx)
+        segment = chars[start:end]
+        if self._nocase:
+            segment = segment.lower()
+        if end <= start or not self.match_string.startswith(segment, self._parse_idx):
+            return super()._append_chunk(chars, start)  # fails on the first mismatch
+        self._parsed += segment
+        self._parse_idx += end - start
+        self._done = self._parse_idx == len(self.match_string)
+        return end, self._done
+
+    def is_complete(self) -> bool:
+        return self._done
+
+    def get_completion(self) -> Optional[str]:
+        return self.match_string[self._parse_idx:]
+
+    def fingerprint(self):
+        return (StringMatchParser, self.match_string, self._nocase, self._parse_idx)
+
     def get_next(self) -> List[str]:
         remaining = self.match_string[self._parse_idx:]
         if remaining:
@@ -76,6 +98,18 @@ class MultiStringMatchParser(IncrementalParser):
         self._parsed = self._sub_parsers[self._running_parsers[0]]._parsed
         return done
     
+    def is_complete(self) -> bool:
+        # complete once no running match can be continued
+        return len(self._running_parsers) > 0 and all(self._sub_parsers[i]._done for i in self._running_parsers)
+
+    def get_completion(self) -> Optional[str]:
+        if not self._running_parsers:
+            return None
+        return min((self._sub_parsers[i].get_completion() for i in self._running_parsers), key=len)
+
+    def fingerprint(self):
+        return (MultiStringMatchParser, tuple(self._sub_parsers[i].fingerprint() for i in self._running_parsers))
+
     def get_next(self) -> List[str]:
         next_ = []
         for i in self._running_parsers:
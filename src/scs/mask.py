@@ -0,0 +1,168 @@
+from typing import List, Iterable
+import numpy as np
+
+
+class TokenMask:
+
+    r"""
+    Tokens that may not be sampled next, over a vocab of `vocab_size` tokens. Depending on how
+    many tokens are allowed, a mask is stored as the allowed token ids, the invalid token ids or a
+    dense boolean array, whichever is smallest, and applied to logits with the matching operation."""
+    def __init__(self, vocab_size: int):
+        self.vocab_size = vocab_size
+
+    r"""
+    Returns a boolean array of shape `(vocab_size,)` marking invalid tokens"""
+    def to_dense(self) -> np.ndarray:
+        raise NotImplementedError()
+
+    r"""
+    Returns the number of tokens that may be sampled"""
+    def num_allowed(self) -> int:
+        raise NotImplementedError()
+
+    r"""
+    Sets the logits of invalid tokens to `fill`, in place. Logits past `vocab_size` (padding of the
+    model's embedding matrix) are set to `fill` as well, like in `write`.
+
+    Parameters:
+        logits (np.ndarray):
+            Logits of shape `(n,)` with `n >= vocab_size`
+        fill (float):
+            Value given to invalid tokens"""
+    def apply(self, logits: np.ndarray, fill: float = -np.inf) -> np.ndarray:
+        raise NotImplementedError()
+
+    r"""
+    Writes the mask into a row of a preallocated boolean buffer, in place. Entries past
+    `vocab_size` (padding of the model's embedding matrix) are marked invalid.
+
+    Parameters:
+        out (np.ndarray):
+            Boolean array of shape `(n,)` with `n >= vocab_size`"""
+    def write(self, out: np.ndarray):
+        raise NotImplementedError()
+
+
+class AllowList(TokenMask):
+
+    r"""
+    Mask stored as the few token ids that may be sampled, such as forced tokens"""
+    def __init__(self, vocab_size: int, token_ids: Iterable[int]):
+        super().__init__(vocab_size)
+        self.token_ids = np.unique(np.asarray(list(token_ids), dtype=np.int64))
+
+    def to_dense(self) -> np.ndarray:
+        mask = np.ones(self.vocab_size, dtype=np.bool_)
+        mask[self.token_ids] = False
+        return mask
+
+    def num_allowed(self) -> int:
+        return len(self.token_ids)
+
+    def apply(self, logits: np.ndarray, fill: float = -np.inf) -> np.ndarray:
+        allowed = logits[self.token_ids]  # gather before overwriting the rest
+        logits[:] = fill
+        logits[self.token_ids] = allowed
+        return logits
+
+    def write(self, out: np.ndarray):
+        out[:] = True
+        out[self.token_ids] = False
+
+
+class DenyList(TokenMask):
+
+    r"""
+    Mask stored as the few token ids that may not be sampled, such as inside strings"""
+    def __init__(self, vocab_size: int, token_ids: Iterable[int]):
+        super().__init__(vocab_size)
+        self.token_ids = np.unique(np.asarray(list(token_ids), dtype=np.int64))
+
+    def to_dense(self) -> np.ndarray:
+        mask = np.zeros(self.vocab_size, dtype=np.bool_)
+        mask[self.token_ids] = True
+        return mask
+
+    def num_allowed(self) -> int:
+        return self.vocab_size - len(self.token_ids)
+
+    def apply(self, logits: np.ndarray, fill: float = -np.inf) -> np.ndarray:
+        logits[self.token_ids] = fill
+        logits[self.vocab_size:] = fill
+        return logits
+
+    def write(self, out: np.ndarray):
+        out[:self.vocab_size] = False
+        out[self.vocab_size:] = True
+        out[self.token_ids] = True
+
+
+class DenseMask(TokenMask):
+
+    def __init__(self, mask: np.ndarray):
+        super().__init__(len(mask))
+        self.mask = mask
+
+    def to_dense(self) -> np.ndarray:
+        return self.mask
+
+    def num_allowed(self) -> int:
+        return self.vocab_size - int(np.count_nonzero(self.mask))
+
+    def apply(self, logits: np.ndarray, fill: float = -np.inf) -> np.ndarray:
+        np.putmask(logits[:self.vocab_size], self.mask, fill)
+        logits[self.vocab_size:] = fill
+        return logits
+
+    def write(self, out: np.ndarray):
+        out[:self.vocab_size] = self.mask
+        out[self.vocab_size:] = True
+
+
+r"""
+Returns the smallest form of a dense invalid mask: an allow-list if at most `max_sparse` tokens are
+allowed, a deny-list if at most `max_sparse` tokens are invalid, otherwise the dense mask itself.
+By default lists are used while they're smaller than the dense mask (one byte per token)."""
+def compact_mask(mask: np.ndarray, max_sparse: int = None) -> TokenMask:
+    if max_sparse is None:
+        max_sparse = len(mask) // np.dtype(np.int64).itemsize
+    num_invalid = int(np.count_nonzero(mask))
+    if len(mask) - num_invalid <= max_sparse:
+        return AllowList(len(mask), np.flatnonzero(~mask))
+    if num_invalid <= max_sparse:
+        return DenyList(len(mask), np.flatnonzero(mask))
+    return DenseMask(mask)
+
+
+r"""
+Applies a mask to each row of a batch of logits, in place, with the cheapest operation for each
+mask's form. Rows may share a mask object. Logits past the vocab size of the masks (padding of
+the model's embedding matrix) are invalid.
+
+Parameters:
+    logits (np.ndarray):
+        Logits of shape `(batch, n)` with `n` at least the vocab size of the masks
+    masks (List[TokenMask]):
+        Mask for each row of `logits`
+    fill (float):
+        Value given to invalid tokens
+
+Return:
+    (np.ndarray):
+    `logits`, with invalid tokens set to `fill`"""
+def apply_masks(logits: np.ndarray, masks: List[TokenMask], fill: float = -np.inf) -> np.ndarray:
+    if len(masks) != len(logits):
+        raise ValueError(f"Got {len(masks)} masks for {len(logits)} rows of logits")
+    dense_rows = [row for row, mask in enumerate(masks) if isinstance(mask, DenseMask)]
+    if len(dense_rows) > 1:  # apply dense masks in a single vectorized operation
+        vocab_size = masks[dense_rows[0]].vocab_size
+        dense = np.stack([masks[row].mask for row in dense_rows])
+        rows = logits[dense_rows, :vocab_size]
+        np.putmask(rows, dense, fill)
+        logits[dense_rows, :vocab_size] = rows
+        logits[dense_rows, vocab_size:] = fill
+    for row, mask in enumerate(masks):
+        if len(dense_rows) <= 1 or not isinstance(mask, DenseMask):
+            mask.apply(logits[row], fill=fill)
+    return logits
@@ -0,0 +1,104 @@
+from typing import Optional, Set
+import numpy as np
+
+try:
+    import torch
+except ImportError:  # torch is optional, NumPy logits are always supported
+    torch = None
+
+from .handler import SyntaxValidityCheckHandler
+
+
+class SyntaxConstraintLogitsProcessor:
+
+    r"""
+    Logits processor enforcing a check handler's constraint during generation, following the
+    `(input_ids, scores) -> scores` interface of 🤗 transformers' `LogitsProcessor`, so it can be
+    passed in a `LogitsProcessorList` to `generate` (greedy search and sampling), or called from a
+    custom generation loop.
+
+    Each call feeds the tokens sampled at the previous step to the handler, writes every row's
+    mask into a boolean buffer kept across steps, and applies the buffer to the whole batch with a
+    single `np.where` (NumPy arrays) or `masked_fill` (torch tensors). Rows that generated EOS are
+    left unmasked and no longer update the handler. With `prefetch_top_k`, the handler then
+    prefetches the masks following each row's most likely valid tokens while the model computes
+    the next step's logits (see `SyntaxValidityCheckHandler.prefetch`).
+
+    Parameters:
+        handler (SyntaxValidityCheckHandler):
+            Handler of the constraint, for a single generation
+        fill (float):
+            Value given to the logits of invalid tokens
+        max_sparse (Optional[int]):
+            Passed to `SyntaxValidityCheckHandler.next_token_masks`
+        prefetch_top_k (int):
+            Number of candidate tokens prefetched for each row, 0 to disable"""
+    def __init__(
+        self,
+        handler: SyntaxValidityCheckHandler,
+        fill: float = -np.inf,
+        max_sparse: Optional[int] = None,
+        prefetch_top_k: int = 0,
+    ):
+        self._handler = handler
+        self._fill = fill
+        self._max_sparse = max_sparse
+        self._prefetch_top_k = prefetch_top_k
+        self._length: Optional[int] = None  # length of input_ids at the previous call
+        self._finished_rows: Set[int] = set()
+        self._buffer: Optional[np.ndarray] = None
+        self._tensor_buffer = None  # torch view sharing memory with the buffer
+
+    @property
+    def handler(self) -> SyntaxValidityCheckHandler:
+        return self._handler
+
+    def _mask_buffer(self, shape) -> np.ndarray:
+        if self._buffer is None or self._buffer.shape != shape:
+            self._buffer = np.zeros(shape, dtype=np.bool_)
+            self._tensor_buffer = None
+        return self._buffer
+
+    def _update_handler(self, input_ids):
+        length = input_ids.shape[1]
+        if self._length is not None:
+            if length != self._length + 1:
+                raise ValueError(f"Expected one new token per call, got {length - self._length}")
+            next_token_ids = [int(token_id) for token_id in input_ids[:, -1].tolist()]
+            self._handler.update(next_token_ids, skip_rows=self._finished_rows)
+            eos_token_id = self._handler.eos_token_id
+            self._finished_rows |= {row for row, token_id in enumerate(next_token_ids) if token_id == eos_token_id}
+        self._length = length
+
+    def __call__(self, input_ids, scores):
+        self._update_handler(input_ids)
+        masks = self._handler.next_token_masks(max_sparse=self._max_sparse)
+        if len(masks) == 1:  # before the first update every row shares the initial check
+            masks = masks * len(scores)
+        buffer = self._mask_buffer(tuple(scores.shape))
+        for row, mask in enumerate(masks):
+            if row in self._finished_rows:
+                buffer[row] = False
+            else:
+                mask.write(buffer[row])
+        if torch is not None and isinstance(scores, torch.Tensor):
+            if self._tensor_buffer is None:
+                self._tensor_buffer = torch.from_numpy(buffer)
+            scores = scores.masked_fill(self._tensor_buffer.to(scores.device), self._fill)
+        else:
+            scores = np.where(buffer, np.asarray(self._fill, dtype=scores.dtype), scores)
+        if self._prefetch_top_k > 0:
+            self._prefetch(scores, buffer)
+        return scores
+
+    def _prefetch(self, scores, buffer: np.ndarray):
+        k = min(self._prefetch_top_k, scores.shape[1])
+        if torch is not None and isinstance(scores, torch.Tensor):
+            top_ids = scores.topk(k, dim=1).indices.tolist()
+        else:
+            top_ids = np.argpartition(-scores, k - 1, axis=1)[:, :k].tolist()
+        candidate_ids = [
+            [] if row in self._finished_rows else [token_id for token_id in row_ids if not buffer[row, token_id]]
+            for row, row_ids in enumerate(top_ids)
+        ]
+        self._handler.prefetch(candidate_ids, max_sparse=self._max_sparse)
@@ -0,0 +1,374 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+
+from .handler import (
+    SyntaxValidityCheckHandler, SyntaxValidityCheckFactory, JSONValidityCheckFactory, JSONSchemaCheckFactory,
+    OneOfValidityCheckFactory, RegexCheckFactory, GrammarCheckFactory,
+)
+from .mask import TokenMask, AllowList, DenyList, DenseMask
+from .vocab import VocabularyIndex
+
+CHECK_FACTORIES = {
+    "json": JSONValidityCheckFactory,
+    "json_schema": JSONSchemaCheckFactory,
+    "one_of": OneOfValidityCheckFactory,
+    "regex": RegexCheckFactory,
+    "grammar": GrammarCheckFactory,
+}
+HANDLER_OPTIONS = ["max_new_tokens", "budget_margin"]
+STREAM_LIMIT = 2 ** 26  # vocabs are sent in a single line
+
+
+class SidecarError(RuntimeError):
+
+    def __init__(self, message: str, retry: bool = False):
+        super().__init__(message)
+        self.retry = retry
+
+
+def encode_mask(mask: TokenMask) -> dict:
+    if isinstance(mask, AllowList):
+        return {"allow": mask.token_ids.tolist()}
+    if isinstance(mask, DenyList):
+        return {"deny": mask.token_ids.tolist()}
+    return {"dense": base64.b64encode(np.packbits(mask.to_dense())).decode("ascii")}
+
+
+def decode_mask(encoded: dict, vocab_size: int) -> TokenMask:
+    if "allow" in encoded:
+        return AllowList(vocab_size, encoded["allow"])
+    if "deny" in encoded:
+        return DenyList(vocab_size, encoded["deny"])
+    bits = np.frombuffer(base64.b64decode(encoded["dense"]), dtype=np.uint8)
+    return DenseMask(np.unpackbits(bits, count=vocab_size).astype(np.bool_))
+
+
+class _Vocabulary:
+
+    r"""
+    Vocab of a tokenizer registered with the server. Sessions over the same vocab and EOS token
+    share its index and a cache of masks, so the vocab is only preprocessed once and a parse
+    state's mask is computed once for all of them"""
+    def __init__(self, token_vocab: List[str], eos_token_id: Optional[int], mask_cache_size: int):
+        self.index = VocabularyIndex(token_vocab)
+        self.eos_token_id = eos_token_id
+        self.mask_cache_size = mask_cache_size
+        self.mask_cache = OrderedDict()
+
+
+class _Session:
+
+    def __init__(self, handler: SyntaxValidityCheckHandler, now: float):
+        self.handler = handler
+        self.last_used = now
+        self.lock = asyncio.Lock()
+
+
+r"""
+Marks `key` as the most recently used entry of an LRU table, dropping the least recently used
+entries beyond `max_size`"""
+def _touch(table: OrderedDict, key: str, max_size: int):
+    table.move_to_end(key)
+    while len(table) > max_size:
+        table.popitem(last=False)
+
+
+class SidecarServer:
+
+    r"""
+    Local service running constrained sampling for several model workers, over a Unix socket or a
+    local TCP port. Requests and responses are JSON objects, one per line; a response carries the
+    `id` of its request along with its result or an `error`:
+
+        {"op": "vocab", "vocab": [...], "eos_token_id": 2}             -> {"vocab_id": ...}
+        {"op": "create", "vocab_id": ..., "constraint": {"type": "json_schema", "schema": ...}}
+                                                                        -> {"session": ...}
+        {"op": "mask", "session": ...}                                  -> {"masks": [...]}
+        {"op": "update", "session": ..., "token_ids": [...]}            -> {"completed": [...]}
+        {"op": "close", "session": ...}                                 -> {}
+
+    Constraint types are the keys of `CHECK_FACTORIES`, and the other fields of a constraint are
+    passed to its factory. Masks are encoded in their most compact form (see `encode_mask`).
+
+    Each tokenizer's vocab is registered once and shared by its sessions, along with a cache of
+    masks. The `max_vocabs` most recently used vocabs and `max_factories` constraints are kept,
+    sessions keep theirs once created, and clients re-register vocabs that were dropped.
+    Compiled schemas, regexes and grammars are cached by their compile functions. Vocabs are
+    indexed, constraints compiled and handlers run on a worker thread so the event loop keeps
+    serving connections, and sessions idle for
+    `idle_timeout` seconds are evicted. Once `max_pending` requests are being processed, further
+    requests are rejected with `"retry": true` rather than queued without bound."""
+    def __init__(
+        self,
+        idle_timeout: float = 300.0,
+        max_sessions: int = 1024,
+        max_pending: int = 64,
+        mask_cache_size: int = 4096,
+        max_vocabs: int = 16,
+        max_factories: int = 256,
+    ):
+        self._idle_timeout = idle_timeout
+        self._max_sessions = max_sessions
+        self._max_pending = max_pending
+        self._mask_cache_size = mask_cache_size
+        self._max_vocabs = max_vocabs
+        self._max_factories = max_factories
+        self._vocabs: Dict[str, _Vocabulary] = OrderedDict()
+        self._sessions: Dict[str, _Session] = {}
+        self._factories: Dict[str, SyntaxValidityCheckFactory] = OrderedDict()
+        self._session_ids = itertools.count()
+        self._reserved_sessions = 0  # sessions being created, counted against `max_sessions`
+        self._pending = 0
+        # handlers share mask caches, so they're run one at a time
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._eviction_task: Optional[asyncio.Task] = None
+
+    @property
+    def num_sessions(self) -> int:
+        return len(self._sessions)
+
+    r"""
+    Starts listening on the Unix socket at `path`, or on `host:port` if no path is given"""
+    async def start(self, path: Optional[str] = None, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._serve_connection, path=path, limit=STREAM_LIMIT)
+        else:
+            self._server = await asyncio.start_server(self._serve_connection, host=host, port=port, limit=STREAM_LIMIT)
+        self._eviction_task = asyncio.ensure_future(self._evict_idle_sessions())
+        return self._server
+
+    async def close(self):
+        if self._eviction_task is not None:
+            self._eviction_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=False)
+
+    async def _evict_idle_sessions(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._idle_timeout / 4)
+            now = loop.time()
+            for session_id, session in list(self._sessions.items()):
+                if now - session.last_used > self._idle_timeout and not session.lock.locked():
+                    del self._sessions[session_id]
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self._respond(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()  # stop reading from clients that don't read their responses
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, line: bytes) -> dict:
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if self._pending >= self._max_pending:
+                raise SidecarError("Server is busy", retry=True)
+            self._pending += 1
+            try:
+                result = await self._dispatch(request)
+            finally:
+                self._pending -= 1
+            return {"id": request_id, **result}
+        except SidecarError as e:
+            return {"id": request_id, "error": str(e), "retry": e.retry}
+        except Exception as e:
+            return {"id": request_id, "error": f"{type(e).__name__}: {e}", "retry": False}
+
+    async def _dispatch(self, request: dict) -> dict:
+        op = request.get("op")
+        if op == "vocab":
+            return {"vocab_id": await self._register_vocab(request["vocab"], request.get("eos_token_id"))}
+        if op == "create":
+            return {"session": await self._create_session(request)}
+        if op == "close":
+            self._sessions.pop(request["session"], None)
+            return {}
+        if op not in ["update", "mask"]:
+            raise SidecarError(f"Unknown op {op!r}")
+        session = self._session(request["session"])
+        async with session.lock:
+            handler = session.handler
+            if op == "update":
+                token_ids = [int(token_id) for token_id in request["token_ids"]]
+                completed = await self._run(lambda: (handler.update(token_ids), handler.completed_checks())[1])
+                return {"completed": completed}
+            masks = await self._run(lambda: handler.next_token_masks(max_sparse=request.get("max_sparse")))
+            return {"masks": [encode_mask(mask) for mask in masks]}
+
+    async def _run(self, fn):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn)
+
+    def _session(self, session_id: str) -> _Session:
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise SidecarError(f"Unknown session {session_id!r}, it may have been evicted")
+        session.last_used = asyncio.get_running_loop().time()
+        return session
+
+    async def _register_vocab(self, token_vocab: List[str], eos_token_id: Optional[int]) -> str:
+        # hashing and indexing the vocab take time linear in its size, so both run off the event loop
+        vocab_id = await self._run(lambda: hashlib.sha1(json.dumps([token_vocab, eos_token_id]).encode()).hexdigest()[:16])
+        if vocab_id not in self._vocabs:
+            vocab = await self._run(lambda: _Vocabulary(token_vocab, eos_token_id, self._mask_cache_size))
+            self._vocabs.setdefault(vocab_id, vocab)  # unless registered by another request meanwhile
+        _touch(self._vocabs, vocab_id, self._max_vocabs)
+        return vocab_id
+
+    async def _factory(self, constraint: dict) -> SyntaxValidityCheckFactory:
+        key = json.dumps(constraint, sort_keys=True)
+        if key not in self._factories:
+            options = dict(constraint)
+            factory_type = CHECK_FACTORIES.get(options.pop("type", None))
+            if factory_type is None:
+                raise SidecarError(f"Unknown constraint type, expected one of {list(CHECK_FACTORIES)}")
+            # factories compile their schema, regex or grammar
+            factory = await self._run(lambda: factory_type(**options))
+            self._factories.setdefault(key, factory)
+        factory = self._factories[key]
+        _touch(self._factories, key, self._max_factories)
+        return factory
+
+    async def _create_session(self, request: dict) -> str:
+        vocab = self._vocabs.get(request["vocab_id"])
+        if vocab is None:
+            raise SidecarError(f"Unknown vocab {request['vocab_id']!r}, it may have been dropped and must be registered again")
+        _touch(self._vocabs, request["vocab_id"], self._max_vocabs)
+        # the slot is reserved before awaiting, so concurrent creates can't exceed the limit
+        if len(self._sessions) + self._reserved_sessions >= self._max_sessions:
+            raise SidecarError("Too many sessions", retry=True)
+        self._reserved_sessions += 1
+        try:
+            factory = await self._factory(request["constraint"])
+            options = {option: request[option] for option in HANDLER_OPTIONS if option in request}
+            handler = await self._run(lambda: SyntaxValidityCheckHandler(
+                vocab.index,
+                factory,
+                eos_token_id=vocab.eos_token_id,
+                mask_cache_size=vocab.mask_cache_size,
+                mask_cache=vocab.mask_cache,
+                **options,
+            ))
+        finally:
+            self._reserved_sessions -= 1
+        session_id = str(next(self._session_ids))
+        self._sessions[session_id] = _Session(handler, asyncio.get_running_loop().time())
+        return session_id
+
+
+class SidecarClient:
+
+    r"""
+    Client of a `SidecarServer`, sending one request at a time over its connection"""
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._request_ids = itertools.count()
+        self._lock = asyncio.Lock()
+        self._vocab_sizes: Dict[str, int] = {}
+        self._session_vocabs: Dict[str, str] = {}
+
+    @classmethod
+    async def connect(cls, path: Optional[str] = None, host: str = "127.0.0.1", port: int = 0) -> "SidecarClient":
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path, limit=STREAM_LIMIT)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=STREAM_LIMIT)
+        return cls(reader, writer)
+
+    async def request(self, op: str, **fields) -> dict:
+        async with self._lock:
+            request_id = next(self._request_ids)
+            self._writer.write(json.dumps({"id": request_id, "op": op, **fields}).encode() + b"\n")
+            await self._writer.drain()
+            line = await self._reader.readline()
+        if not line:
+            raise SidecarError("Connection closed by the server")
+        response = json.loads(line)
+        if "error" in response:
+            raise SidecarError(response["error"], retry=response.get("retry", False))
+        return response
+
+    async def register_vocab(self, token_vocab: List[str], eos_token_id: Optional[int] = None) -> str:
+        vocab_id = (await self.request("vocab", vocab=token_vocab, eos_token_id=eos_token_id))["vocab_id"]
+        self._vocab_sizes[vocab_id] = len(token_vocab)
+        return vocab_id
+
+    r"""
+    Creates a session for `constraint`, such as `{"type": "json_schema", "schema": ...}`.
+    `handler_options` may set `max_new_tokens` and `budget_margin`"""
+    async def create_session(self, vocab_id: str, constraint: dict, **handler_options) -> str:
+        session = (await self.request("create", vocab_id=vocab_id, constraint=constraint, **handler_options))["session"]
+        self._session_vocabs[session] = vocab_id
+        return session
+
+    async def get_masks(self, session: str, max_sparse: Optional[int] = None) -> List[TokenMask]:
+        response = await self.request("mask", session=session, max_sparse=max_sparse)
+        vocab_size = self._vocab_sizes[self._session_vocabs[session]]
+        return [decode_mask(mask, vocab_size) for mask in response["masks"]]
+
+    async def update(self, session: str, token_ids: List[int]) -> List[bool]:
+        return (await self.request("update", session=session, token_ids=[int(t) for t in token_ids]))["completed"]
+
+    async def close_session(self, session: str):
+        await self.request("close", session=session)
+        self._session_vocabs.pop(session, None)
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Constrained sampling sidecar server")
+    parser.add_argument("--socket", help="Path of the Unix socket to listen on")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--idle-timeout", type=float, default=300.0)
+    parser.add_argument("--max-sessions", type=int, default=1024)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--mask-cache-size", type=int, default=4096)
+    parser.add_argument("--max-vocabs", type=int, default=16)
+    parser.add_argument("--max-factories", type=int, default=256)
+    args = parser.parse_args(args)
+
+    async def serve():
+        server = SidecarServer(
+            idle_timeout=args.idle_timeout,
+            max_sessions=args.max_sessions,
+            max_pending=args.max_pending,
+            mask_cache_size=args.mask_cache_size,
+            max_vocabs=args.max_vocabs,
+            max_factories=args.max_factories,
+        )
+        listener = await server.start(path=args.socket, host=args.host, port=args.port)
+        try:
+            await listener.serve_forever()
+        finally:
+            await server.close()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+from threading import Lock
+from typing import List, Dict, Optional, Type, Tuple, Iterator, Union
+import numpy as np
+
+from .incremental_parse.json.parser import NonNumericTokenGroup, InvalidFloatTokenGroup, BeginWithNonJsonCharGroup, NoQuoteCharGroup, NumericTokenGroup, NonValueStartGroup
+from .incremental_parse.string_match import NonAlnumGroup
+from .incremental_parse import TokenGroup, AllTokenGroup, EmptyTokenGroup
+
+
+TOKEN_GROUPS = [
+    AllTokenGroup, EmptyTokenGroup, NonNumericTokenGroup, InvalidFloatTokenGroup, BeginWithNonJsonCharGroup, NonAlnumGroup, NoQuoteCharGroup, NumericTokenGroup,
+    NonValueStartGroup,
+]
+
+
+def make_vocab_splits(vocab: List[str], *token_group_types: Type[TokenGroup]) -> Dict[Type, "VocabSplit"]:
+    split_dict = {}
+    for T in token_group_types:
+        split = VocabSplit()
+        split.filter_vocab(vocab, grouping=T)
+        split_dict[T] = split
+    return split_dict
+
+
+class VocabSplit:
+
+    def __init__(self) -> None:
+        self.filtered = []
+        self.remaining = []
+        self.filtered_mask = np.zeros(0, dtype=np.bool_)
+
+    def filter_vocab(self, vocab: List[str], grouping: Type[TokenGroup]):
+        self.filtered = []
+        self.remaining = []
+        self.filtered_mask = np.zeros(len(vocab), dtype=np.bool_)
+        for i, tok in enumerate(vocab):
+            if isinstance(tok, str) and grouping.filter(tok):
+                self.filtered += [(i, tok)]
+                self.filtered_mask[i] = True
+            else:
+                self.remaining += [(i, tok)]
+        self.filtered_mask.flags.writeable = False
+
+
+class TokenTrie:
+
+    r"""
+    Character trie over the token strings of a vocab. Each node maps a character to the node
+    following it, and lists the ids of the tokens ending at it"""
+    __slots__ = ["children", "token_ids"]
+
+    def __init__(self):
+        self.children: Dict[str, "TokenTrie"] = {}
+        self.token_ids: List[int] = []
+
+    def add(self, token: str, token_id: int):
+        node = self
+        for char in token:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = TokenTrie()
+            node = child
+        node.token_ids.append(token_id)
+
+
+class VocabularyIndex:
+
+    r"""
+    Structures derived from a tokenizer's vocab: the token strings, the id of each token and the
+    split of the vocab by each token group. Building them is linear in the size of the vocab, so
+    an index is built once per tokenizer and shared by the check handlers of every request over
+    it, making a handler's setup proportional to its constraint only.
+
+    An index is never modified once built, apart from splits for token groups not in TOKEN_GROUPS
+    (such as length-bounded groups), which are added under a lock the first time a group is seen.
+    Handlers in different threads may share an index.
+
+        index = VocabularyIndex(tokenizer.convert_ids_to_tokens(range(len(tokenizer))))
+        handler = SyntaxValidityCheckHandler(index, JSONSchemaCheckFactory(schema=schema))
+
+    Parameters:
+        token_vocab (List[str]):
+            Token strings of the vocab, indexed by token id. Ids without a string (such as
+            special tokens) may be any other value"""
+    def __init__(self, token_vocab: List[str]):
+        self._token_vocab = tuple(token_vocab)
+        self._vocab_map = {t: i for i, t in enumerate(self._token_vocab) if isinstance(t, str)}
+        self._max_token_length = max((len(t) for t in self._vocab_map), default=0)
+        self._splits = make_vocab_splits(self._token_vocab, *TOKEN_GROUPS)
+        self._trie: Optional[TokenTrie] = None
+        self._lock = Lock()
+
+    @property
+    def token_vocab(self) -> Tuple[str, ...]:
+        return self._token_vocab
+
+    @property
+    def vocab_map(self) -> Dict[str, int]:
+        return self._vocab_map
+
+    @property
+    def max_token_length(self) -> int:
+        return self._max_token_length
+
+    def __len__(self) -> int:
+        return len(self._token_vocab)
+
+    def __getitem__(self, token_id: int) -> str:
+        return self._token_vocab[token_id]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._token_vocab)
+
+    r"""
+    Returns the id of a token string, or None if it isn't in the vocab"""
+    def token_id(self, token: str) -> Optional[int]:
+        return self._vocab_map.get(token)
+
+    r"""
+    Returns the vocab split for a token group, splitting the vocab the first time a group not in
+    TOKEN_GROUPS (such as a length-bounded group) is seen"""
+    def split(self, group: Optional[Type[TokenGroup]]) -> Optional[VocabSplit]:
+        split = self._splits.get(group)
+        if split is not None or group is None:
+            return split
+        max_length = getattr(group, "max_length", None)
+        if max_length is not None and max_length >= self._max_token_length:
+            # every token fits, so the bound doesn't narrow the group it derives from
+            split = self.split(group.__base__)
+        else:
+            split = make_vocab_splits(self._token_vocab, group)[group]
+        with self._lock:
+            # another thread may have split the vocab for the same group meanwhile, keep the first
+            return self._splits.setdefault(group, split)
+
+    r"""
+    Returns the character trie over the vocab's token strings, built the first time it's used.
+    Constraints that scan character by character (such as grammars) walk it to check tokens
+    sharing a prefix together"""
+    def token_trie(self) -> TokenTrie:
+        if self._trie is not None:
+            return self._trie
+        trie = TokenTrie()
+        for token_id, token in enumerate(self._token_vocab):
+            if isinstance(token, str) and token:
+                trie.add(token, token_id)
+        with self._lock:
+            if self._trie is None:
+                self._trie = trie
+            return self._trie
+
+    def __getstate__(self) -> dict:
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+r"""
+Returns `token_vocab` as a `VocabularyIndex`, building the index unless it already is one"""
+def vocabulary_index(token_vocab: Union[List[str], VocabularyIndex]) -> VocabularyIndex:
+    if isinstance(token_vocab, VocabularyIndex):
+        return token_vocab
+    return VocabularyIndex(token_vocab)
@@ -0,0 +1,185 @@
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Optional, Tuple, Union
+import numpy as np
+
+from .handler import SyntaxValidityCheckHandler, SyntaxValidityCheckFactory
+from .vocab import VocabularyIndex
+
+
+def _slots(shared_memory: SharedMemory, shape: Tuple[int, int, int]) -> np.ndarray:
+    return np.ndarray(shape, dtype=np.bool_, buffer=shared_memory.buf)
+
+
+def _write_masks(handler: SyntaxValidityCheckHandler, slot: np.ndarray, num_rows: int) -> int:
+    masks = handler.next_token_masks()
+    if len(masks) == 1:  # before the first update every row shares the initial check
+        masks = masks * num_rows
+    if len(masks) > len(slot):
+        raise ValueError(f"Got {len(masks)} rows, more than the worker's max_batch_size of {len(slot)}")
+    for row, mask in enumerate(masks):
+        mask.write(slot[row])
+    return len(masks)
+
+
+r"""
+Entry point of the worker process: serves requests from `connection` until asked to stop, writing
+the masks of each step into the next slot of the shared ring buffer"""
+def _serve(
+    connection,
+    shared_memory_name: str,
+    shape: Tuple[int, int, int],
+    token_vocab: Union[List[str], VocabularyIndex],
+    check_factory: SyntaxValidityCheckFactory,
+    handler_kwargs: dict,
+):
+    shared_memory = SharedMemory(name=shared_memory_name)
+    slots = _slots(shared_memory, shape)
+    step = 0
+    num_rows = 1
+    handler = None
+    request = ("init",)
+    try:
+        while request[0] != "close":
+            try:
+                if request[0] == "init":
+                    handler = SyntaxValidityCheckHandler(token_vocab, check_factory, **handler_kwargs)
+                elif handler is None:
+                    raise RuntimeError("The worker's handler failed to initialize")
+                elif request[0] == "update":
+                    handler.update(request[1], skip_rows=request[2])
+                    num_rows = len(request[1])
+                elif request[0] == "call":
+                    connection.send(("result", getattr(handler, request[1])(*request[2])))
+                    request = connection.recv()
+                    continue
+                slot = step % len(slots)
+                connection.send(("masks", slot, _write_masks(handler, slots[slot], num_rows)))
+                step += 1
+            except Exception as e:
+                connection.send(("error", e))
+            request = connection.recv()
+    finally:
+        del slots
+        shared_memory.close()
+
+
+class MaskWorker:
+
+    r"""
+    Runs a `SyntaxValidityCheckHandler` in a separate process, so computing masks doesn't compete
+    for the GIL with the process serving the model. Sampled token ids are sent to the worker over a
+    pipe and masks are read back from a ring of `ring_size` slots in shared memory, so vocab-sized
+    arrays are never pickled or copied.
+
+    `update` returns as soon as the token ids are sent, so the worker computes the next masks
+    while the model computes the next logits. `invalid_next_token_masks` then waits for them.
+
+        with MaskWorker(vocab, JSONSchemaCheckFactory(schema=schema), max_batch_size=4) as worker:
+            while ...:
+                logits[worker.invalid_next_token_masks()] = -np.inf
+                worker.update(next_token_ids)
+
+    Parameters:
+        token_vocab (Union[List[str], VocabularyIndex]):
+            Token strings of the vocab, or an index of them
+        check_factory (SyntaxValidityCheckFactory):
+            Factory of the constraint, which must be picklable
+        max_batch_size (int):
+            Largest number of rows generated at once
+        ring_size (int):
+            Number of mask slots. Masks returned by `invalid_next_token_masks` are overwritten
+            `ring_size` updates later, and must not be used once the worker object is released
+        start_method (Optional[str]):
+            `multiprocessing` start method of the worker, by default the platform's
+        handler_kwargs:
+            Passed to `SyntaxValidityCheckHandler`"""
+    def __init__(
+        self,
+        token_vocab: Union[List[str], VocabularyIndex],
+        check_factory: SyntaxValidityCheckFactory,
+        max_batch_size: int = 1,
+        ring_size: int = 2,
+        start_method: Optional[str] = None,
+        **handler_kwargs,
+    ):
+        if ring_size < 2:
+            raise ValueError("The ring buffer needs at least 2 slots for the worker to run ahead")
+        shape = (ring_size, max_batch_size, len(token_vocab))
+        self._shared_memory = SharedMemory(create=True, size=max(1, int(np.prod(shape))))
+        self._slots = _slots(self._shared_memory, shape)
+        context = get_context(start_method)
+        self._connection, worker_connection = context.Pipe()
+        self._process = context.Process(
+            target=_serve,
+            args=(worker_connection, self._shared_memory.name, shape, token_vocab, check_factory, handler_kwargs),
+            daemon=True,
+        )
+        self._process.start()
+        worker_connection.close()
+        self._pending = 1  # masks of the first step
+        self._masks: Optional[np.ndarray] = None
+
+    r"""
+    Sends the next sampled token ids to the worker without waiting for the resulting masks.
+    Rows of `skip_rows` (rows that already generated EOS) aren't updated"""
+    def update(self, next_token_ids: List[int], skip_rows: List[int] = ()):
+        self._connection.send(("update", [int(token_id) for token_id in next_token_ids], list(skip_rows)))
+        self._pending += 1
+
+    r"""
+    Returns a read-only `(num_rows, vocab)` view of the invalid masks after the latest update,
+    waiting for the worker to write them. Before the first update every row shares the initial
+    check, and a single row is returned. Raises any error the worker hit computing them."""
+    def invalid_next_token_masks(self) -> np.ndarray:
+        error = None
+        while self._pending:
+            reply = self._connection.recv()
+            self._pending -= 1
+            if reply[0] == "error":
+                error = reply[1]
+                continue
+            _, slot, num_rows = reply
+            self._masks = self._slots[slot, :num_rows]
+            self._masks.flags.writeable = False
+        if error is not None:
+            raise error
+        return self._masks
+
+    r"""
+    Calls a handler method in the worker and returns its result, once pending masks are read.
+    Results are pickled, so this is meant for small results such as `completed_checks`."""
+    def call(self, method: str, *args):
+        self.invalid_next_token_masks()
+        self._connection.send(("call", method, args))
+        reply = self._connection.recv()
+        if reply[0] == "error":
+            raise reply[1]
+        return reply[1]
+
+    def completed_checks(self) -> List[bool]:
+        return self.call("completed_checks")
+
+    def get_completions(self) -> List[Optional[str]]:
+        return self.call("get_completions")
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._connection.send(("close",))
+        except (BrokenPipeError, OSError):  # the worker already exited
+            pass
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+        self._connection.close()
+        # views of the masks may still be in use, so the mapping is only released along with this object
+        self._shared_memory.unlink()
+
+    def __enter__(self) -> "MaskWorker":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,83 @@
+import unittest
+import numpy as np
+from scs.constraint.regex import regex
+from scs.constraint.one_of import one_of
+from scs.constraint.combinators import sequence, alternation, intersection
+from scs.incremental_parse import SpecialToken, ParseFailure
+from scs.handler import (
+    SyntaxValidityCheckHandler, SequenceCheckFactory, AlternationCheckFactory, IntersectionCheckFactory,
+    RegexCheckFactory, JSONSchemaCheckFactory, OneOfValidityCheckFactory,
+)
+
+VOCAB = ["a", "b", "#", "#{", "{", '{"', '"', '"x', '":', ":", "1", "12", "}", "}#", "ab", "ba", "c", "</s>"]
+EOS = 17
+
+
+def _matches(constraint, text: str) -> bool:
+    check = constraint.copy()
+    try:
+        check.update_parser(text)
+        check.update_parser([SpecialToken.EOS])
+        return True
+    except ParseFailure:
+        return False
+
+
+class TestCombinators(unittest.TestCase):
+
+    def test_sequence(self):
+        constraint = sequence(regex(r"a*"), regex(r"ab"), one_of(["#", "##"]))
+        for text, expected in [("ab#", True), ("aaab##", True), ("a#", False), ("aab", False), ("ab###", False)]:
+            self.assertEqual(_matches(constraint, text), expected, text)
+        check = constraint.copy()
+        check.update_parser("aa")
+        self.assertEqual(check.get_completion(), "b#")
+        check.update_parser("b")
+        self.assertEqual(len(check.parser.branches), 2)  # ab is complete, and the last part has begun
+
+    def test_alternation_and_intersection(self):
+        either = alternation(regex(r"a+b"), regex(r"b+a"))
+        both = intersection(regex(r"[ab]{2,3}"), regex(r"a*b*"))
+        for text in ["ab", "aab", "ba", "bba", "abb", "aa", "abab", ""]:
+            self.assertEqual(_matches(either, text), text in ["ab", "aab", "ba", "bba"], text)
+            self.assertEqual(_matches(both, text), text in ["ab", "aab", "abb", "aa"], text)
+        self.assertEqual(either.get_completion(), "ab")
+        self.assertEqual(both.get_completion(), "aa")
+        # an intersection is only complete once every part is
+        for parts, expected in [((r"a", r"ab"), False), ((r"a", r"a|ab"), False), ((r"a", r"a"), True)]:
+            check = intersection(*[regex(pattern) for pattern in parts])
+            check.update_parser("a")
+            self.assertEqual(check.is_complete(), expected, parts)
+
+    def test_combined_masks_match_checks(self):
+        factories = [
+            SequenceCheckFactory(RegexCheckFactory(pattern=r"[ab]*#"), JSONSchemaCheckFactory(schema="{x: number}")),
+            AlternationCheckFactory(RegexCheckFactory(pattern=r"(ab)+c?"), OneOfValidityCheckFactory(match_strings=["ba", "b1"])),
+            IntersectionCheckFactory(RegexCheckFactory(pattern=r"[ab]*"), RegexCheckFactory(pattern=r"(a|ba)*")),
+        ]
+        texts = ['ab#{"x":12}', "ababc", "baba"]
+        for factory, text in zip(factories, texts):
+            handler = SyntaxValidityCheckHandler(VOCAB, factory, eos_token_id=EOS)
+            check = handler._active_checks[0]
+            for pos in range(len(text) + 1):
+                mask = handler._combined_invalid_mask(check)
+                for token_id, token in enumerate(VOCAB):
+                    valid = check.check_next([SpecialToken.EOS] if token_id == EOS else token)
+                    self.assertEqual(mask[token_id], not valid, (text[:pos], token))
+                if pos < len(text):
+                    check.update_parser(text[pos])
+
+    def test_parts_masks_are_cached(self):
+        factory = AlternationCheckFactory(RegexCheckFactory(pattern=r"a+"), RegexCheckFactory(pattern=r"a+b"))
+        handler = SyntaxValidityCheckHandler(VOCAB, factory, eos_token_id=EOS)
+        for tok in [0, 0, 0]:
+            self.assertFalse(handler.invalid_next_token_mask()[tok])
+            handler.update([tok])
+        # 'a' is forced at first, after which the alternation and both parts repeat the same states
+        self.assertEqual(len(handler._mask_cache), 4)
+        mask = handler.invalid_next_token_mask()
+        self.assertEqual([VOCAB[i] for i in np.where(~mask)[0]], ["a", "b", "ab", "</s>"])
+
+
+if __name__ == '__main__':
+    unittest.main()
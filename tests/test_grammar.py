@@ -0,0 +1,176 @@
+import re
+import sys
+import unittest
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scs.incremental_parse.grammar import GrammarParser, compile_grammar, GrammarSyntaxError
+from scs.incremental_parse import SpecialToken, ParseFailure
+from scs.handler import SyntaxValidityCheckHandler, GrammarCheckFactory
+
+ARITHMETIC = r"""
+expr ::= term (("+" | "-") term)*   # left associative
+term ::= num | "(" expr ")"
+num  ::= [0-9]+
+"""
+
+SQL = r"""
+root  ::= "SELECT " cols " FROM " ident
+cols  ::= ident ("," " "? ident)*
+ident ::= [a-z_] [a-z0-9_]*
+"""
+
+
+def _parser(ebnf: str, start: str = None) -> GrammarParser:
+    return GrammarParser(compile_grammar(ebnf, start=start))
+
+
+def _matches(ebnf: str, text: str) -> bool:
+    parser = _parser(ebnf)
+    try:
+        parser.append(text)
+        parser.append([SpecialToken.EOS])
+        return True
+    except ParseFailure:
+        return False
+
+
+def _balanced(text: str) -> bool:
+    depth = 0
+    for char in text:
+        depth += 1 if char == "(" else -1
+        if depth < 0:
+            return False
+    return depth == 0
+
+
+class TestGrammarParser(unittest.TestCase):
+
+    def test_regular_grammar_matches_like_re(self):
+        grammars = {
+            r'''s ::= ("ab" | "a")* "c"''': r"(ab|a)*c",
+            r'''s ::= [a-c]+ "-"? x
+                x ::= | [0-9] x''': r"[a-c]+-?[0-9]*",
+        }
+        alphabet = "abc-1"
+        for ebnf, pattern in grammars.items():
+            for length in range(5):
+                for chars in itertools.product(alphabet, repeat=length):
+                    text = "".join(chars)
+                    self.assertEqual(_matches(ebnf, text), bool(re.fullmatch(pattern, text)), (ebnf, text))
+
+    def test_nested_grammar(self):
+        ebnf = r's ::= "(" s ")" s |'
+        for length in range(7):
+            for chars in itertools.product("()", repeat=length):
+                text = "".join(chars)
+                self.assertEqual(_matches(ebnf, text), _balanced(text), text)
+
+    def test_completion_and_forced(self):
+        parser = _parser(SQL)
+        self.assertEqual(parser.get_next(), ["SELECT "])
+        parser.append("SELECT a, b")
+        self.assertEqual(parser.get_next(), [])
+        self.assertEqual(parser.get_completion(), " FROM a")
+        parser.append(" FROM t")
+        self.assertFalse(parser.is_complete())
+        parser.append([SpecialToken.EOS])
+
+        parser = _parser(ARITHMETIC)
+        parser.append("((1+")
+        completion = parser.get_completion()
+        self.assertEqual(completion, "0))")
+        parser.append(completion)
+        parser.append([SpecialToken.EOS])
+
+    def test_copies_diverge(self):
+        parser = _parser(ARITHMETIC)
+        parser.append("(1")
+        left, right = parser.copy(), parser.copy()
+        left.append(")+2")
+        right.append("+(3")
+        self.assertEqual(left.get_completion(), "")
+        self.assertEqual(right.get_completion(), "))")
+        parser.append(")")
+        self.assertEqual(parser.get_parsed(), "(1)")
+        with self.assertRaises(ParseFailure):
+            right.append(")+")
+            right.append([SpecialToken.EOS])
+
+    def test_threaded_copies(self):
+        grammar = compile_grammar(SQL)
+        continuations = ["ab", ", c", "abx", " FROM t"]
+        barrier = threading.Barrier(len(continuations))
+
+        def check(parser: GrammarParser, continuation: str) -> bool:
+            barrier.wait()  # copies of a freshly extended parser are first advanced together
+            copy = parser.copy()
+            try:
+                copy.append(continuation)
+                return True
+            except ParseFailure:
+                return False
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # switch threads often, also between reading and extending a chart
+        try:
+            with ThreadPoolExecutor(max_workers=len(continuations)) as executor:
+                for _ in range(200):
+                    parser = GrammarParser(grammar)
+                    parser.append("SELECT a")
+                    results = executor.map(check, [parser] * len(continuations), continuations)
+                    self.assertEqual(list(results), [True] * len(continuations))
+                    self.assertEqual(parser.get_completion(), " FROM a")
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+    def test_fingerprint(self):
+        parser, other = _parser(ARITHMETIC), _parser(ARITHMETIC)
+        parser.append("12+3")
+        other.append("4-567")
+        self.assertEqual(parser.fingerprint(), other.fingerprint())
+        other.append("+(")
+        self.assertNotEqual(parser.fingerprint(), other.fingerprint())
+        nested = _parser(ARITHMETIC)
+        nested.append("(1")
+        deeper = _parser(ARITHMETIC)
+        deeper.append("((1")
+        self.assertNotEqual(nested.fingerprint(), deeper.fingerprint())
+
+    def test_invalid_grammar(self):
+        for ebnf in ['s ::= "a', "s ::= (a", "s ::= t", "s ::= s", "::= a"]:
+            with self.assertRaises(GrammarSyntaxError):
+                compile_grammar(ebnf)
+        with self.assertRaises(GrammarSyntaxError):
+            compile_grammar('s ::= "a"', start="t")
+
+    def test_masks_are_cached(self):
+        vocab = ["(", "1", "2", "+", ")", "12", "+(", "a", "</s>"]
+        handler = SyntaxValidityCheckHandler(vocab, GrammarCheckFactory(ebnf=ARITHMETIC), eos_token_id=8)
+        for tok in [1, 3, 2, 3, 5, 3, 2]:
+            mask = handler.invalid_next_token_mask()
+            self.assertFalse(mask[tok])
+            for token_id in np.where(~mask)[0]:
+                self.assertTrue(handler._active_checks[0].check_next(vocab[token_id]) or token_id == 8)
+            handler.update([tok])
+        # past the first term, the states after each operator and after each number repeat
+        self.assertEqual(len(handler._mask_cache), 4)
+        self.assertFalse(handler.invalid_next_token_mask()[8])
+
+    def test_masks_walk_the_vocab_trie(self):
+        vocab = ["S", "SE", "SELECT ", "SELECT a", "a", "ab", "a,", "a, b", ", ", " FROM", " FROM t", "t1", "x", None, "</s>"]
+        handler = SyntaxValidityCheckHandler(vocab, GrammarCheckFactory(ebnf=SQL), eos_token_id=14)
+        handler.update([2])  # 'SELECT ' is forced
+        # 'SELECT a, ab FROM tt1', checking tokens that share prefixes such as 'a' and 'a,'
+        for tok in [4, 8, 5, 10, 11]:
+            check = handler._active_checks[0]
+            expected = [not isinstance(token, str) or not check.check_next(token) for token in vocab]
+            expected[14] = not check.check_next([SpecialToken.EOS])
+            self.assertEqual(list(handler.invalid_next_token_mask()), expected)
+            handler.update([tok])
+        self.assertFalse(handler.invalid_next_token_mask()[14])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,13 @@
+import asyncio
+import threading
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from scs.incremental_parse.json.schema import ObjectSchemaParser, JSONKey, JSONValue, BaseType, ObjectSchema, JSONSchemaParser
 from scs.incremental_parse.json.parser import JSONParser
-from scs.handler import SyntaxValidityCheckHandler, JSONSchemaCheckFactory, SyntaxConstraint
+from scs.incremental_parse import ParseFailure
+from scs.mask import TokenMask
+from scs.handler import SyntaxValidityCheckHandler, BeamSearchCheckHandler, JSONSchemaCheckFactory, JSONValidityCheckFactory, OneOfValidityCheckFactory, SyntaxConstraint
 
 #              0     1    2    3    4    5      6    7    8    9    10       11   12   13
 TEST_VOCAB = ['{"', '{', '}', '[', ']', 'key', '1', '2', '3', '"', 'value', ':', ',', ' ']
@@ -32,3 +38,323 @@ class TestJSONSchema(unittest.TestCase):
                     self.assertTrue(tok in [i[1] for i in l])
             handler.update([tok])
             handler.process_invalid_next_tokens()
+
+    def test_next_valid_tokens_greedy(self):
+        handler = SyntaxValidityCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=TEST_SCHEMA))
+        logits = np.zeros(len(TEST_VOCAB))
+        logits[10] = 5.0  # 'value' is invalid at the start of the output
+        logits[3] = 1.0
+        self.assertEqual(handler.next_valid_tokens(logits), [3])
+
+    def test_invalid_candidate_mask(self):
+        handler = SyntaxValidityCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=TEST_SCHEMA))
+        for tok in [3, 0, 5, 7, 9, 11, 9]:
+            handler.update([tok])
+        logits = np.arange(len(TEST_VOCAB), dtype=np.float64)
+        mask = handler.invalid_candidate_mask(logits, top_k=3)
+        # only the top 3 candidates (' ', ',', ':') are considered, all valid inside a string
+        self.assertEqual(list(np.where(~mask[0])[0]), [11, 12, 13])
+
+        # no candidate valid after closing the string value: fall back to the full mask
+        handler.update([9])
+        mask = handler.invalid_candidate_mask(logits, top_k=1)
+        self.assertTrue((mask[0] == handler.invalid_next_token_mask()).all())
+
+    def test_verify_draft(self):
+        handler = SyntaxValidityCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=TEST_SCHEMA))
+        draft = [3, 0, 5, 7, 9, 11, 12, 10]  # ',' is invalid in place of the value's opening quote
+        num_valid, masks = handler.verify_draft(draft)
+        self.assertEqual(num_valid, 6)
+        self.assertEqual(masks.shape, (7, len(TEST_VOCAB)))
+        self.assertTrue(masks[6][12])
+        self.assertFalse(masks[6][9])
+        # the active check is left untouched
+        self.assertEqual(handler._active_checks[0].parser.get_parsed(), "")
+
+    def test_verify_draft_masks_accepted_prefix_only(self):
+        handler = SyntaxValidityCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=TEST_SCHEMA))
+        calls = []
+        invalid_mask = handler._invalid_mask
+        handler._invalid_mask = lambda check: calls.append(check) or invalid_mask(check)
+        updates = []
+        update_check = handler._update_check
+        handler._update_check = lambda check, token_id: updates.append(token_id) or update_check(check, token_id)
+        # the draft is walked once, the masks deciding where it stops
+        handler._active_checks[0].valid_prefix_length = lambda draft: self.fail("draft parsed twice")
+        num_valid, masks = handler.verify_draft([3, 0, 5, 12, 9, 9, 9])
+        self.assertEqual(num_valid, 3)
+        self.assertEqual(len(calls), 4)  # accepted positions and the first rejection
+        self.assertEqual(updates, [3, 0, 5])
+        self.assertEqual(len({id(check) for check in calls}), 1)  # a single copy of the check
+        self.assertTrue(masks[3][12])
+        # ids outside the vocab are rejected
+        for draft in [[3, len(TEST_VOCAB)], [3, -1]]:
+            num_valid, masks = handler.verify_draft(draft)
+            self.assertEqual(num_valid, 1)
+            self.assertEqual(masks.shape, (2, len(TEST_VOCAB)))
+
+    def test_beam_search_shares_checks(self):
+        handler = BeamSearchCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=TEST_SCHEMA))
+        handler.update([3, 3, 3], beam_indices=[0, 0, 0])
+        self.assertEqual(len({id(c) for c in handler._active_checks}), 1)
+        for tok in [0, 5, 7, 9, 11, 9]:
+            handler.update([tok] * 3, beam_indices=[0, 1, 2])
+        # beam 0 is dropped, beam 1 forks into two hypotheses
+        handler.update([9, 10, 9], beam_indices=[1, 1, 2])
+        checks = handler._active_checks
+        self.assertIs(checks[0], checks[2])
+        self.assertEqual(len({id(c) for c in checks}), 2)
+        self.assertNotEqual(checks[0].parser.get_parsed(), checks[1].parser.get_parsed())
+        masks = handler.invalid_next_token_masks()
+        self.assertEqual(masks.shape, (3, len(TEST_VOCAB)))
+        self.assertTrue((masks[0] == masks[2]).all())
+
+    def test_batch_rows_share_masks_by_fingerprint(self):
+        handler = SyntaxValidityCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=TEST_SCHEMA))
+        # both rows are inside the value of "key2" with different text parsed so far
+        for toks in [[3, 3], [0, 0], [5, 5], [7, 7], [9, 9], [11, 11], [9, 9], [10, 6]]:
+            handler.update(toks)
+        first, second = handler._active_checks
+        self.assertNotEqual(first.parser.get_parsed(), second.parser.get_parsed())
+        self.assertEqual(first.fingerprint(), second.fingerprint())
+
+        calls = []
+        invalid_mask = handler._invalid_mask
+        handler._invalid_mask = lambda check: calls.append(check) or invalid_mask(check)
+        masks = handler.invalid_next_token_masks()
+        self.assertEqual(len(calls), 1)
+        self.assertTrue((masks[0] == masks[1]).all())
+
+        handler.update([9, 6])
+        self.assertNotEqual(handler._active_checks[0].fingerprint(), handler._active_checks[1].fingerprint())
+
+    def test_valid_json_masks(self):
+        vocab = TEST_VOCAB + ['["', '"]', '12', '.', '0', 'abc']
+        handler = SyntaxValidityCheckHandler(vocab, JSONValidityCheckFactory())
+        tokenized = [0, 5, 9, 11, 14, 10, 15, 12, 9, 5, 9, 11, 3, 16, 17, 18, 4, 2]
+        self.assertEqual(''.join(vocab[i] for i in tokenized), '{"key":["value"],"key":[12.0]}')
+        for tok in tokenized:
+            check = handler._active_checks[0]
+            mask = handler.invalid_next_token_mask()
+            self.assertFalse(mask[tok])
+            for token_id in np.where(~mask)[0]:
+                self.assertTrue(check.check_next(vocab[token_id]))
+            handler.update([tok])
+        self.assertTrue(handler.invalid_next_token_mask().all())
+
+    def test_eos(self):
+        vocab = TEST_VOCAB + ['</s>']
+        eos = len(TEST_VOCAB)
+        handler = SyntaxValidityCheckHandler(vocab, JSONSchemaCheckFactory(schema=TEST_SCHEMA), eos_token_id=eos)
+        for tok in [3, 0, 5, 7, 9, 11, 9]:
+            self.assertTrue(handler.invalid_next_token_mask()[eos])
+            handler.update([tok])
+        self.assertTrue(handler.invalid_next_token_mask()[eos])  # '</s>' inside a string is still EOS
+        for tok in [10, 9, 2, 4]:
+            self.assertEqual(handler.completed_checks(), [False])
+            handler.update([tok])
+        self.assertEqual(handler.completed_checks(), [True])
+        self.assertEqual(list(handler.await_invalid_next_tokens()), [(0, eos, False)])
+        self.assertEqual(handler.next_valid_tokens(np.arange(len(vocab))), [eos])
+        handler.update([eos])
+
+    def test_eos_one_of(self):
+        vocab = ['yes', 'no', ' please', '</s>']
+        handler = SyntaxValidityCheckHandler(vocab, OneOfValidityCheckFactory(match_strings=['yes', 'yes please', 'no']), eos_token_id=3)
+        handler.update([0])
+        # 'yes' may either end or continue
+        self.assertEqual(list(handler.invalid_next_token_mask()), [True, True, False, False])
+        self.assertEqual(handler.completed_checks(), [False])
+        handler.update([2])
+        self.assertEqual(handler.completed_checks(), [True])
+
+    def test_token_budget_forces_completion(self):
+        handler = SyntaxValidityCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=TEST_SCHEMA), budget_margin=0)
+        for tok in [3, 0, 5, 7, 9, 11]:
+            handler.update([tok])
+        # the shortest completion '""}]' takes all 4 remaining tokens, so its first token is forced
+        handler.set_token_budget(4)
+        self.assertEqual(list(np.where(~handler.invalid_next_token_mask())[0]), [9])
+        for tok in [9, 9, 2, 4]:
+            handler.update([tok])
+        self.assertTrue(handler.completed_checks()[0])
+
+    def test_token_budget_checks_tokens_ending_values(self):
+        handler = SyntaxValidityCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=TEST_SCHEMA))
+        for tok in [3, 0, 5, 7, 9, 11, 9, 10]:
+            handler.update([tok])
+        # the completion '"}]' takes 3 of the 4 remaining tokens
+        handler.set_token_budget(4)
+        check = handler._active_checks[0]
+        fits_budget = handler._fits_budget
+        checked = []
+        handler._fits_budget = lambda check, token_id, *args: checked.append(token_id) or fits_budget(check, token_id, *args)
+        valid = list(np.where(~handler.invalid_next_token_mask())[0])
+        # string characters leave the completion as is, so only tokens with a quote are checked
+        self.assertEqual(checked, [0, 9])
+        expected = []
+        for token_id, token in enumerate(TEST_VOCAB):
+            if check.check_next(token) and fits_budget(check, token_id):
+                expected += [token_id]
+        self.assertEqual(valid, expected)
+
+    def test_get_completions(self):
+        handler = SyntaxValidityCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=TEST_SCHEMA))
+        self.assertEqual(handler.get_completions(), ['[]'])
+        for tok in [3, 0, 5, 7, 9, 11, 9, 10]:
+            handler.update([tok])
+        self.assertEqual(handler.get_completions(), ['"}]'])
+
+    def test_string_length_bound(self):
+        handler = SyntaxValidityCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema="{ key2: string(..6) }"))
+        for tok in [0, 5, 7, 9, 11, 9]:
+            handler.update([tok])
+        self.assertFalse(handler.invalid_next_token_mask()[10])  # 'value' fits in 6 characters
+        handler.update([10])
+        valid = list(np.where(~handler.invalid_next_token_mask())[0])
+        self.assertEqual(valid, [0, 1, 2, 3, 4, 6, 7, 8, 9, 11, 12, 13])  # one character left
+        handler.update([13])
+        self.assertEqual(list(np.where(~handler.invalid_next_token_mask())[0]), [9])
+
+    def test_ordered_keys_force_key_spans(self):
+        vocab = TEST_VOCAB + ['"key2":"', ',"key3":']
+        handler = SyntaxValidityCheckHandler(vocab, JSONSchemaCheckFactory(schema=TEST_SCHEMA, ordered_keys=True))
+        handler.update([3])
+        handler.update([1])
+        self.assertEqual(list(handler.await_invalid_next_tokens()), [(0, 14, False)])
+        for tok in [14, 10, 9]:
+            handler.update([tok])
+        # either continue with the next key or close the object
+        self.assertEqual(list(handler.await_invalid_next_tokens()), [(0, 15, False), (0, 2, False)])
+
+    def test_enum_masks_are_cached(self):
+        vocab = TEST_VOCAB + ['yes', 'no']
+        handler = SyntaxValidityCheckHandler(vocab, JSONSchemaCheckFactory(schema='[]{ key: oneof("yes", "no") }'))
+        for tok in [3, 0, 5, 9, 11]:
+            handler.update([tok])
+        self.assertEqual(list(handler.await_invalid_next_tokens()), [(0, 9, False)])
+        handler.update([9])
+        mask = handler._invalid_mask(handler._active_checks[0])
+        self.assertEqual(list(np.where(~mask)[0]), [14, 15])
+        for tok in [14, 9, 2, 12, 0, 5, 9, 11, 9]:
+            handler.update([tok])
+        # the same enum state in the next item reuses the cached mask
+        self.assertIs(handler._invalid_mask(handler._active_checks[0]), mask)
+        self.assertTrue(handler.invalid_next_token_mask().flags.writeable)
+
+    def test_union_mask(self):
+        schemas = ["{ key2: string }", "{ key2: number }"]
+        masks = []
+        for schema in schemas + [schemas]:
+            handler = SyntaxValidityCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=schema))
+            for tok in [0, 5, 7, 9, 11]:
+                handler.update([tok])
+            masks += [handler.invalid_next_token_mask()]
+        # a token is valid for the union if it is valid for either alternative
+        self.assertTrue((masks[2] == (masks[0] & masks[1])).all())
+        self.assertEqual(list(np.where(~masks[2])[0]), [6, 7, 8, 9])
+
+
+class TestPrefetch(unittest.TestCase):
+
+    VOCAB = TEST_VOCAB + ['["', '"]', '12', '.', '0', 'abc', '</s>']
+    EOS = len(TEST_VOCAB) + 6
+    TOKENIZED = [0, 5, 9, 11, 14, 10, 15, 12, 9, 5, 9, 11, 3, 16, 17, 18, 4, 2]  # {"key":["value"],"key":[12.0]}
+
+    def _wait_for_prefetches(self, handler):
+        for _, future in handler._prefetched.values():
+            future.result()
+
+    def test_prefetched_tokens_are_promoted(self):
+        reference = SyntaxValidityCheckHandler(self.VOCAB, JSONValidityCheckFactory(), eos_token_id=self.EOS)
+        handler = SyntaxValidityCheckHandler(self.VOCAB, JSONValidityCheckFactory(), eos_token_id=self.EOS)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for step, tok in enumerate(self.TOKENIZED):
+                self.assertTrue((handler.invalid_next_token_masks() == reference.invalid_next_token_masks()).all())
+                # an invalid candidate and, every third step, a miss
+                candidates = [tok, 2, 11] if step % 3 else [2, 11]
+                handler.prefetch([candidates], executor=executor)
+                self._wait_for_prefetches(handler)
+                prefetched = handler._prefetched.get((id(handler._active_checks[0]), tok))
+                handler.update([tok])
+                reference.update([tok])
+                if prefetched is not None:
+                    self.assertIs(handler._active_checks[0], prefetched[1].result())
+                    # the next mask was computed in the background
+                    state = (TokenMask, handler._active_checks[0].fingerprint(), None)
+                    self.assertIsNotNone(handler._cache_lookup(state))
+                self.assertEqual(handler._prefetched, {})
+        self.assertEqual(handler.completed_checks(), [True])
+
+    def test_invalid_prefetched_token(self):
+        handler = SyntaxValidityCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=TEST_SCHEMA))
+        handler.prefetch([[3, 2]])
+        self._wait_for_prefetches(handler)
+        with self.assertRaises(ParseFailure):
+            handler.update([2])  # '}' can't begin the array
+
+    def test_beam_search_promotes_prefetched(self):
+        handler = BeamSearchCheckHandler(TEST_VOCAB, JSONSchemaCheckFactory(schema=TEST_SCHEMA))
+        for tok in [3, 0, 5, 7, 9, 11, 9]:
+            handler.update([tok] * 2, beam_indices=[0, 0])
+        handler.prefetch([[9, 10], [9, 10]])
+        self.assertEqual(len(handler._prefetched), 2)  # beams share a check
+        self._wait_for_prefetches(handler)
+        children = {token_id: future.result() for (_, token_id), (_, future) in handler._prefetched.items()}
+        handler.update([9, 10], beam_indices=[0, 0])
+        self.assertIs(handler._active_checks[0], children[9])
+        self.assertIs(handler._active_checks[1], children[10])
+        self.assertEqual([check.parser.get_parsed() for check in handler._active_checks], ['[{"key2":""', '[{"key2":"value'])
+
+
+class TestAsyncHandler(unittest.TestCase):
+
+    VOCAB = TEST_VOCAB + ['["', '"]', '12', '.', '0', 'abc', '</s>']
+    EOS = len(TEST_VOCAB) + 6
+    TOKENIZED = [0, 5, 9, 11, 14, 10, 15, 12, 9, 5, 9, 11, 3, 16, 17, 18, 4, 2]  # {"key":["value"],"key":[12.0]}
+
+    def _handler(self, **kwargs) -> SyntaxValidityCheckHandler:
+        return SyntaxValidityCheckHandler(self.VOCAB, JSONValidityCheckFactory(), eos_token_id=self.EOS, **kwargs)
+
+    def test_next_mask_matches_blocking_masks(self):
+        async def walk(handler, executor):
+            masks = []
+            for tok in self.TOKENIZED:
+                masks += [[mask.to_dense() for mask in await handler.next_mask(executor=executor, batch_size=3)]]
+                await handler.aupdate([tok], executor=executor)
+            return masks
+
+        blocking = self._handler()
+        expected = []
+        for tok in self.TOKENIZED:
+            expected += [[mask.to_dense() for mask in blocking.next_token_masks()]]
+            blocking.update([tok])
+
+        async def run():
+            # sessions sharing a single thread take turns scanning batches
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                return await asyncio.gather(*(walk(self._handler(mask_cache_size=0), executor) for _ in range(3)))
+
+        for masks in asyncio.run(run()):
+            self.assertEqual(len(masks), len(expected))
+            for step, expected_step in zip(masks, expected):
+                self.assertTrue((np.stack(step) == np.stack(expected_step)).all())
+
+    def test_cancel_current_check(self):
+        async def run():
+            handler = self._handler(mask_cache_size=0)
+            release = threading.Event()
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(release.wait)  # keep the scan queued
+                task = asyncio.ensure_future(handler.next_mask(executor=executor, batch_size=3))
+                await asyncio.sleep(0.01)
+                handler.cancel_current_check()
+                release.set()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                # the next step is computed as usual
+                await handler.aupdate([0], executor=executor)
+                [mask] = await handler.next_mask(executor=executor)
+                self.assertTrue((mask.to_dense() == handler.invalid_next_token_mask()).all())
+
+        asyncio.run(run())
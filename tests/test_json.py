@@ -252,6 +252,60 @@ class TestJSONConstraint(unittest.TestCase):
         constraint = valid_json()
         self.assertFalse(constraint.check_next(test_data))
 
+    def test_valid_prefix_length(self):
+        constraint = valid_json()
+        self.assertEqual(constraint.valid_prefix_length(['{"a', '":', '1', '}', '}']), 4)
+        self.assertEqual(constraint.valid_prefix_length(['[', '"x"', ']']), 3)
+        self.assertEqual(constraint.parser.get_parsed(), "")
+
+    def test_chunked_append_matches_char_by_char(self):
+        test_data = [
+            '{"name":"John \\"Smith\\"","age":35,"scores":[1.5,0,20]}',
+            '{"a":01}',
+            '{"a":1.2.3}',
+            '[["x"],[],{"y":{}}]',
+            '{"a":"b"}}',
+        ]
+        for data in test_data:
+            for end in range(len(data) + 1):
+                chunked, by_char = JSONParser(), JSONParser()
+                try:
+                    chunked.append(data[:end])
+                    chunked_ok = True
+                except ParseFailure:
+                    chunked_ok = False
+                try:
+                    by_char.append(list(data[:end]))
+                    by_char_ok = True
+                except ParseFailure:
+                    by_char_ok = False
+                self.assertEqual(chunked_ok, by_char_ok, data[:end])
+                if chunked_ok:
+                    self.assertEqual(chunked.get_parsed(), by_char.get_parsed())
+                    self.assertEqual(chunked.fingerprint(), by_char.fingerprint())
+
+    def test_completion(self):
+        data = '{"a":["x",{"b":1.5}],"c\\"":{}}'
+        for kwargs in [{}, {"allow_empty": False}, {"allow_empty_children": False}]:
+            for end in range(len(data) + 1):
+                parser = JSONParser(**kwargs)
+                try:
+                    parser.append(data[:end])
+                except ParseFailure:
+                    continue
+                completion = parser.get_completion()
+                parser.append(completion)
+                self.assertTrue(parser.is_complete(), data[:end] + completion)
+
+    def test_empty_container_completion(self):
+        for data in ['{}', '[]', '{"a":{}}', '[[]]']:
+            parser = JSONParser()
+            parser.append(data)
+            self.assertTrue(parser.is_complete(), data)
+            self.assertEqual(parser.get_completion(), "", data)
+        for text, salvaged in [('{}', '{}'), ('[]', '[]'), ('[]x', '[]'), ('{}}', '{}')]:
+            self.assertEqual(valid_json().salvage(text), salvaged)
+
     def test_disallow_array_in_outer_json(self):
         test_data = '[[]]'
         constraint = valid_json(allow_outer_list=False)
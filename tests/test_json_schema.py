@@ -1,6 +1,8 @@
 import unittest
-from scs.incremental_parse.json.schema import ObjectSchemaParser, JSONKey, JSONValue, BaseType, ObjectSchema, JSONSchemaParser
+from scs.incremental_parse.json.schema import ObjectSchemaParser, JSONKey, JSONValue, BaseType, ObjectSchema, JSONSchemaParser, SchemaKind
 from scs.incremental_parse.json.parser import JSONParser
+from scs.incremental_parse import ParseFailure
+from scs.constraint.json import force_json_schema, compile_json_schema
 
 
 class TestJSONSchema(unittest.TestCase):
@@ -314,3 +316,323 @@ class TestJSONParser(unittest.TestCase):
             done = json_parser._append(char)
 
         self.assertTrue(done)
+
+
+class TestObjectKeyIndex(unittest.TestCase):
+
+    def test_key_is_prefix_of_another_key(self):
+        schema = JSONSchemaParser()
+        schema.append("{ a: number, ab?: string }")
+        parser = JSONParser(schema=schema.get_schema())
+        parser.append('{"ab":"x","a":1}')
+        self.assertTrue(parser._complete)
+
+    def test_repeated_key(self):
+        schema = JSONSchemaParser()
+        schema.append("{ a: number, b?: number }")
+        parser = JSONParser(schema=schema.get_schema())
+        parser.append('{"a":1,')
+        with self.assertRaises(ParseFailure):
+            parser.copy().append('"a"')
+        self.assertEqual(parser.get_next(), ['"'])
+        parser.append('"')
+        self.assertEqual(parser.get_next(), ['b"'])
+
+    def test_wide_object(self):
+        names = [f"key_{i}" for i in range(300)]
+        schema = JSONSchemaParser()
+        schema.append("{" + ",".join(f"{n}?: number" for n in names) + "}")
+        parser = JSONParser(schema=schema.get_schema())
+        parser.append("{" + ",".join(f'"{n}":{i}' for i, n in enumerate(reversed(names))) + "}")
+        self.assertTrue(parser._complete)
+
+
+class TestInternedSchema(unittest.TestCase):
+
+    def test_intern_schema(self):
+        from scs.constraint.json import compile_json_schema
+        from scs.incremental_parse.json.schema import intern_schema, SchemaKind
+        first = JSONSchemaParser()
+        first.append("{ a: string, b: []{ c: number } }")
+        second = JSONSchemaParser()
+        second.append("{ a: string, b: []{ c: number } }")
+        interned = intern_schema(first.get_schema())
+        self.assertIs(intern_schema(second.get_schema()), interned)
+        self.assertIs(interned.key_index.values[0], BaseType.STRING.schema())
+        self.assertEqual(interned.kind, SchemaKind.OBJECT)
+        self.assertEqual({interned: 1}[compile_json_schema("{a:string,b:[]{c:number}}")], 1)
+        with self.assertRaises(ValueError):
+            interned.add_prop(JSONKey("d"), JSONValue(BaseType.NUMBER.schema()))
+
+    def test_intern_schema_copies_input(self):
+        import gc
+        from scs.incremental_parse.json.schema import intern_schema, _INTERNED_SCHEMAS
+        parser = JSONSchemaParser()
+        parser.append("{ " + ", ".join(f"k{i}: {{ v: number }}" for i in range(50)) + " }")
+        schema = parser.get_schema()
+        children = [v.value_def for _, v in schema.get_items()]
+        interned = intern_schema(schema)
+        self.assertIsNot(interned, schema)
+        self.assertIsNone(schema._key)  # the input is left as it was
+        self.assertTrue(all(v.value_def is child for (_, v), child in zip(schema.get_items(), children)))
+        # the hash is computed once, when interned
+        self.assertEqual(interned._hash, hash(interned.key()))
+        self.assertEqual(hash(interned), hash(schema))
+        self.assertEqual(interned, schema)
+        # schemas no longer in use are dropped from the intern table
+        key = interned.key()
+        del interned
+        gc.collect()
+        self.assertNotIn(key, _INTERNED_SCHEMAS)
+
+    def test_key_fingerprint_keeps_its_trie(self):
+        import gc
+        import weakref
+        parser = JSONParser(schema=compile_json_schema("{ " + ", ".join(f"key{i}: number" for i in range(20)) + " }"))
+        parser.append('{"key1')
+        key_parser = parser._subparser._active_subparser
+        fingerprint = key_parser.fingerprint()
+        node = weakref.ref(key_parser._node)
+        del parser, key_parser
+        gc.collect()
+        # a cached fingerprint holds the trie node, so its id can't be reused by another schema's node
+        self.assertIsNotNone(node())
+        self.assertIn(node(), fingerprint)
+
+    def test_value_prefix(self):
+        schema = JSONSchemaParser()
+        schema.append("{ a: string, b: []number, c: {}, d: { e: number } }")
+        parser = JSONParser(schema=schema.get_schema())
+        parser.append('{"a"')
+        self.assertEqual(parser.get_next(), [':"'])
+        parser.append(':"x","b"')
+        self.assertEqual(parser.get_next(), [':['])
+        parser.append(':[1],"c"')
+        self.assertEqual(parser.get_next(), [':{'])
+        parser.append(':{')
+        self.assertEqual(parser.get_next(), ['}'])
+        parser.append('},"d"')
+        self.assertEqual(parser.get_next(), [':{"'])
+
+    def test_chunked_append_matches_char_by_char(self):
+        schema = JSONSchemaParser()
+        schema.append("[]{ name: string, ages: []number, inner?: { a: string } }")
+        schema = schema.get_schema()
+        data = '[{"name":"a\\"b","ages":[10,2.5],"inner":{"a":"x"}},{"name":"c","ages":[01]}]'
+        for end in range(len(data) + 1):
+            results = []
+            for chars in [data[:end], list(data[:end])]:
+                parser = JSONParser(schema=schema)
+                try:
+                    parser.append(chars)
+                    results += [(parser.get_parsed(), parser.fingerprint())]
+                except ParseFailure:
+                    results += [None]
+            self.assertEqual(results[0], results[1], data[:end])
+
+
+class TestCompletion(unittest.TestCase):
+
+    def test_schema_completion_is_valid_and_shortest(self):
+        schema = JSONSchemaParser()
+        schema.append("[]{ name: string, ages: []number, inner?: { a: string }, id: number, tag?: string }")
+        schema = schema.get_schema()
+        data = '[{"name":"a\\"b","inner":{"a":"x"},"ages":[10,2.5],"id":12},{"tag":"t","name":"c","ages":[],"id":1}]'
+        self.assertEqual(JSONParser(schema=schema).get_completion(), '[]')
+        for end in range(len(data) + 1):
+            parser = JSONParser(schema=schema)
+            parser.append(data[:end])
+            completion = parser.get_completion()
+            parser.append(completion)
+            self.assertTrue(parser.is_complete(), data[:end] + completion)
+
+        parser = JSONParser(schema=schema)
+        parser.append('[{"ages":[1')
+        self.assertEqual(parser.get_completion(), '],"name":"","id":0}]')
+        parser = JSONParser(schema=schema)
+        parser.append('[{"name":"","ages":[],"id":0,')
+        self.assertEqual(parser.get_completion(), '"tag":""}]')
+
+    def test_salvage_truncated_output(self):
+        constraint = force_json_schema(schema="[]{ name: string, ages?: []number, id: number }")
+        self.assertEqual(constraint.salvage('[{"name":"x'), '[{"name":"x","id":0}]')
+        self.assertEqual(constraint.salvage('[{"ages":[1,2.'), '[{"ages":[1,2.0],"name":"","id":0}]')
+        # the invalid tail is dropped before completing
+        self.assertEqual(constraint.salvage('[{"name":"x"} and then'), '[{"name":"x","id":0}]')
+        # the constraint itself is left untouched
+        self.assertEqual(constraint.get_completion(), '[]')
+
+    def test_salvage_complete_output(self):
+        constraint = force_json_schema(schema="[]{ name: string, ages?: []number, id: number }")
+        for text in ['[]', '[{"name":"x","id":1}]', '[{"ages":[],"name":"","id":0}]']:
+            self.assertEqual(constraint.salvage(text), text)
+            # trailing garbage after complete output is dropped, without appending a completion
+            self.assertEqual(constraint.salvage(text + ']x'), text)
+            self.assertEqual(constraint.salvage(text + ' and then'), text)
+
+
+class TestLengthBounds(unittest.TestCase):
+
+    def test_parse_bounds(self):
+        schema = JSONSchemaParser()
+        schema.append("{ a: string(2..4), b: [1..]number, c?: [..1]{ d: string(3) }, e: string }")
+        schema = schema.get_schema()
+        self.assertEqual([repr(v) for v in schema.key_index.values[:2]], ["string(2..4)", "[1..]number"])
+        self.assertEqual(schema.key_index.values[3], BaseType.STRING.schema())
+        self.assertEqual(schema.key_index.values[2].max_items, 1)
+        for invalid in ["{ a: string(4..2) }", "{ a: [1.2]number }", "{ a: string(x) }"]:
+            with self.assertRaises(ParseFailure):
+                JSONSchemaParser().append(invalid)
+
+    def test_enforce_bounds(self):
+        constraint = force_json_schema(schema="{ a: string(2..4), b: [1..2]number }")
+        self.assertFalse(constraint.check_next('{"a":"x"'))
+        self.assertFalse(constraint.check_next('{"a":"xyzwv'))
+        self.assertTrue(constraint.check_next('{"a":"x\\"yz"'))
+        self.assertFalse(constraint.check_next('{"a":"xy","b":[]'))
+        self.assertFalse(constraint.check_next('{"a":"xy","b":[1,2,'))
+        self.assertTrue(constraint.check_next('{"a":"xy","b":[1,2]}'))
+        self.assertEqual(constraint.get_completion(), '{"a":"__","b":[0]}')
+
+        constraint.update_parser('{"a":"xyzw')
+        self.assertEqual(constraint.get_next(), ['"'])
+        constraint.update_parser('","b":[1,2')
+        self.assertEqual(constraint.get_next(), [])  # the number may still continue
+        constraint.update_parser('0')
+        self.assertFalse(constraint.check_next(','))
+        constraint.update_parser(']')
+        self.assertEqual(constraint.get_completion(), '}')
+
+
+class TestOrderedKeys(unittest.TestCase):
+
+    def test_keys_follow_declaration_order(self):
+        constraint = force_json_schema(schema="{ a: string, b?: number, c: []{ d: string, e?: string } }", ordered_keys=True)
+        self.assertTrue(constraint.check_next('{"a":"x","c":[]}'))
+        self.assertTrue(constraint.check_next('{"a":"x","b":1,"c":[{"d":"y","e":"z"}]}'))
+        self.assertFalse(constraint.check_next('{"b":1,"a":"x"'))
+        self.assertFalse(constraint.check_next('{"a":"x","c":[{"e":"z"'))
+        self.assertFalse(force_json_schema(schema="{ a: string, b?: number }").check_next('{"a":"x","c"'))
+
+    def test_key_spans_are_forced(self):
+        constraint = force_json_schema(schema="{ alpha: string, beta?: []number, gamma: { d: string } }", ordered_keys=True)
+        constraint.update_parser('{')
+        self.assertEqual(constraint.get_next(), ['"alpha":"'])
+        constraint.update_parser('"al')
+        self.assertEqual(constraint.get_next(), ['pha":"'])
+        constraint.update_parser('pha":"x"')
+        self.assertEqual(constraint.get_next(), [',"beta":[', ',"gamma":{"'])
+        constraint.update_parser(',"gamma":{"d":""}')
+        self.assertEqual(constraint.get_next(), ['}'])
+
+    def test_unordered_schema_is_distinct(self):
+        self.assertIsNot(compile_json_schema("{ a: string }"), compile_json_schema("{ a: string }", ordered_keys=True))
+
+
+class TestStringEnum(unittest.TestCase):
+
+    def test_parse_oneof(self):
+        schema = JSONSchemaParser()
+        schema.append('{ status: oneof("active", "in\\"active"), tags: [..2]oneof("a", "b", "a") }')
+        schema = schema.get_schema()
+        status, tags = schema.key_index.values
+        self.assertEqual(status.kind, SchemaKind.ENUM)
+        self.assertEqual(status.options, ['active', 'in\\"active'])
+        self.assertEqual(repr(tags), '[..2]oneof("a", "b")')
+        for invalid in ['{ a: oneof() }', '{ a: oneof("x",) }', '{ a: oneof(x) }']:
+            with self.assertRaises(ParseFailure):
+                JSONSchemaParser().append(invalid)
+
+    def test_option_order_is_kept_when_interned(self):
+        ab, ba = compile_json_schema('{ a: oneof("a", "b") }'), compile_json_schema('{ a: oneof("b", "a", "b") }')
+        self.assertIsNot(ab, ba)
+        self.assertEqual(repr(ab), '{ a: oneof("a", "b") }')
+        self.assertEqual(repr(ba), '{ a: oneof("b", "a") }')
+        self.assertEqual(force_json_schema(schema='{ a: oneof("b", "a") }').get_completion(), '{"a":"b"}')
+
+    def test_enum_fingerprint_holds_its_trie_node(self):
+        constraint = force_json_schema(schema='{ a: oneof("left", "right") }')
+        constraint.update_parser('{"a":"ri')
+        enum_parser = constraint.parser._subparser._active_subparser
+        self.assertIn(enum_parser._node, enum_parser.fingerprint())
+        self.assertIs(enum_parser._node, constraint.parser._schema.key_index.values[0].trie.children["r"].children["i"])
+
+    def test_enum_values(self):
+        constraint = force_json_schema(schema='{ status: oneof("active", "inactive", "act"), tags: []oneof("a", "bb") }')
+        self.assertEqual(constraint.get_completion(), '{"status":"act","tags":[]}')
+        self.assertTrue(constraint.check_next('{"status":"act","tags":["bb","a"]}'))
+        self.assertTrue(constraint.check_next('{"status":"acti'))
+        self.assertFalse(constraint.check_next('{"status":"acti"'))
+        self.assertFalse(constraint.check_next('{"status":"act","tags":["c"'))
+
+        constraint.update_parser('{"status":"')
+        self.assertEqual(sorted(constraint.get_next()), ['act"', 'active"', 'inactive"'])
+        constraint.update_parser('i')
+        self.assertEqual(constraint.get_next(), ['nactive"'])
+        self.assertEqual(constraint.get_completion(), 'nactive","tags":[]}')
+
+
+    def test_enum_values_with_escapes(self):
+        constraint = force_json_schema(schema='{ a: oneof("x\\"y", "z\\\\", "w") }')
+        self.assertTrue(constraint.check_next('{"a":"x\\"y"}'))
+        self.assertTrue(constraint.check_next('{"a":"z\\\\"}'))
+        self.assertFalse(constraint.check_next('{"a":"x"'))  # "x" isn't an option
+        self.assertFalse(constraint.check_next('{"a":"z\\"'))  # the quote is escaped, so it doesn't close "z\\"
+        for text in ['{"a":"x\\"y"}', '{"a":"z\\\\"}']:
+            parser = force_json_schema(schema='{ a: oneof("x\\"y", "z\\\\", "w") }')
+            for char in text:  # char by char as well as in chunks
+                parser.update_parser(char)
+            self.assertTrue(parser.is_complete(), text)
+        constraint.update_parser('{"a":"x')
+        self.assertEqual(constraint.get_next(), ['\\"y"'])
+
+
+class TestUnion(unittest.TestCase):
+
+    def test_union_tracks_surviving_alternatives(self):
+        constraint = force_json_schema(schema=['{ a: string }', '{ a: number, b?: string }', '[]number'])
+        self.assertEqual(constraint.get_next(), ['{', '['])
+        self.assertEqual(constraint.get_completion(), '[]')
+        self.assertTrue(constraint.check_next('{"a":"x"}'))
+        self.assertTrue(constraint.check_next('{"a":1,"b":""}'))
+        self.assertFalse(constraint.check_next('{"a":"x","b"'))
+        constraint.update_parser('{"a":')
+        self.assertEqual(len(constraint.parser.surviving_schemas()), 2)
+        constraint.update_parser('1')
+        self.assertEqual(repr(constraint.parser.surviving_schemas()[0]), '{ a: number, b?: string }')
+        self.assertEqual(constraint.get_completion(), '}')
+
+    def test_duplicate_alternatives_merge(self):
+        constraint = force_json_schema(schema=['{ a: string }', '{a:string}'])
+        self.assertEqual(len(constraint.parser.surviving_schemas()), 1)
+
+    def test_alternatives_merge_once_their_remaining_schemas_are_equal(self):
+        constraint = force_json_schema(schema=['{ x: oneof("a", "b"), y: number }', '{ x: string, y: number }'])
+        constraint.update_parser('{"x":"a')
+        self.assertEqual(len(constraint.parser.alternatives), 2)
+        constraint.update_parser('",')
+        # both are left with `y: number`, and are parsed by a single alternative from here on
+        self.assertEqual(len(constraint.parser.alternatives), 1)
+        self.assertEqual(len(constraint.parser.surviving_schemas()), 2)
+        merged = constraint.parser.fingerprint()
+        self.assertFalse(constraint.check_next('"x"'))
+        constraint.update_parser('"y":1}')
+        self.assertTrue(constraint.is_complete())
+        # a different value for `x` reaches the same merged state
+        other = force_json_schema(schema=['{ x: oneof("a", "b"), y: number }', '{ x: string, y: number }'])
+        other.update_parser('{"x":"b",')
+        self.assertEqual(other.parser.fingerprint(), merged)
+
+    def test_discriminated_union(self):
+        schemas = ['{ name: string, type: oneof("cat"), lives: number }', '{ type: oneof("dog"), breed?: string }']
+        constraint = force_json_schema(schema=schemas, discriminator="type")
+        self.assertFalse(constraint.check_next('{"name"'))
+        self.assertTrue(constraint.check_next('{"type":"cat","name":"x","lives":9}'))
+        constraint.update_parser('{"')
+        self.assertEqual(constraint.get_next(), ['type"'])
+        constraint.update_parser('type":"')
+        self.assertEqual(constraint.get_next(), ['cat"', 'dog"'])
+        constraint.update_parser('d')
+        self.assertEqual(constraint.get_completion(), 'og"}')
+        with self.assertRaises(ValueError):
+            force_json_schema(schema=schemas, discriminator="name")
@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+from scs.mask import AllowList, DenyList, DenseMask, compact_mask, apply_masks
+from scs.handler import SyntaxValidityCheckHandler, JSONSchemaCheckFactory
+
+
+class TestTokenMask(unittest.TestCase):
+
+    def test_compact_mask_form(self):
+        mask = np.ones(64, dtype=np.bool_)
+        mask[[3, 5]] = False
+        self.assertIsInstance(compact_mask(mask), AllowList)
+        self.assertIsInstance(compact_mask(~mask), DenyList)
+        mask[:32] = False
+        self.assertIsInstance(compact_mask(mask), DenseMask)
+        self.assertIsInstance(compact_mask(mask, max_sparse=32), AllowList)
+        for form in [compact_mask(mask), compact_mask(mask, max_sparse=32), compact_mask(mask, max_sparse=64)]:
+            self.assertTrue((form.to_dense() == mask).all())
+            self.assertEqual(form.num_allowed(), 32)
+
+    def test_apply_masks(self):
+        rng = np.random.default_rng(0)
+        logits = rng.normal(size=(5, 72))  # padded past the vocab
+        dense_masks = [rng.random(64) < p for p in [0.02, 0.98, 0.5, 0.4, 0.5]]
+        masks = [compact_mask(mask) for mask in dense_masks]
+        self.assertEqual([type(mask) for mask in masks], [DenyList, AllowList, DenseMask, DenseMask, DenseMask])
+        expected = logits.copy()
+        expected[:, 64:] = -np.inf  # padding is never sampled
+        for row, mask in enumerate(dense_masks):
+            expected[row, :64][mask] = -np.inf
+        self.assertTrue((apply_masks(logits.copy(), masks) == expected).all())
+        for row, mask in enumerate(masks):  # one row at a time, and written to a buffer
+            self.assertTrue((mask.apply(logits[row].copy()) == expected[row]).all())
+            out = np.zeros(72, dtype=np.bool_)
+            mask.write(out)
+            self.assertTrue((out == np.isinf(expected[row])).all())
+        # a single dense row is applied on its own
+        self.assertTrue((apply_masks(np.zeros((1, 12)), [compact_mask(np.arange(10) % 2 == 0)])[0, 10:] == -np.inf).all())
+        with self.assertRaises(ValueError):
+            apply_masks(logits, masks[:2])
+
+    def test_handler_next_token_masks(self):
+        vocab = ['{"', 'key', '":', '"', 'a', 'b', '}', ',', '1', '</s>']
+        handler = SyntaxValidityCheckHandler(vocab, JSONSchemaCheckFactory(schema="{ key: string }"), eos_token_id=9)
+        [mask] = handler.next_token_masks()
+        self.assertIsInstance(mask, AllowList)  # forced
+        self.assertEqual(list(mask.token_ids), [0])
+        for tok in [0, 1, 2, 3]:
+            handler.update([tok])
+        [mask] = handler.next_token_masks(max_sparse=3)  # inside the string value
+        self.assertIsInstance(mask, DenyList)
+        self.assertTrue((mask.to_dense() == handler.invalid_next_token_mask()).all())
+        self.assertIs(handler.next_token_masks(max_sparse=3)[0], mask)
+
+
+if __name__ == '__main__':
+    unittest.main()
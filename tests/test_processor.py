@@ -0,0 +1,102 @@
+import json
+import time
+import unittest
+import numpy as np
+from scs.processor import SyntaxConstraintLogitsProcessor, torch
+from scs.handler import SyntaxValidityCheckHandler, JSONSchemaCheckFactory
+
+VOCAB = ['{"', 'name', '":', '"', 'bob', 'al', 'ice', '"}', '}', ':', ' ', 'x', '</s>']
+EOS = 12
+PADDED_VOCAB_SIZE = 16  # models pad their embedding matrix past the tokenizer's vocab
+
+
+class FakeModel:
+
+    r"""
+    Returns random logits, so only the constraint keeps the output valid"""
+    def __init__(self, seed: int = 0):
+        self._rng = np.random.default_rng(seed)
+
+    def __call__(self, input_ids: np.ndarray) -> np.ndarray:
+        return self._rng.normal(size=(len(input_ids), PADDED_VOCAB_SIZE)).astype(np.float32)
+
+
+def _generate(processor, input_ids, max_new_tokens: int = 40, to_numpy=np.asarray, model=None):
+    model = model or FakeModel()
+    finished = np.zeros(len(input_ids), dtype=np.bool_)
+    for _ in range(max_new_tokens):
+        scores = processor(input_ids, model(to_numpy(input_ids)))
+        next_ids = to_numpy(scores).argmax(axis=1)
+        next_ids[finished] = EOS  # padding of rows that already ended
+        finished |= next_ids == EOS
+        input_ids = np.concatenate([to_numpy(input_ids), next_ids[:, None]], axis=1)
+        if finished.all():
+            break
+    return input_ids
+
+
+def _decode(token_ids) -> str:
+    return "".join(VOCAB[i] for i in token_ids if i != EOS)
+
+
+class TestLogitsProcessor(unittest.TestCase):
+
+    def _processor(self, **kwargs):
+        handler = SyntaxValidityCheckHandler(VOCAB, JSONSchemaCheckFactory(schema="{ name: string }"), eos_token_id=EOS)
+        return SyntaxConstraintLogitsProcessor(handler, **kwargs)
+
+    def test_fake_model_generates_valid_output(self):
+        prompt = np.array([[11, 10], [10, 11], [11, 11]])
+        output = _generate(self._processor(), prompt)
+        for row in output[:, 2:]:
+            self.assertEqual(list(json.loads(_decode(row)).keys()), ["name"])
+            self.assertEqual(row[-1], EOS)
+
+    def test_prefetch_top_k(self):
+        prompt = np.array([[11, 10], [10, 11], [11, 11]])
+        expected = _generate(self._processor(), prompt)
+        processor = self._processor(prefetch_top_k=3)
+        handler = processor.handler
+        take_prefetched = handler._take_prefetched
+        promoted = []
+
+        def record_promotion(check, token_id):
+            child = take_prefetched(check, token_id)
+            promoted.append(child is not None)
+            return child
+
+        handler._take_prefetched = record_promotion
+        model = FakeModel()
+
+        def slow_model(input_ids):  # prefetching overlaps with the forward pass
+            time.sleep(0.02)
+            return model(input_ids)
+
+        self.assertTrue((_generate(processor, prompt, model=slow_model) == expected).all())
+        # the greedy pick is always prefetched, except for rows created at the first update
+        self.assertTrue(all(promoted[len(prompt):]))
+
+    def test_mask_buffer_is_reused(self):
+        processor = self._processor()
+        input_ids = np.array([[11], [11]])
+        scores = processor(input_ids, np.zeros((2, PADDED_VOCAB_SIZE), dtype=np.float32))
+        buffer = processor._buffer
+        self.assertTrue(np.isinf(scores[:, len(VOCAB):]).all())  # padding is never sampled
+        self.assertEqual(list(np.where(np.isfinite(scores[0]))[0]), [0])
+        processor(np.array([[11, 0], [11, 0]]), np.zeros((2, PADDED_VOCAB_SIZE), dtype=np.float32))
+        self.assertIs(processor._buffer, buffer)
+        with self.assertRaises(ValueError):
+            processor(np.array([[11, 0, 1, 2], [11, 0, 1, 2]]), np.zeros((2, PADDED_VOCAB_SIZE)))
+
+    @unittest.skipIf(torch is None, "torch isn't installed")
+    def test_torch_tensors(self):
+        prompt = torch.tensor([[11, 10], [10, 11]])
+        to_numpy = lambda x: x.numpy() if isinstance(x, torch.Tensor) else np.asarray(x)
+        model = FakeModel()
+        output = _generate(self._processor(), prompt, to_numpy=to_numpy, model=lambda ids: torch.from_numpy(model(ids)))
+        for row in output[:, 2:]:
+            self.assertEqual(list(json.loads(_decode(row)).keys()), ["name"])
+
+
+if __name__ == '__main__':
+    unittest.main()
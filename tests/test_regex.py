@@ -0,0 +1,112 @@
+import re
+import unittest
+import itertools
+from collections import OrderedDict
+import numpy as np
+from scs.incremental_parse.regex import RegexParser, compile_regex, RegexSyntaxError
+from scs.incremental_parse import SpecialToken, ParseFailure
+from scs.handler import SyntaxValidityCheckHandler, RegexCheckFactory
+
+PATTERNS = [
+    r"\d{4}-\d{2}-\d{2}",
+    r"[A-Z]{2,3}-\d+",
+    r"(ab|a)*c",
+    r"\(?\d{3}\)?[ -]?\d{3}",
+    r"(?:yes|no)!?",
+    r"[^\s@]+@[a-z]+\.(com|org)",
+    r"a.b",
+    r"[\w.-]+",
+]
+
+
+def _matches(pattern: str, text: str) -> bool:
+    parser = RegexParser(pattern)
+    try:
+        parser.append(text)
+        parser.append([SpecialToken.EOS])
+        return True
+    except ParseFailure:
+        return False
+
+
+class TestRegexParser(unittest.TestCase):
+
+    def test_matches_like_re(self):
+        alphabet = "aAbcZ09-@.!( )\n"
+        for pattern in PATTERNS:
+            expected = re.compile(pattern)
+            for length in range(4):
+                for chars in itertools.product(alphabet, repeat=length):
+                    text = "".join(chars)
+                    self.assertEqual(_matches(pattern, text), bool(expected.fullmatch(text)), (pattern, text))
+
+    def test_minimized(self):
+        self.assertEqual(compile_regex(r"(a|b)*abb").num_states(), 4)
+        self.assertEqual(compile_regex(r"a*|a+").num_states(), 1)
+
+    def test_completion_and_forced(self):
+        for pattern in PATTERNS:
+            completion = RegexParser(pattern).get_completion()
+            self.assertTrue(re.fullmatch(pattern, completion), (pattern, completion))
+        parser = RegexParser(r"id_[a-f0-9]{2}-(x|yz)")
+        self.assertEqual(parser.get_next(), ["id_"])
+        parser.append("id_a0")
+        self.assertEqual(parser.get_next(), ["-"])
+        self.assertEqual(parser.get_completion(), "-x")
+        parser.append("-x")
+        self.assertTrue(parser.is_complete())
+
+    def test_chunked_append_matches_char_by_char(self):
+        text = "2024-01-3x"
+        for end in range(len(text) + 1):
+            fingerprints = []
+            for chars in [text[:end], list(text[:end])]:
+                parser = RegexParser(r"\d{4}-\d{2}-\d{2}")
+                try:
+                    parser.append(chars)
+                    fingerprints += [parser.fingerprint()]
+                except ParseFailure:
+                    fingerprints += [None]
+            self.assertEqual(fingerprints[0], fingerprints[1])
+
+    def test_invalid_pattern(self):
+        for pattern in ["(ab", "a)", "*a", "[a-", "a{3,1}"]:
+            with self.assertRaises(RegexSyntaxError):
+                RegexParser(pattern)
+        # anchors and backreferences would silently match the escaped character instead
+        for pattern in [r"\bab", r"\Ba", r"\Aa", r"a\Z", r"(a)\1", r"(a)(b)\2", r"[\B]"]:
+            with self.assertRaises(RegexSyntaxError):
+                RegexParser(pattern)
+        self.assertTrue(_matches(r"a[\b]", "a\b"))  # a backspace inside a class, as in re
+
+    def test_empty_pattern_and_anchors(self):
+        self.assertTrue(RegexParser("").is_complete())
+        self.assertTrue(RegexParser("").copy().is_complete())
+        self.assertFalse(_matches("", "a"))
+        for pattern, text in itertools.product([r"a$", r"^a$", r"a\$", r"a\\$", r"a\\\$"], ["a", "a$", "a\\", "a\\$"]):
+            self.assertEqual(_matches(pattern, text), bool(re.fullmatch(pattern, text)), (pattern, text))
+
+    def test_precomputed_masks(self):
+        vocab = ["20", "2", "-", "1", "12", "-0", "a", "</s>"]
+        shared_cache = OrderedDict()
+        other = SyntaxValidityCheckHandler(vocab, RegexCheckFactory(pattern=r"a+"), eos_token_id=7, mask_cache_size=2, mask_cache=shared_cache)
+        handler = SyntaxValidityCheckHandler(vocab, RegexCheckFactory(pattern=r"\d{2,4}-\d"), eos_token_id=7, mask_cache_size=2, mask_cache=shared_cache)
+        self.assertEqual(handler.precompute_masks(), compile_regex(r"\d{2,4}-\d").num_states())
+        # precomputed masks don't grow the shared cache past its bound
+        self.assertEqual(handler._mask_cache_size, 2)
+        other.invalid_next_token_mask()
+        self.assertLessEqual(len(shared_cache), 2)
+        num_cached = len(handler._mask_cache)
+        handler._compute_invalid_mask = lambda check: self.fail("mask wasn't precomputed")
+        for tok in [0, 4, 2, 3]:
+            mask = handler.invalid_next_token_mask()
+            self.assertFalse(mask[tok])
+            for token_id in np.where(~mask)[0]:
+                self.assertTrue(handler._active_checks[0].check_next(vocab[token_id]) or token_id == 7)
+            handler.update([tok])
+        self.assertEqual(handler.completed_checks(), [True])
+        self.assertEqual(len(handler._mask_cache), num_cached)
+
+
+if __name__ == '__main__':
+    unittest.main()
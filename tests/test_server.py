@@ -0,0 +1,161 @@
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+import numpy as np
+from scs.server import SidecarServer, SidecarClient, SidecarError, encode_mask, decode_mask
+from scs.mask import compact_mask
+from scs.constraint.json import force_json_schema
+from scs.incremental_parse import SpecialToken, ParseFailure
+
+VOCAB = ['{"', 'name', '":', '"', 'bob', 'al', 'ice', '"}', '}', ':', ' ', 'x', 'age', '",', '"age', '1', '0', ',', '</s>']
+EOS = 18
+SCHEMA = "{ name: string, age?: number }"
+
+
+def _is_valid(text: str) -> bool:
+    check = force_json_schema(SCHEMA)
+    try:
+        check.update_parser(text)
+        check.update_parser([SpecialToken.EOS])
+        return True
+    except ParseFailure:
+        return False
+
+
+async def _random_walk(client: SidecarClient, vocab_id: str, seed: int, max_new_tokens: int = 24) -> str:
+    r"""
+    Fake model worker sampling uniformly among the valid tokens, retrying requests the server is
+    too busy to take"""
+    async def retry(coroutine_fn):
+        while True:
+            try:
+                return await coroutine_fn()
+            except SidecarError as e:
+                if not e.retry:
+                    raise
+                await asyncio.sleep(0.001)
+
+    rng = np.random.default_rng(seed)
+    constraint = {"type": "json_schema", "schema": SCHEMA}
+    session = await retry(lambda: client.create_session(vocab_id, constraint, max_new_tokens=max_new_tokens, budget_margin=4))
+    text = ""
+    for _ in range(max_new_tokens):
+        [mask] = await retry(lambda: client.get_masks(session))
+        token_id = int(rng.choice(np.flatnonzero(~mask.to_dense())))
+        if token_id == EOS:
+            break
+        text += VOCAB[token_id]
+        await retry(lambda: client.update(session, [token_id]))
+    await retry(lambda: client.close_session(session))
+    return text
+
+
+class TestSidecarServer(unittest.TestCase):
+
+    def _run(self, test_fn, **server_kwargs):
+        async def run():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "scs.sock")
+                server = SidecarServer(**server_kwargs)
+                await server.start(path=path)
+                try:
+                    await test_fn(server, path)
+                finally:
+                    await server.close()
+        asyncio.run(run())
+
+    def test_random_walks_are_valid(self):
+        async def test(server, path):
+            clients = [await SidecarClient.connect(path) for _ in range(4)]
+            vocab_ids = {await client.register_vocab(VOCAB, eos_token_id=EOS) for client in clients}
+            self.assertEqual(len(vocab_ids), 1)  # the vocab is shared by every client
+            vocab_id = vocab_ids.pop()
+            # several sessions per connection, and more concurrent requests than the server takes
+            walks = [_random_walk(client, vocab_id, seed) for seed, client in enumerate(clients * 4)]
+            for text in await asyncio.gather(*walks):
+                self.assertTrue(_is_valid(text), text)
+            self.assertEqual(server.num_sessions, 0)
+            for client in clients:
+                await client.close()
+        self._run(test, max_pending=3)
+
+    def test_idle_sessions_are_evicted(self):
+        async def test(server, path):
+            client = await SidecarClient.connect(path)
+            vocab_id = await client.register_vocab(VOCAB, eos_token_id=EOS)
+            session = await client.create_session(vocab_id, {"type": "regex", "pattern": "(bob|al)+"})
+            self.assertEqual(len(await client.get_masks(session)), 1)
+            await asyncio.sleep(0.2)
+            self.assertEqual(server.num_sessions, 0)
+            with self.assertRaises(SidecarError):
+                await client.get_masks(session)
+            await client.close()
+        self._run(test, idle_timeout=0.05)
+
+    def test_errors(self):
+        async def test(server, path):
+            client = await SidecarClient.connect(path)
+            vocab_id = await client.register_vocab(VOCAB, eos_token_id=EOS)
+            with self.assertRaises(SidecarError):
+                await client.create_session(vocab_id, {"type": "xml"})
+            with self.assertRaises(SidecarError):
+                await client.request("train")
+            session = await client.create_session(vocab_id, {"type": "one_of", "match_strings": ["bob", "alice"]})
+            self.assertEqual(await client.update(session, [5]), [False])
+            with self.assertRaises(SidecarError) as context:
+                await client.create_session(vocab_id, {"type": "regex", "pattern": "a"})
+            self.assertTrue(context.exception.retry)  # session limit
+            with self.assertRaises(SidecarError) as context:
+                await client.update(session, [1])  # 'alname' isn't an option
+            self.assertFalse(context.exception.retry)
+            await client.close_session(session)
+            await client.create_session(vocab_id, {"type": "regex", "pattern": "a"})
+            await client.close()
+        self._run(test, max_sessions=1)
+
+    def test_concurrent_creates_respect_the_session_limit(self):
+        async def test(server, path):
+            clients = [await SidecarClient.connect(path) for _ in range(6)]
+            vocab_id = await clients[0].register_vocab(VOCAB, eos_token_id=EOS)
+            # every create passes the limit check before any of their handlers is built
+            creates = [client.create_session(vocab_id, {"type": "regex", "pattern": f"a{i}"}) for i, client in enumerate(clients)]
+            results = await asyncio.gather(*creates, return_exceptions=True)
+            self.assertEqual(len([result for result in results if isinstance(result, str)]), 2)
+            self.assertTrue(all(result.retry for result in results if isinstance(result, SidecarError)))
+            self.assertEqual(server.num_sessions, 2)
+            self.assertEqual(server._reserved_sessions, 0)
+            for client in clients:
+                await client.close()
+        self._run(test, max_sessions=2)
+
+    def test_vocabs_and_factories_are_bounded(self):
+        async def test(server, path):
+            client = await SidecarClient.connect(path)
+            vocab_ids = [await client.register_vocab(VOCAB[:size], eos_token_id=None) for size in [16, 17, 18]]
+            self.assertEqual(list(server._vocabs), vocab_ids[1:])
+            with self.assertRaises(SidecarError):
+                await client.create_session(vocab_ids[0], {"type": "regex", "pattern": "a"})
+            # sessions keep their vocab and constraint after they're dropped
+            session = await client.create_session(vocab_ids[1], {"type": "regex", "pattern": "(bob|al)+"})
+            for pattern in ["a", "b", "x"]:
+                await client.close_session(await client.create_session(vocab_ids[2], {"type": "regex", "pattern": pattern}))
+            self.assertEqual(len(server._factories), 2)
+            self.assertEqual(list(server._vocabs), vocab_ids[1:])
+            self.assertEqual(await client.update(session, [4]), [False])
+            self.assertEqual(await client.register_vocab(VOCAB[:16]), vocab_ids[0])
+            self.assertEqual(list(server._vocabs), vocab_ids[2:] + vocab_ids[:1])
+            await client.close()
+        self._run(test, max_vocabs=2, max_factories=2)
+
+    def test_mask_encoding(self):
+        rng = np.random.default_rng(0)
+        for p in [0.01, 0.5, 0.99]:
+            mask = rng.random(100) < p
+            encoded = json.loads(json.dumps(encode_mask(compact_mask(mask))))
+            self.assertTrue((decode_mask(encoded, 100).to_dense() == mask).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,17 @@ class TestStringMatchParser(unittest.TestCase):
     def test_match_nocase(self):
         parser = StringMatchParser("hello", nocase=True)
         parser._append("H")
+        copy = parser.copy()
+        self.assertEqual(copy.fingerprint(), parser.fingerprint())
+        copy.append("ELLO")
+        self.assertTrue(copy.is_complete())
+
+    def test_match_chunk(self):
+        parser = StringMatchParser("hello")
+        parser.append("hel")
+        self.assertEqual(parser._append_chunk("lo world", 0), (2, True))
+        with self.assertRaises(ParseFailure):
+            StringMatchParser("hello").append("help")
 
 
 class TestMultiStringMatchParser(unittest.TestCase):
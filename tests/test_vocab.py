@@ -0,0 +1,81 @@
+import pickle
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scs.vocab import VocabularyIndex, TOKEN_GROUPS
+from scs.handler import SyntaxValidityCheckHandler, JSONSchemaCheckFactory, RegexCheckFactory
+from scs.incremental_parse.json.parser import NoQuoteCharGroup, bounded_no_quote_char_group
+
+
+VOCAB = ['{"', 'key', '":', '"', 'a', 'b', 'ab', 'abc', '}', ',', ':', '12', None]
+
+
+class TestVocabularyIndex(unittest.TestCase):
+
+    def test_index(self):
+        index = VocabularyIndex(VOCAB)
+        self.assertEqual(len(index), len(VOCAB))
+        self.assertEqual(index[7], 'abc')
+        self.assertEqual(index.token_id('ab'), 6)
+        self.assertIsNone(index.token_id('zz'))
+        self.assertEqual(index.max_token_length, 3)
+        for group in TOKEN_GROUPS:
+            self.assertIs(index.split(group), index.split(group))
+        with self.assertRaises(ValueError):
+            index.split(NoQuoteCharGroup).filtered_mask[0] = True  # shared, so read-only
+
+    def test_bounded_split(self):
+        index = VocabularyIndex(VOCAB)
+        self.assertIs(index.split(bounded_no_quote_char_group(3)), index.split(NoQuoteCharGroup))
+        split = index.split(bounded_no_quote_char_group(1))
+        self.assertEqual([tok for _, tok in split.filtered], ['a', 'b', '}', ',', ':'])
+        self.assertIs(index.split(bounded_no_quote_char_group(1)), split)
+
+    def test_concurrent_splits(self):
+        index = VocabularyIndex(VOCAB)
+        groups = [bounded_no_quote_char_group(length) for length in [1, 2]] * 8
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            splits = list(executor.map(index.split, groups))
+        for group, split in zip(groups, splits):
+            self.assertIs(split, index.split(group))  # every thread got the same split
+
+    def test_pickle(self):
+        index = pickle.loads(pickle.dumps(VocabularyIndex(VOCAB)))
+        self.assertEqual(index.token_id('abc'), 7)
+        self.assertIsNotNone(index.split(bounded_no_quote_char_group(2)))
+
+    def test_handlers_share_index(self):
+        index = VocabularyIndex(VOCAB)
+        schema_handler = SyntaxValidityCheckHandler(index, JSONSchemaCheckFactory(schema="{ key: string }"))
+        regex_handler = SyntaxValidityCheckHandler(index, RegexCheckFactory(pattern=r"a+b"))
+        self.assertIs(schema_handler.vocab_index, index)
+        self.assertIs(regex_handler.vocab_index, index)
+        # handlers built from the index compute the same masks as from the vocab
+        walks = [(JSONSchemaCheckFactory(schema="{ key: string }"), [0, 1, 3, 10]), (RegexCheckFactory(pattern=r"a+b"), [4, 6])]
+        for factory, token_ids in walks:
+            from_vocab = SyntaxValidityCheckHandler(VOCAB, factory)
+            from_index = SyntaxValidityCheckHandler(index, factory)
+            for token_id in token_ids:
+                self.assertTrue(np.array_equal(from_vocab.invalid_next_token_masks(), from_index.invalid_next_token_masks()))
+                from_vocab.update([token_id])
+                from_index.update([token_id])
+
+    def test_concurrent_handlers(self):
+        index = VocabularyIndex(VOCAB)
+        token_ids = [0, 1, 3, 10, 3, 7, 7, 3, 8]  # {"key":"abcabc"}
+
+        def valid_steps(max_length: int) -> list:
+            handler = SyntaxValidityCheckHandler(index, JSONSchemaCheckFactory(schema=f"{{ key: string(..{max_length}) }}"))
+            steps = []
+            for token_id in token_ids:
+                steps += [not handler.invalid_next_token_masks()[0, token_id]]
+                if not steps[-1]:
+                    break
+                handler.update([token_id])
+            return steps
+
+        max_lengths = [2, 3, 4, 6] * 4
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(valid_steps, max_lengths))
+        self.assertEqual(results, [valid_steps(max_length) for max_length in max_lengths])
+        self.assertEqual(results[:4], [[True] * 5 + [False], [True] * 6 + [False], [True] * 6 + [False], [True] * 9])
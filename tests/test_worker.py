@@ -0,0 +1,46 @@
+import unittest
+from scs.worker import MaskWorker
+from scs.handler import SyntaxValidityCheckHandler, JSONSchemaCheckFactory, RegexCheckFactory
+from scs.incremental_parse import ParseFailure
+
+VOCAB = ['{"', 'name', '":', '"', 'bob', 'al', 'ice', '"}', '}', ':', ' ', 'x', '</s>']
+EOS = 12
+SCHEMA = "{ name: string }"
+
+
+class TestMaskWorker(unittest.TestCase):
+
+    def test_masks_match_handler(self):
+        handler = SyntaxValidityCheckHandler(VOCAB, JSONSchemaCheckFactory(schema=SCHEMA), eos_token_id=EOS)
+        steps = [[0, 0], [1, 1], [3, 3], [9, 9], [3, 3], [5, 7], [6, EOS], [7, EOS]]
+        with MaskWorker(VOCAB, JSONSchemaCheckFactory(schema=SCHEMA), max_batch_size=2, ring_size=2, eos_token_id=EOS) as worker:
+            masks = worker.invalid_next_token_masks()
+            self.assertTrue((masks == handler.invalid_next_token_masks()).all())
+            self.assertFalse(masks.flags.writeable)
+            finished = []
+            for step in steps:
+                worker.update(step, skip_rows=finished)
+                handler.update(step, skip_rows=finished)
+                finished += [row for row, token_id in enumerate(step) if token_id == EOS and row not in finished]
+                masks = worker.invalid_next_token_masks()
+                self.assertEqual(masks.shape, (2, len(VOCAB)))
+                for row in range(2):
+                    if row not in finished:
+                        self.assertTrue((masks[row] == handler.invalid_next_token_mask(row)).all(), (step, row))
+            self.assertEqual(worker.completed_checks(), [True, True])
+            self.assertEqual(worker.get_completions(), ["", ""])
+
+    def test_worker_errors_are_raised(self):
+        with MaskWorker(VOCAB, RegexCheckFactory(pattern=r"bob|al"), max_batch_size=1) as worker:
+            worker.update([4])
+            worker.update([4])  # 'bobbob' doesn't match
+            with self.assertRaises(ParseFailure):
+                worker.invalid_next_token_masks()
+        with MaskWorker(VOCAB, RegexCheckFactory(pattern=r"bob|al"), max_batch_size=1) as worker:
+            worker.update([4, 5])  # more rows than max_batch_size
+            with self.assertRaises(ValueError):
+                worker.invalid_next_token_masks()
+
+
+if __name__ == '__main__':
+    unittest.main()